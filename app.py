@@ -1,8 +1,14 @@
 import streamlit as st
-import folium
-from streamlit_folium import st_folium
-import requests
-from geopy.distance import geodesic
+import streamlit.components.v1 as components
+from geocoder import Geocoder
+from matrix_cache import cached_distance_matrix, get_cache
+import local_search
+from distance_utils import coords_to_arrays
+from location_set import LocationSet
+from spatial_index import nearest_neighbor_route
+from warm_start import reoptimize_route
+from result_cache import ResultCache, pack_routes, problem_fingerprint, unpack_routes
+import profiling
 
 # Configure page
 st.set_page_config(page_title="📍 Route Optimizer", layout="wide")
@@ -41,6 +47,15 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# Stage timings for this run (see profiling.py) when enabled in the sidebar;
+# a cProfile/tracemalloc capture applies to the one run after it is armed
+capture = st.session_state.pop("profile_capture_next", None)
+if st.session_state.get("profile_spans") or capture:
+    profiling.begin(memory=capture == "tracemalloc", profile=capture == "cProfile")
+else:
+    profiling.end()
+    st.session_state.pop("last_trace", None)
+
 # Header
 st.markdown("<h1 style='text-align: center; color: #1F4E79;'>📍 Jabalpur Route Optimizer</h1>", unsafe_allow_html=True)
 st.markdown("<h4 style='text-align: center; color: grey;'>Get the shortest route with just place names!</h4>", unsafe_allow_html=True)
@@ -50,7 +65,7 @@ st.sidebar.header("➕ Add Places")
 
 # Initialize session state
 if "places" not in st.session_state:
-    st.session_state["places"] = []
+    st.session_state["places"] = LocationSet()
 
 if "multi_places_input" not in st.session_state:
     st.session_state.multi_places_input = ""
@@ -58,49 +73,29 @@ if "multi_places_input" not in st.session_state:
 if "example_loaded" not in st.session_state:
     st.session_state.example_loaded = False
 
-# Enhanced geocoder with rate limiting and caching
-@st.cache_data(ttl=3600, show_spinner=False)
+# Geocoder with per-provider rate limiting and a persistent SQLite cache,
+# shared by every session of this server process
+@st.cache_resource(show_spinner=False)
+def get_geocoder():
+    return Geocoder()
+
+# Solved routes, distances and rendered maps by problem fingerprint, shared
+# by every session so a repeated stop list is answered without solving
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return ResultCache()
+
+def show_geocoding_errors(errors):
+    for error in errors[:3]:
+        st.sidebar.error(f"Geocoding error: {error}")
+
+@profiling.stage("get_lat_lon")
 def get_lat_lon(place):
-    # Try Nominatim first (free but requires attribution)
-    nominatim_url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        'q': place + ", Jabalpur",
-        'format': 'json',
-        'limit': 1,
-        'countrycodes': 'in'
-    }
-    headers = {'User-Agent': 'JabalpurRoutePlanner/1.0'}
-    
-    try:
-        response = requests.get(nominatim_url, params=params, headers=headers)
-        if response.ok:
-            data = response.json()
-            if data:
-                return float(data[0]['lat']), float(data[0]['lon'])
-        
-        # If Nominatim fails, try OpenCage as fallback
-        opencage_key = "32d1e78b3e2848999a5947c8894cfe31"  # Replace with your actual key
-        if opencage_key:
-            oc_url = "https://api.opencagedata.com/geocode/v1/json"
-            oc_params = {
-                'q': place + ", Jabalpur, India",
-                'key': opencage_key,
-                'limit': 1,
-                'no_annotations': 1
-            }
-            oc_response = requests.get(oc_url, params=oc_params)
-            if oc_response.ok:
-                results = oc_response.json().get("results", [])
-                if results:
-                    coords = results[0]["geometry"]
-                    return coords["lat"], coords["lng"]
-        
-        return None, None
-    
-    except Exception as e:
-        st.sidebar.error(f"Geocoding error: {str(e)}")
-        return None, None
-    
+    errors = []
+    latlon = get_geocoder().geocode(place, errors)
+    show_geocoding_errors(errors)
+    return latlon
+
 tab1, tab2 = st.sidebar.tabs(["Single Location", "Multiple Locations"])
 
 # Single location input
@@ -116,8 +111,7 @@ with tab1:
             
             if latlon[0] is not None:
                 # Check for duplicates
-                existing_places = [p[0].lower() for p in st.session_state["places"]]
-                if single_place.lower() not in existing_places:
+                if st.session_state["places"].find(single_place, ignore_case=True) is None:
                     st.session_state["places"].append((single_place, latlon))
                     st.success(f"✅ {single_place} added!")
                 else:
@@ -152,12 +146,14 @@ Russel Chowk"""
                 success_count = 0
                 
                 with st.spinner(f"Processing {len(places_list)} places..."):
-                    for place in places_list:
-                        latlon = get_lat_lon(place)
+                    # All lines are looked up concurrently; cached ones return at once
+                    errors = []
+                    all_latlon = get_geocoder().geocode_many(places_list, errors)
+                    show_geocoding_errors(errors)
+                    for place, latlon in zip(places_list, all_latlon):
                         if latlon[0] is not None:
                             # Check for duplicates
-                            existing_places = [p[0].lower() for p in st.session_state["places"]]
-                            if place.lower() not in existing_places:
+                            if st.session_state["places"].find(place, ignore_case=True) is None:
                                 st.session_state["places"].append((place, latlon))
                                 success_count += 1
                 
@@ -189,109 +185,140 @@ if st.session_state["places"]:
         
         # Add delete button for each place
         if col3.button("❌", key=f"del_{i}"):
-            del st.session_state["places"][i]
+            places = st.session_state["places"]
+            removed = places.pop(i)
+            # Free the stop's row/column unless the same point is still listed
+            lat, lon = removed[1]
+            if not ((places.lats == lat) & (places.lons == lon)).any():
+                get_cache().discard(removed[1])
             st.rerun()
 else:
     st.info("ℹ️ Add at least 2 places to begin route optimization")
 
-from geopy.distance import geodesic
-import itertools
-
-def total_distance(route, locations):
+def total_distance(route, distance_matrix):
     dist = 0
     for i in range(len(route) - 1):
-        dist += geodesic(locations[route[i]][1], locations[route[i+1]][1]).km
-    return dist
-
-def two_opt(route, locations):
-    best = route
-    improved = True
-    while improved:
-        improved = False
-        for i in range(1, len(route) - 2):
-            for j in range(i+1, len(route) - 1):
-                if j - i == 1: continue
-                new_route = route[:]
-                new_route[i:j] = reversed(route[i:j])
-                if total_distance(new_route, locations) < total_distance(best, locations):
-                    best = new_route
-                    improved = True
-        route = best
-    return best
-
-def solve_tsp(locations):
+        dist += distance_matrix[route[i]][route[i+1]]
+    return float(dist)
+
+def two_opt(route, distance_matrix):
+    # Edge-delta 2-opt over k-nearest neighbor lists with don't-look bits
+    return local_search.two_opt(route, distance_matrix)
+
+@profiling.stage("solve_tsp")
+def solve_tsp(locations, method="2-opt"):
     if len(locations) < 2:
         return []
+
+    # Only stops added since the last run get new matrix rows/columns
+    distance_matrix = cached_distance_matrix(locations)
     
-    # Greedy initial route
-    route = [0]
-    unvisited = set(range(1, len(locations)))
-    while unvisited:
-        last = route[-1]
-        nearest = min(unvisited, key=lambda x: geodesic(locations[last][1], locations[x][1]).km)
-        route.append(nearest)
-        unvisited.remove(nearest)
-    
-    route.append(0)  # Return to start
+    # Greedy initial route from the spatial index, returning to start
+    lats, lons = coords_to_arrays(locations)
+    route = nearest_neighbor_route(lats, lons, start=0, return_to_start=True)
 
-    # Improve route using 2-opt
-    optimized_route = two_opt(route, locations)
+    # Improve route using 2-opt, or the full Or-opt / 3-opt / LK engine
+    if method == "2-opt":
+        optimized_route = two_opt(route, distance_matrix)
+    else:
+        optimized_route = local_search.improve_route(route, distance_matrix)
     return optimized_route
 
+def build_route_map(route, locations):
+    # folium loads on the first map drawn, not on every cold start
+    import folium
+    # Get coordinates in route order
+    coords = locations.coords_at(route).tolist()
+    
+    # Create map centered on the first location
+    route_map = folium.Map(
+        location=coords[0],
+        zoom_start=13,
+        tiles="cartodbpositron"
+    )
+    
+    # Add polyline for the route
+    folium.PolyLine(
+        coords,
+        color="#1F4E79",
+        weight=5,
+        opacity=0.8,
+        tooltip="Optimized Route"
+    ).add_to(route_map)
+    
+    # Add markers with numbering
+    for idx, i in enumerate(route):
+        name, (lat, lon) = locations[i]
+        folium.Marker(
+            location=(lat, lon),
+            popup=f"<b>{idx + 1}. {name}</b>",
+            tooltip=f"{idx + 1}. {name}",
+            icon=folium.Icon(
+                color="green" if idx == 0 else "blue",
+                icon="info-sign" if idx == 0 else "map-marker",
+                prefix="fa"
+            )
+        ).add_to(route_map)
+    return route_map
+
+improvement_method = st.radio(
+    "Improvement method",
+    ["2-opt", "Or-opt + 3-opt + LK"],
+    horizontal=True,
+    key="improvement_method",
+    help="2-opt is quickest; the full engine usually finds a few percent shorter routes"
+)
+
 if st.button("📍 Optimize Route", type="primary", key="optimize_button"):
     if len(st.session_state["places"]) < 2:
         st.warning("Please add at least 2 places to optimize a route")
     else:
         with st.spinner("Calculating optimal route..."):
             locations = st.session_state["places"]
-            route = solve_tsp(locations)
-            st.session_state["route"] = route
+            key = problem_fingerprint("tsp", locations, method=improvement_method)
+            previous = st.session_state.get("route")
+            previous_places = st.session_state.get("route_places")
+
+            def optimize():
+                distance_matrix = cached_distance_matrix(locations)
+                if previous and previous_places and previous_places != locations:
+                    # Stops were edited: repair the last tour instead of starting over
+                    route = reoptimize_route(previous_places, unpack_routes(previous)[0],
+                                             locations, distance_matrix, method=improvement_method)
+                else:
+                    route = solve_tsp(locations, improvement_method)
+                # int32 stop order and leg total; the map is rendered on display
+                return {"route": pack_routes([route], distance_matrix)}
+
+            st.session_state["route_key"] = key
+            st.session_state["route"] = get_result_cache().get_or_compute(key, optimize)["route"]
+            # a view is enough: adding or removing places builds new columns
+            st.session_state["route_places"] = locations[:]
             st.session_state["optimized"] = True
             st.success("Route optimized successfully!")
 
 
 # Map display
 if "route" in st.session_state and "places" in st.session_state and st.session_state.get("optimized", False):
-    route = st.session_state["route"]
+    packed = st.session_state["route"]
     locations = st.session_state["places"]
     
-    if route and all(i < len(locations) for i in route):
-        # Get coordinates and names in route order
-        coords = [locations[i][1] for i in route]
-        names = [locations[i][0] for i in route]
-        
-        # Calculate total distance
-        total_km = sum(geodesic(coords[i], coords[i+1]).km for i in range(len(coords)-1))
+    if len(packed["nodes"]) and packed["nodes"].max() < len(locations):
+        route = unpack_routes(packed)[0]
+        cache = get_result_cache()
+        key = st.session_state.get("route_key")
+        if st.session_state.get("route_places") != locations:
+            # Stops changed since the last solve: the old result no longer applies
+            key = problem_fingerprint("tsp", locations, route=route)
+        if key not in cache:
+            cache.put(key, {"route": packed})
         
-        # Create map centered on the first location
-        route_map = folium.Map(
-            location=coords[0],
-            zoom_start=13,
-            tiles="cartodbpositron"
-        )
-        
-        # Add polyline for the route
-        folium.PolyLine(
-            coords,
-            color="#1F4E79",
-            weight=5,
-            opacity=0.8,
-            tooltip="Optimized Route"
-        ).add_to(route_map)
-        
-        # Add markers with numbering
-        for idx, i in enumerate(route):
-            name, (lat, lon) = locations[i]
-            folium.Marker(
-                location=(lat, lon),
-                popup=f"<b>{idx + 1}. {name}</b>",
-                tooltip=f"{idx + 1}. {name}",
-                icon=folium.Icon(
-                    color="green" if idx == 0 else "blue",
-                    icon="info-sign" if idx == 0 else "map-marker",
-                    prefix="fa"
-                )
-            ).add_to(route_map)
+        # The map is rendered once per solved problem and kept only in the
+        # shared cache, never in the session
+        total_km = float(packed["km"].sum())
+        with profiling.span("render_map"):
+            map_html = cache.field(key, "map_html",
+                                   lambda: build_route_map(route, locations).get_root().render())
         
         # Display route info
         st.subheader("🗺️ Optimized Route")
@@ -305,20 +332,31 @@ if "route" in st.session_state and "places" in st.session_state and st.session_s
         st.metric("Total Distance", f"{total_km:.2f} km")
         
         # Show the map
-        st_folium(route_map, width=1200, height=600, returned_objects=[])
+        components.html(map_html, width=1200, height=600)
     else:
         st.error("Invalid route generated. Please try optimizing again.")
 
 # Clear all button
 if st.sidebar.button("🧹 Clear All", type="secondary", key="clear_all_button"):
-    st.session_state["places"] = []
+    st.session_state["places"] = LocationSet()
     st.session_state.pop("route", None)
+    st.session_state.pop("route_places", None)
+    st.session_state.pop("route_key", None)
     st.session_state.pop("optimized", None)
     st.session_state.multi_places_input = ""
     st.session_state.example_loaded = False
     st.sidebar.success("All places cleared!")
     st.rerun()
 
+with st.sidebar.expander("⏱️ Profiling"):
+    st.checkbox("Record stage timings", key="profile_spans",
+                help="Wall time, call counts and peak memory per stage, shown below the results")
+    capture_mode = st.radio("Deep capture", ["cProfile", "tracemalloc"], horizontal=True,
+                            key="profile_capture_mode")
+    if st.button("Capture next run", key="profile_capture_button"):
+        st.session_state["profile_capture_next"] = capture_mode
+        st.info(f"{capture_mode} will record the next run")
+
 # Add attribution and instructions
 st.sidebar.markdown("---")
 st.sidebar.markdown("**Instructions:**")
@@ -329,3 +367,15 @@ st.sidebar.markdown("---")
 st.sidebar.markdown("© 2023 Jabalpur Route Optimizer")
 st.sidebar.markdown("*Uses OpenStreetMap and OpenCage data*")
 
+# Stage timings of this run
+trace = profiling.end()
+if trace is not None:
+    st.session_state["last_trace"] = trace.to_dict()
+if st.session_state.get("last_trace"):
+    report = st.session_state["last_trace"]
+    with st.expander("⏱️ Stage timings"):
+        st.json({key: report[key] for key in ("seconds", "stages", "counters")})
+        if "profile" in report:
+            st.code(report["profile"])
+        if "allocations" in report:
+            st.code("\n".join(report["allocations"]))
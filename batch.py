@@ -0,0 +1,347 @@
+"""Headless batch routing.
+
+    python batch.py jobs.jsonl > results.jsonl
+    python batch.py day1.csv day2.csv --maps maps/ --workers 8
+
+Jobs are read lazily and solved in a process pool; one JSON line per job
+is written as soon as it finishes (in completion order, with the input
+``index``), so memory stays bounded however long the batch is. No browser
+is opened; maps are only written with --maps.
+
+CSV files use the tsp_route_info.csv layout (Stop #, Location, Latitude,
+Longitude). An optional Job column splits a file into several jobs
+(consecutive rows with the same value), otherwise each file is one job;
+an optional Demand column makes them CVRP jobs when --capacity and
+--vehicles are given. The first stop is the start / depot.
+
+JSONL lines are objects like
+    {"id": "north", "stops": [["Depot", 23.16, 79.92], ["A", 23.18, 79.95, 4]],
+     "capacity": 50, "vehicles": 3, "return_to_start": true, "solver": "auto"}
+where stops are [name, lat, lon(, demand)] lists or {"name", "lat", "lon",
+"demand"} objects; with capacity and vehicles the job is a CVRP.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import profiling
+from candidate_graph import compute_candidate_graph
+from cvrp_solver import solve_cvrp, solve_cvrp_sparse, split_tour
+from distance_utils import compute_distance_matrix, coords_to_arrays, route_leg_distances
+from held_karp import EXACT_MAX_STOPS
+from local_search import tour_length
+from location_set import LocationSet
+from map_visualizer import plot_route, plot_routes
+from savings import solve_cvrp_savings
+from spatial_index import nearest_neighbor_route
+from tsp_solver import (default_time_limit, solve_tsp, solve_tsp_greedy, solve_tsp_local,
+                        solve_tsp_sparse)
+
+SOLVERS = ("auto", "greedy", "local", "ortools")
+# above this many stops jobs are solved on a k-nearest-neighbour candidate
+# graph instead of a dense matrix
+DENSE_MAX_STOPS = 2000
+# jobs submitted ahead of the results written, per worker
+PENDING_PER_WORKER = 2
+# a job in flight when this many pools died under it is reported as an error
+MAX_ATTEMPTS = 3
+# OR-Tools searches end after this long without a better solution
+NO_IMPROVEMENT_SECONDS = 2
+
+
+def _stop(raw):
+    if isinstance(raw, dict):
+        name, lat, lon, demand = raw.get("name", ""), raw["lat"], raw["lon"], raw.get("demand")
+    else:
+        name, lat, lon, demand = (list(raw) + [None])[:4]
+    return (str(name), (float(lat), float(lon))), demand
+
+
+def _job(index, job_id, locations, demands=None, **options):
+    return {"index": index, "id": job_id, "locations": locations, "demands": demands, **options}
+
+
+def parse_job(data, index, default_id):
+    """Job dict from one JSONL line or service request body (see module
+    doc); raises ValueError, KeyError or TypeError when malformed."""
+    stops = [_stop(raw) for raw in data["stops"]]
+    demands = data.get("demands") or (
+        [int(d or 0) for _, d in stops] if any(d is not None for _, d in stops) else None)
+    if demands is not None and (
+            not isinstance(demands, list) or len(demands) != len(stops)
+            or not all(isinstance(d, int) and not isinstance(d, bool) for d in demands)):
+        raise ValueError("demands must be a list of integers, one per stop")
+    locations = LocationSet.from_locations(location for location, _ in stops)
+    return _job(index, data.get("id", default_id), locations, demands,
+                capacity=data.get("capacity"), vehicles=data.get("vehicles"),
+                depot=data.get("depot", 0), return_to_start=data.get("return_to_start", True),
+                solver=data.get("solver"), time_limit=data.get("time_limit"))
+
+
+def read_jsonl(path, start=0):
+    """Jobs from a JSONL file, one per non-empty line; unreadable lines
+    come back as error results so the rest of the batch still runs."""
+    with open(path) as f:
+        index = start
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            line_id = f"{os.path.basename(path)}:{number}"
+            try:
+                yield parse_job(json.loads(line), index, line_id)
+            except (ValueError, KeyError, TypeError, IndexError) as e:
+                yield {"index": index, "id": line_id, "status": "error", "error": f"bad job line: {e!r}"}
+            index += 1
+
+
+def read_csv(path, start=0):
+    """Jobs from a CSV in the tsp_route_info.csv layout (see module doc)."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with open(path, newline="") as f:
+        rows = csv.DictReader(f)
+        index = start
+        for job_id, group in itertools.groupby(rows, key=lambda row: row.get("Job") or stem):
+            try:
+                locations, demands = [], []
+                for row in group:
+                    locations.append((row["Location"], (float(row["Latitude"]), float(row["Longitude"]))))
+                    if row.get("Demand") not in (None, ""):
+                        demands.append(int(row["Demand"]))
+                yield _job(index, job_id, LocationSet.from_locations(locations),
+                           demands if len(demands) == len(locations) else None)
+            except (ValueError, KeyError, TypeError) as e:
+                yield {"index": index, "id": job_id, "status": "error", "error": f"bad CSV rows: {e!r}"}
+            index += 1
+
+
+def read_jobs(paths, fmt=None):
+    # every job of every file, in order, read lazily
+    index = 0
+    for path in paths:
+        kind = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        reader = read_csv if kind == "csv" else read_jsonl
+        for job in reader(path, index):
+            index = job["index"] + 1
+            yield job
+
+
+def _map_path(maps_dir, job):
+    return os.path.join(maps_dir, re.sub(r"[^\w.-]", "_", str(job["id"])) + ".html")
+
+
+def _solve_tsp(job, solver, method):
+    locations, back = job["locations"], job.get("return_to_start", True)
+    n = len(locations)
+    if solver == "greedy":
+        return solve_tsp_greedy(locations, back)
+    if n > DENSE_MAX_STOPS:
+        graph = compute_candidate_graph(locations, method=method)
+        time_limit = (job.get("time_limit") or 5) if solver == "ortools" else 0
+        return solve_tsp_sparse(graph, back, time_limit=time_limit,
+                                no_improvement_seconds=NO_IMPROVEMENT_SECONDS,
+                                deadline=job.get("deadline") if time_limit else None)
+    matrix = compute_distance_matrix(locations, method)
+    if solver == "ortools" or n <= EXACT_MAX_STOPS:
+        route, _ = solve_tsp(matrix, back, time_limit=job.get("time_limit"), deadline=job.get("deadline"),
+                             no_improvement_seconds=NO_IMPROVEMENT_SECONDS)
+    else:
+        route, _ = solve_tsp_local(matrix, back)
+    return route, None if route is None else round(tour_length(route, matrix), 2)
+
+
+def _solve_cvrp(job, solver, method):
+    locations, demands = job["locations"], job["demands"]
+    capacity, vehicles, depot = job["capacity"], job["vehicles"], job.get("depot", 0)
+    time_limit = job.get("time_limit") or default_time_limit(len(locations))
+    if solver == "greedy":
+        # nearest-neighbour tour cut wherever the next stop would not fit
+        lats, lons = coords_to_arrays(locations)
+        routes = split_tour(nearest_neighbor_route(lats, lons, depot, False), demands, capacity, depot)
+        if len(routes) > vehicles:
+            return None, None
+        total = sum(route_leg_distances(lats, lons, route, method).sum() for route in routes)
+        return routes, round(float(total), 2)
+    if len(locations) > DENSE_MAX_STOPS:
+        graph = compute_candidate_graph(locations, method=method, depot=depot)
+        routes = solve_cvrp_sparse(graph, demands, capacity, vehicles, depot, time_limit=time_limit,
+                                   deadline=job.get("deadline"),
+                                   no_improvement_seconds=NO_IMPROVEMENT_SECONDS)
+        if routes is None:
+            return None, None
+        return routes, round(sum(graph.route_length(route) for route in routes), 2)
+
+    matrix = compute_distance_matrix(locations, method)
+    if solver == "local":
+        routes = solve_cvrp_savings(matrix, demands, capacity, vehicles, depot)
+    else:
+        routes = solve_cvrp(matrix, demands, capacity, vehicles, depot, time_limit=time_limit,
+                            deadline=job.get("deadline"), savings_start=True,
+                            no_improvement_seconds=NO_IMPROVEMENT_SECONDS)
+    if routes is None:
+        return None, None
+    return routes, round(sum(tour_length(route, matrix) for route in routes), 2)
+
+
+def solve_job(job, solver="auto", method="ellipsoidal", maps_dir=None, profile=False):
+    """Solve one job and return its result record; never raises."""
+    result = {"index": job["index"], "id": job["id"], "stops": len(job["locations"])}
+    start = time.perf_counter()
+    cvrp = job.get("capacity") is not None and job.get("vehicles") is not None
+    solver = job.get("solver") or solver
+    try:
+        if solver not in SOLVERS:
+            raise ValueError(f"unknown solver {solver!r} (expected one of {SOLVERS})")
+        if len(job["locations"]) < 2:
+            raise ValueError("a job needs at least 2 stops")
+        if cvrp and (job.get("demands") is None or len(job["demands"]) != len(job["locations"])):
+            raise ValueError("CVRP jobs need one demand per stop")
+        with profiling.trace() if profile else profiling.trace_from_env() as trace:
+            if cvrp:
+                routes, total = _solve_cvrp(job, solver, method)
+                result.update(kind="cvrp", routes=routes)
+            else:
+                route, total = _solve_tsp(job, solver, method)
+                result.update(kind="tsp", route=route)
+            if total is not None and maps_dir:
+                if cvrp:
+                    result["map"] = plot_routes(job["locations"], routes, total, _map_path(maps_dir, job))
+                else:
+                    result["map"] = plot_route(job["locations"], route, total, filename=_map_path(maps_dir, job),
+                                               open_browser=False)
+        result.update(status="ok" if total is not None else "infeasible", distance_km=total)
+        if trace is not None:
+            result["profile"] = trace.to_dict()
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def run_batch(jobs, write, workers=None, solver="auto", method="ellipsoidal", maps_dir=None,
+              profile=False):
+    """Solve ``jobs`` and call ``write(result)`` for each as it finishes.
+
+    At most PENDING_PER_WORKER jobs per worker are in flight, so input is
+    only read as fast as results go out. Returns the count per status.
+    """
+    workers = workers or os.cpu_count() or 1
+    counts = {}
+
+    def emit(result):
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        write(result)
+
+    options = (solver, method, maps_dir, profile)
+    if workers == 1:
+        for job in jobs:
+            emit(job if "status" in job else solve_job(job, *options))
+        return counts
+
+    pool = ProcessPoolExecutor(workers)
+    pending = {}
+    attempts = {}
+
+    def submit(job):
+        try:
+            pending[pool.submit(solve_job, job, *options)] = job
+        except BrokenProcessPool:
+            restart([job])
+
+    def restart(lost):
+        # a worker died (out of memory, killed) and took the pool with it:
+        # every job still in flight failed, so retry them on a fresh pool
+        nonlocal pool
+        pool.shutdown(wait=False, cancel_futures=True)
+        pool = ProcessPoolExecutor(workers)
+        lost = lost + list(pending.values())
+        pending.clear()
+        for job in lost:
+            attempts[job["index"]] = attempts.get(job["index"], 0) + 1
+            if attempts[job["index"]] >= MAX_ATTEMPTS:
+                emit({"index": job["index"], "id": job["id"], "status": "error",
+                      "error": f"worker died {MAX_ATTEMPTS} times while this job was running"})
+            else:
+                submit(job)
+
+    def drain(futures):
+        lost = []
+        for future in futures:
+            job = pending.pop(future)
+            try:
+                emit(future.result())
+            except BrokenProcessPool:
+                lost.append(job)
+            except Exception as e:
+                emit({"index": job["index"], "id": job["id"], "status": "error",
+                      "error": f"{type(e).__name__}: {e}"})
+        if lost:
+            restart(lost)
+
+    try:
+        for job in jobs:
+            if "status" in job:
+                emit(job)
+                continue
+            submit(job)
+            while len(pending) >= workers * PENDING_PER_WORKER:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                drain(done)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            drain(done)
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve route jobs from CSV/JSONL files without a UI.")
+    parser.add_argument("inputs", nargs="+", help="CSV or JSONL job files")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="default: by file extension")
+    parser.add_argument("--output", "-o", help="JSONL results file (default: stdout)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--solver", choices=SOLVERS, default="auto")
+    parser.add_argument("--method", default="ellipsoidal", help="distance method")
+    parser.add_argument("--capacity", type=int, help="vehicle capacity for CSV jobs with a Demand column")
+    parser.add_argument("--vehicles", type=int, help="vehicle count for CSV jobs with a Demand column")
+    parser.add_argument("--time-limit", type=float, help="OR-Tools seconds per job")
+    parser.add_argument("--maps", help="directory to write one HTML map per job")
+    parser.add_argument("--profile", action="store_true", help="add per-stage timings to each result")
+    args = parser.parse_args(argv)
+
+    if args.maps:
+        os.makedirs(args.maps, exist_ok=True)
+
+    def jobs():
+        for job in read_jobs(args.inputs, args.format):
+            if "status" not in job:
+                if job.get("capacity") is None and job.get("demands") is not None:
+                    job["capacity"], job["vehicles"] = args.capacity, args.vehicles
+                if job.get("time_limit") is None:
+                    job["time_limit"] = args.time_limit
+            yield job
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        def write(result):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+        counts = run_batch(jobs(), write, args.workers, args.solver, args.method, args.maps, args.profile)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    summary = ", ".join(f"{status} {n}" for status, n in sorted(counts.items()))
+    print(f"{sum(counts.values())} jobs in {time.perf_counter() - start:.1f}s: {summary}", file=sys.stderr)
+    return 0 if set(counts) <= {"ok"} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
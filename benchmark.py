@@ -0,0 +1,434 @@
+"""Latency and route-quality benchmarks.
+
+    python benchmark.py                        # synthetic Jabalpur, 10 .. 50k stops
+    python benchmark.py --quick                # up to 500 stops
+    python benchmark.py --instance kroA100.tsp --instance X-n101-k25.vrp
+    python benchmark.py --save baseline.json   # machine-readable baseline
+    python benchmark.py --compare baseline.json
+    python benchmark.py --imports              # cold import time per entry point
+
+The report is printed and written to bench_output.txt. --compare exits
+with status 1 when a function got slower or its routes got longer than
+in the baseline, or an entry point imports slower or loads a heavy
+dependency it did not load before.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from cvrp_solver import solve_cvrp
+from distance_utils import compute_distance_matrix
+from local_search import tour_length, two_opt
+from sample_input import locations as sample_locations
+from tsp_solver import solve_tsp, solve_tsp_greedy
+
+# Jabalpur bounding box, covering every sample and predefined place
+LAT_RANGE = (23.08, 23.26)
+LON_RANGE = (79.84, 80.07)
+DEFAULT_SIZES = (10, 50, 100, 500, 1000, 5000, 10000, 50000)
+QUICK_SIZES = (10, 50, 100, 500)
+VEHICLE_CAPACITY = 100
+# largest instance each function runs on: the matrix-based ones stop where
+# the n x n matrix gets big, the OR-Tools ones where the time limit rules
+LIMITS = {
+    "compute_distance_matrix": 5000,
+    "solve_tsp_greedy": None,
+    "two_opt": 5000,
+    "solve_tsp": 1000,
+    "solve_cvrp": 500,
+}
+FUNCTIONS = tuple(LIMITS)
+SOLVER_SECONDS = 2
+# fast functions are timed this many times and the best run kept
+REPEAT = 3
+REPEAT_MAX_STOPS = 1000
+# a result regresses when it is slower by this factor (beyond timer noise)
+# or its route is longer by this share
+TIME_TOLERANCE = 1.25
+TIME_NOISE = 0.005
+LENGTH_TOLERANCE = 0.005
+OUTPUT_PATH = "bench_output.txt"
+# entry points whose cold import is timed, each in a fresh interpreter
+IMPORT_MODULES = ("greedy", "route_optimizer", "batch", "routing_service", "tsp_solver",
+                  "cvrp_solver", "distance_utils", "map_visualizer")
+# dependencies that should only load when a solve or map needs them
+HEAVY_MODULES = ("ortools", "folium", "geopy", "scipy", "webbrowser", "requests")
+IMPORT_NOISE = 0.02
+
+
+def synthetic_instance(num_stops, seed=0, vehicle_capacity=VEHICLE_CAPACITY):
+    """Stops in the Jabalpur bounding box: half scattered around the sample
+    places like neighbourhoods, half uniform. Stop 0 is the depot."""
+    rng = np.random.default_rng(seed)
+    centres = np.array([coords for _, coords in sample_locations])
+    clustered = num_stops // 2
+    points = np.vstack([
+        np.column_stack([rng.uniform(*LAT_RANGE, num_stops - clustered),
+                         rng.uniform(*LON_RANGE, num_stops - clustered)]),
+        centres[rng.integers(len(centres), size=clustered)]
+        + rng.normal(scale=0.01, size=(clustered, 2)),
+    ])
+    points[:, 0] = points[:, 0].clip(*LAT_RANGE)
+    points[:, 1] = points[:, 1].clip(*LON_RANGE)
+    points[0] = centres[0]
+    demands = [0] + rng.integers(1, 11, num_stops - 1).tolist()
+    return {
+        "name": f"jabalpur-{num_stops}",
+        "kind": "both",
+        "locations": [(f"Stop {i}", (float(lat), float(lon))) for i, (lat, lon) in enumerate(points)],
+        "demands": demands,
+        "capacity": vehicle_capacity,
+        "vehicles": math.ceil(1.2 * sum(demands) / vehicle_capacity) + 1,
+        "depot": 0,
+        "matrix": None,
+        "optimum": None,
+    }
+
+
+def _read_sections(path):
+    # header fields and the rows of every *_SECTION of a TSPLIB-format file
+    header, sections, section = {}, {}, None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line == "EOF":
+                continue
+            if ":" in line:
+                key, _, value = line.partition(":")
+                header[key.strip().upper()] = value.strip()
+                section = None
+            elif line.upper().endswith("_SECTION"):
+                section = line.upper()
+                sections[section] = []
+            elif section is not None:
+                sections[section].append(line.split())
+    return header, sections
+
+
+def tsplib_matrix(coords, edge_weight_type):
+    """Integer distances as TSPLIB defines them for EUC_2D, CEIL_2D, ATT
+    and GEO instances."""
+    xy = np.asarray(coords, dtype=np.float64)
+    if edge_weight_type == "GEO":
+        degrees = np.trunc(xy)
+        rad = math.pi * (degrees + 5.0 * (xy - degrees) / 3.0) / 180.0
+        lat, lon = rad[:, 0], rad[:, 1]
+        q1 = np.cos(lon[:, None] - lon[None, :])
+        q2 = np.cos(lat[:, None] - lat[None, :])
+        q3 = np.cos(lat[:, None] + lat[None, :])
+        cos = np.clip(0.5 * ((1.0 + q1) * q2 - (1.0 - q1) * q3), -1.0, 1.0)
+        matrix = np.floor(6378.388 * np.arccos(cos) + 1.0)
+    else:
+        squared = ((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2)
+        if edge_weight_type == "EUC_2D":
+            matrix = np.floor(np.sqrt(squared) + 0.5)
+        elif edge_weight_type == "CEIL_2D":
+            matrix = np.ceil(np.sqrt(squared))
+        elif edge_weight_type == "ATT":
+            r = np.sqrt(squared / 10.0)
+            matrix = np.floor(r + 0.5)
+            matrix += matrix < r
+        else:
+            raise ValueError(f"EDGE_WEIGHT_TYPE {edge_weight_type} is not supported")
+    np.fill_diagonal(matrix, 0.0)
+    return matrix
+
+
+def _known_optimum(path, matrix):
+    # optimal tour length from name.opt.tour (TSPLIB) or the cost in
+    # name.sol (CVRPLIB), if either sits next to the instance
+    stem = os.path.splitext(path)[0]
+    if os.path.exists(stem + ".opt.tour"):
+        _, sections = _read_sections(stem + ".opt.tour")
+        tour = [int(row[0]) - 1 for row in sections.get("TOUR_SECTION", []) if int(row[0]) > 0]
+        return tour_length(tour + tour[:1], matrix) if tour else None
+    if os.path.exists(stem + ".sol"):
+        with open(stem + ".sol") as f:
+            for line in f:
+                if line.lower().startswith("cost"):
+                    return float(line.split()[1])
+    return None
+
+
+def load_tsplib(path):
+    """TSPLIB (.tsp) or CVRPLIB (.vrp) instance with node coordinates.
+
+    Distances follow the file's EDGE_WEIGHT_TYPE, so route lengths are
+    comparable with published optima; those are read from a .opt.tour or
+    .sol file of the same name when present.
+    """
+    header, sections = _read_sections(path)
+    rows = sections.get("NODE_COORD_SECTION")
+    if not rows:
+        raise ValueError(f"{path}: only instances with a NODE_COORD_SECTION are supported")
+    ids = [int(row[0]) for row in rows]
+    index = {node: i for i, node in enumerate(ids)}
+    coords = [(float(row[1]), float(row[2])) for row in rows]
+    matrix = tsplib_matrix(coords, header.get("EDGE_WEIGHT_TYPE", "EUC_2D").upper())
+    name = header.get("NAME", os.path.basename(path))
+    instance = {
+        "name": name,
+        "kind": "tsp",
+        "locations": [(str(node), xy) for node, xy in zip(ids, coords)],
+        "demands": None,
+        "capacity": None,
+        "vehicles": None,
+        "depot": 0,
+        "matrix": matrix,
+    }
+    if "CVRP" in header.get("TYPE", "").upper() or "DEMAND_SECTION" in sections:
+        demands = [0] * len(ids)
+        for row in sections.get("DEMAND_SECTION", []):
+            demands[index[int(row[0])]] = int(row[1])
+        depots = [int(row[0]) for row in sections.get("DEPOT_SECTION", []) if int(row[0]) > 0]
+        capacity = int(header["CAPACITY"])
+        # CVRPLIB names end in -k<minimum fleet>; the fleet itself is free
+        match = re.search(r"-k(\d+)", name)
+        fleet = int(header.get("VEHICLES", match.group(1) if match else 0)) or \
+            math.ceil(sum(demands) / capacity)
+        instance.update(kind="cvrp", demands=demands, capacity=capacity,
+                        vehicles=math.ceil(1.1 * fleet) + 1,
+                        depot=index[depots[0]] if depots else 0)
+    instance["optimum"] = _known_optimum(path, matrix)
+    return instance
+
+
+def _timed(fn, repeat=1):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def import_time(module, repeat=REPEAT):
+    """Best cold import of ``module`` over fresh interpreters, with the
+    heavy dependencies it loaded and its slowest direct imports."""
+    probe = (f"import sys, {module}; "
+             f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        # "import time: self [us] | cumulative | imported package", nested
+        # imports indented two more spaces than their importer
+        rows = []
+        for line in out.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[1].strip().isdigit():
+                rows.append((parts[2].rstrip(), int(parts[1]) / 1e6))
+        end = next(i for i, (name, _) in enumerate(rows) if name.strip() == module)
+        seconds = rows[end][1]
+        if best is None or seconds < best["seconds"]:
+            # an import's own imports are the rows printed just before it
+            start = end
+            while start > 0 and len(rows[start - 1][0]) - len(rows[start - 1][0].lstrip()) > 1:
+                start -= 1
+            children = sorted(((s, name.strip()) for name, s in rows[start:end]
+                               if len(name) - len(name.lstrip()) == 3), reverse=True)
+            best = {"module": module, "seconds": round(seconds, 4),
+                    "heavy": [m for m in out.stdout.strip().split(",") if m],
+                    "slowest": [f"{name} {1000 * s:.0f}ms" for s, name in children[:3]]}
+    return best
+
+
+def format_import(r):
+    heavy = ", ".join(r["heavy"]) or "-"
+    return f"{r['module']:<22}{1000 * r['seconds']:>9.1f}ms  heavy: {heavy:<20}{'  '.join(r['slowest'])}"
+
+
+def _routes_length(routes, matrix):
+    return sum(tour_length(route, matrix) for route in routes)
+
+
+def run_instance(instance, functions=FUNCTIONS, solver_seconds=SOLVER_SECONDS):
+    """Time every applicable function on one instance.
+
+    Returns result dicts with the seconds taken, the route length and the
+    gap to the known optimum, or else to the best route of the same kind
+    found in this run.
+    """
+    locations, n = instance["locations"], len(instance["locations"])
+    repeat = REPEAT if n <= REPEAT_MAX_STOPS else 1
+    results = []
+
+    def wanted(name):
+        limit = LIMITS[name]
+        return name in functions and (limit is None or n <= limit)
+
+    def record(name, kind, seconds, length=None):
+        results.append({"instance": instance["name"], "stops": n, "function": name,
+                        "kind": kind, "seconds": round(seconds, 6),
+                        "length": None if length is None else round(float(length), 3)})
+
+    matrix = instance["matrix"]
+    if matrix is None and n <= LIMITS["compute_distance_matrix"]:
+        seconds, matrix = _timed(lambda: compute_distance_matrix(locations), repeat)
+        if wanted("compute_distance_matrix"):
+            record("compute_distance_matrix", None, seconds)
+        matrix = np.asarray(matrix, dtype=np.float64)
+
+    if instance["kind"] in ("tsp", "both"):
+        if "solve_tsp_greedy" in functions or (matrix is not None and wanted("two_opt")):
+            # the apps seed from the grid index; TSPLIB metrics need the matrix
+            seconds, (seed, total) = _timed(
+                lambda: solve_tsp_greedy(locations, distance_matrix=instance["matrix"]), repeat)
+            if wanted("solve_tsp_greedy"):
+                record("solve_tsp_greedy", "tsp", seconds,
+                       total if matrix is None else tour_length(seed, matrix))
+            if matrix is not None and wanted("two_opt"):
+                # app.two_opt is a thin wrapper; importing app would start the UI
+                seconds, route = _timed(lambda: two_opt(list(seed), matrix), repeat)
+                record("two_opt", "tsp", seconds, tour_length(route, matrix))
+        if matrix is not None and wanted("solve_tsp"):
+            seconds, (route, _) = _timed(lambda: solve_tsp(matrix, time_limit=solver_seconds))
+            if route is not None:
+                record("solve_tsp", "tsp", seconds, tour_length(route, matrix))
+
+    if instance["kind"] in ("cvrp", "both") and matrix is not None and wanted("solve_cvrp"):
+        seconds, routes = _timed(lambda: solve_cvrp(
+            matrix, instance["demands"], instance["capacity"], instance["vehicles"],
+            instance["depot"], time_limit=solver_seconds))
+        if routes is not None:
+            record("solve_cvrp", "cvrp", seconds, _routes_length(routes, matrix))
+
+    for kind in ("tsp", "cvrp"):
+        lengths = [r["length"] for r in results if r["kind"] == kind]
+        if not lengths:
+            continue
+        # synthetic instances have no known optimum in either mode; a TSPLIB
+        # optimum belongs to the instance's own problem type
+        optimum = instance["optimum"] if instance["kind"] == kind else None
+        reference = optimum or min(lengths)
+        for r in results:
+            if r["kind"] == kind:
+                r["gap"] = round(r["length"] / reference - 1.0, 6) if reference else None
+                r["reference"] = "optimum" if optimum else "best_in_run"
+    return results
+
+
+def _commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(instances, functions=FUNCTIONS, solver_seconds=SOLVER_SECONDS, log=print):
+    """Benchmark ``instances`` and return the baseline document."""
+    results = []
+    for instance in instances:
+        for result in run_instance(instance, functions, solver_seconds):
+            log(format_result(result))
+            results.append(result)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "solver_seconds": solver_seconds,
+        "results": results,
+    }
+
+
+def format_result(r):
+    length = "" if r["length"] is None else f"{r['length']:14.3f}"
+    gap = f"{100 * r['gap']:+8.2f}%" if r.get("gap") is not None else ""
+    return f"{r['instance']:<22}{r['stops']:>7}  {r['function']:<24}{r['seconds']:>11.4f}s{length:>15}{gap:>10}"
+
+
+def compare(report, baseline):
+    """Regressions of ``report`` against ``baseline``, as readable lines."""
+    previous = {(r["instance"], r["function"]): r for r in baseline["results"]}
+    problems = []
+    imports = {r["module"]: r for r in baseline.get("imports", [])}
+    for r in report.get("imports", []):
+        old = imports.get(r["module"])
+        if old is None:
+            continue
+        if r["seconds"] > old["seconds"] * TIME_TOLERANCE + IMPORT_NOISE:
+            problems.append(f"import {r['module']}: {old['seconds']:.4f}s -> {r['seconds']:.4f}s")
+        for module in sorted(set(r["heavy"]) - set(old["heavy"])):
+            problems.append(f"import {r['module']} now loads {module}")
+    for r in report["results"]:
+        old = previous.get((r["instance"], r["function"]))
+        if old is None:
+            continue
+        if r["seconds"] > old["seconds"] * TIME_TOLERANCE + TIME_NOISE:
+            problems.append(f"{r['instance']} {r['function']}: {old['seconds']:.4f}s -> {r['seconds']:.4f}s")
+        if r["length"] is not None and old.get("length") and \
+                r["length"] > old["length"] * (1 + LENGTH_TOLERANCE):
+            problems.append(f"{r['instance']} {r['function']}: length {old['length']} -> {r['length']}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time distance, construction, improvement and OR-Tools solves.")
+    parser.add_argument("--sizes", type=int, nargs="+", help="synthetic instance sizes")
+    parser.add_argument("--quick", action="store_true", help=f"sizes {QUICK_SIZES}")
+    parser.add_argument("--instance", action="append", default=[],
+                        help="TSPLIB .tsp or CVRPLIB .vrp file (repeatable)")
+    parser.add_argument("--functions", nargs="+", choices=FUNCTIONS, default=list(FUNCTIONS))
+    parser.add_argument("--solver-seconds", type=float, default=SOLVER_SECONDS,
+                        help="OR-Tools time limit per solve")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to check the results against")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="text report path")
+    parser.add_argument("--imports", action="store_true",
+                        help="time cold imports of the entry points (alone unless sizes or instances are given)")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else
+                           ([] if args.instance or args.imports else DEFAULT_SIZES))
+    instances = [synthetic_instance(n, args.seed) for n in sizes]
+    instances += [load_tsplib(path) for path in args.instance]
+
+    lines = []
+
+    def log(line):
+        print(line, flush=True)
+        lines.append(line)
+
+    if instances or not args.imports:
+        log(f"{'instance':<22}{'stops':>7}  {'function':<24}{'time':>12}{'length':>15}{'gap':>10}")
+    report = run(instances, args.functions, args.solver_seconds, log)
+    if args.imports:
+        log(f"{'module':<22}{'import':>11}")
+        report["imports"] = []
+        for module in IMPORT_MODULES:
+            report["imports"].append(import_time(module))
+            log(format_import(report["imports"][-1]))
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(report, json.load(f))
+        log(f"\n{len(problems)} regression(s) against {args.compare}")
+        for problem in problems:
+            log("  " + problem)
+        status = 1 if problems else 0
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("\n".join(lines) + "\n")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=1)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
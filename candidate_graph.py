@@ -0,0 +1,144 @@
+import numpy as np
+
+from distance_utils import ASYMMETRIC_METHODS, coords_to_arrays, ellipsoidal_distance, paired_distances
+from spatial_index import k_nearest
+
+# neighbours kept per stop; 8-12 is enough for near-optimal TSP/VRP tours
+DEFAULT_K = 10
+
+
+class _DistanceRow(dict):
+    # graph arcs of one stop; any other distance is computed on first use
+    # and kept, so local search can score moves through non-graph arcs
+    __slots__ = ("graph", "node")
+
+    def __missing__(self, j):
+        graph, i = self.graph, self.node
+        if graph.method == "ellipsoidal":
+            km = ellipsoidal_distance(graph.lats[i], graph.lons[i], graph.lats[j], graph.lons[j])
+        else:
+            km = float(paired_distances(graph.lats[i:i + 1], graph.lons[i:i + 1],
+                                        graph.lats[j:j + 1], graph.lons[j:j + 1], graph.method)[0])
+        self[j] = km
+        return km
+
+
+class CandidateGraph:
+    """Sparse distance graph: only the arcs a solver is allowed to use.
+
+    Arcs are stored in CSR form (``indptr``, ``indices``, ``distances``),
+    each row sorted by target, so memory is O(n k) instead of the O(n^2)
+    of a dense matrix. Every arc is present in both directions.
+    """
+
+    def __init__(self, lats, lons, indptr, indices, distances, method="ellipsoidal"):
+        self.lats = lats
+        self.lons = lons
+        self.indptr = indptr
+        self.indices = indices
+        self.distances = distances
+        self.method = method
+
+    def __len__(self):
+        return len(self.lats)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.lats, self.lons, self.indptr, self.indices, self.distances))
+
+    @classmethod
+    def from_arcs(cls, lats, lons, sources, targets, method="ellipsoidal"):
+        n = len(lats)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        keys = np.concatenate([sources * n + targets, targets * n + sources])
+        keys = np.unique(keys[(keys // n) != (keys % n)])
+        sources, targets = keys // n, keys % n
+        distances = paired_distances(lats[sources], lons[sources], lats[targets], lons[targets], method)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        return cls(lats, lons, indptr, targets.astype(np.int32), distances, method)
+
+    def arcs(self):
+        # (sources, targets) of every stored arc
+        sources = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        return sources, self.indices.astype(np.int64)
+
+    def with_arcs(self, sources, targets):
+        # copy of the graph that also allows the given arcs (e.g. a seed tour)
+        old_sources, old_targets = self.arcs()
+        return CandidateGraph.from_arcs(self.lats, self.lons,
+                                        np.concatenate([old_sources, np.asarray(sources, dtype=np.int64)]),
+                                        np.concatenate([old_targets, np.asarray(targets, dtype=np.int64)]),
+                                        self.method)
+
+    def with_route(self, route):
+        route = np.asarray(route, dtype=np.int64)
+        return self.with_arcs(route[:-1], route[1:])
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def row(self, i):
+        # {target: km} of node i, for solver callbacks
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return dict(zip(self.indices[start:stop].tolist(), self.distances[start:stop].tolist()))
+
+    def distance_rows(self):
+        # rows[i][j] in km for the local search engines
+        rows = []
+        for i in range(len(self)):
+            row = _DistanceRow(self.row(i))
+            row.graph, row.node = self, i
+            rows.append(row)
+        return rows
+
+    def neighbor_lists(self):
+        # graph neighbours of every stop, closest first
+        lists = []
+        for i in range(len(self)):
+            start, stop = self.indptr[i], self.indptr[i + 1]
+            order = np.argsort(self.distances[start:stop], kind="stable")
+            lists.append(self.indices[start:stop][order].tolist())
+        return lists
+
+    def length_bound(self):
+        # no tour through these stops is longer than n bounding-box diagonals
+        if not len(self):
+            return 0.0
+        diagonal = paired_distances([self.lats.min()], [self.lons.min()],
+                                    [self.lats.max()], [self.lons.max()], self.method)[0]
+        return float(diagonal) * len(self) * 2 + 1.0
+
+    def route_length(self, route):
+        # exact length of a route, including any arcs outside the graph
+        route = np.asarray(route, dtype=np.int64)
+        if len(route) < 2:
+            return 0.0
+        a, b = route[:-1], route[1:]
+        return float(paired_distances(self.lats[a], self.lons[a], self.lats[b], self.lons[b],
+                                      self.method).sum())
+
+
+def build_candidate_graph(lats, lons, k=DEFAULT_K, method="ellipsoidal", depot=None):
+    """k-nearest-neighbour candidate graph, plus a fan of arcs between
+    ``depot`` and every stop when a depot is given (so any stop can open or
+    close a route)."""
+    if method in ASYMMETRIC_METHODS:
+        raise ValueError(f"Sparse graphs need a closed-form metric, not {method!r}")
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    nearest = k_nearest(lats, lons, k)
+    sources = np.repeat(np.arange(n), nearest.shape[1])
+    targets = nearest.ravel().astype(np.int64)
+    if depot is not None:
+        sources = np.concatenate([sources, np.full(n, depot)])
+        targets = np.concatenate([targets, np.arange(n)])
+    return CandidateGraph.from_arcs(lats, lons, sources, targets, method)
+
+
+def compute_candidate_graph(locations, k=DEFAULT_K, method="ellipsoidal", depot=None):
+    # sparse counterpart of distance_utils.compute_distance_matrix
+    lats, lons = coords_to_arrays(locations)
+    return build_candidate_graph(lats, lons, k, method, depot)
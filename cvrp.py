@@ -1,20 +1,32 @@
 import streamlit as st
-import requests
-from geopy.distance import geodesic
-from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-import folium
-from streamlit_folium import st_folium, folium_static
+import streamlit.components.v1 as components
+from cvrp_solver import create_distance_matrix, solve_cvrp
+from portfolio import solve_cvrp_portfolio
+from warm_start import match_stops, repair_routes
+from map_visualizer import COMPACT_MIN_STOPS, add_compact_layers, fit_zoom
+from result_cache import ResultCache, pack_routes, problem_fingerprint, unpack_routes
+from location_set import LocationSet
+import profiling
 from streamlit_extras.stylable_container import stylable_container
 
-# Initialize session state for map persistence
-if 'map_data' not in st.session_state:
-    st.session_state.map_data = None
+# Initialize session state; solved routes are kept packed (see
+# result_cache.pack_routes) and maps are rendered from them on display
+if 'route_key' not in st.session_state:
+    st.session_state.route_key = None
 if 'routes' not in st.session_state:
     st.session_state.routes = None
 if 'locations' not in st.session_state:
-    st.session_state.locations = []
+    st.session_state.locations = LocationSet()
 if 'demands' not in st.session_state:
     st.session_state.demands = []
+if 'solved_locations' not in st.session_state:
+    st.session_state.solved_locations = None
+
+# Solved routes and rendered maps by problem fingerprint, shared by every
+# session so a repeated configuration is answered without solving
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return ResultCache()
 
 # Configure page
 st.set_page_config(
@@ -66,6 +78,15 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# Stage timings for this run (see profiling.py) when enabled in the sidebar;
+# a cProfile/tracemalloc capture applies to the one run after it is armed
+capture = st.session_state.pop("profile_capture_next", None)
+if st.session_state.get("profile_spans") or capture:
+    profiling.begin(memory=capture == "tracemalloc", profile=capture == "cProfile")
+else:
+    profiling.end()
+    st.session_state.pop("last_trace", None)
+
 # App title and description
 st.title("🚍 Multi-Bus Optimal Route Planner - Jabalpur")
 st.markdown("""
@@ -116,7 +137,7 @@ with st.sidebar:
             help="Select how many stops to include in the route planning"
         )
         
-        st.session_state.locations = []
+        st.session_state.locations = LocationSet()
         st.session_state.demands = []
         
         for i in range(num_stops):
@@ -170,70 +191,40 @@ with st.sidebar:
             value=50,
             help="Maximum passengers each bus can carry"
         )
+
+        use_portfolio = st.checkbox(
+            "Use all CPU cores",
+            value=False,
+            help="Run several search strategies in parallel and keep the best routes"
+        )
     
     with st.expander("🏁 Depot Settings", expanded=True):
         if st.session_state.locations:
             depot_place = st.selectbox(
                 "Depot Location (Start Point)", 
-                [loc[0] for loc in st.session_state.locations],
+                st.session_state.locations.names.tolist(),
                 help="Starting and ending point for all bus routes"
             )
-            depot_index = [loc[0] for loc in st.session_state.locations].index(depot_place)
-
-# Create distance matrix function
-def create_distance_matrix(locations):
-    return [
-        [geodesic(loc1[1], loc2[1]).km for loc2 in locations]
-        for loc1 in locations
-    ]
-
-# CVRP solver function
-def solve_cvrp(distance_matrix, demands, vehicle_capacity, num_vehicles, depot=0):
-    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot)
-    routing = pywrapcp.RoutingModel(manager)
-
-    def distance_callback(from_idx, to_idx):
-        return int(distance_matrix[manager.IndexToNode(from_idx)][manager.IndexToNode(to_idx)] * 1000)
+            depot_index = st.session_state.locations.index(depot_place)
 
-    def demand_callback(from_idx):
-        return demands[manager.IndexToNode(from_idx)]
-
-    transit_cb = routing.RegisterTransitCallback(distance_callback)
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_cb)
-
-    demand_cb = routing.RegisterUnaryTransitCallback(demand_callback)
-    routing.AddDimensionWithVehicleCapacity(
-        demand_cb,
-        0,
-        [vehicle_capacity] * num_vehicles,
-        True,
-        "Capacity"
-    )
-
-    search_params = pywrapcp.DefaultRoutingSearchParameters()
-    search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    search_params.time_limit.seconds = 10
-
-    solution = routing.SolveWithParameters(search_params)
-
-    if solution:
-        routes = []
-        for vehicle_id in range(num_vehicles):
-            idx = routing.Start(vehicle_id)
-            route = []
-            while not routing.IsEnd(idx):
-                route.append(manager.IndexToNode(idx))
-                idx = solution.Value(routing.NextVar(idx))
-            route.append(manager.IndexToNode(idx))
-            routes.append(route)
-        return routes
-
-    return None
+    with st.expander("⏱️ Profiling"):
+        st.checkbox("Record stage timings", key="profile_spans",
+                    help="Wall time, call counts and peak memory per stage, shown below the results")
+        capture_mode = st.radio("Deep capture", ["cProfile", "tracemalloc"], horizontal=True,
+                                key="profile_capture_mode")
+        if st.button("Capture next run", key="profile_capture_button"):
+            st.session_state["profile_capture_next"] = capture_mode
+            st.info(f"{capture_mode} will record the next run")
 
 # Generate map function
 def generate_map(routes, locations, depot_index):
-    route_map = folium.Map(location=locations[depot_index][1], zoom_start=13, control_scale=True)
+    # folium loads on the first map drawn, not on every cold start
+    import folium
+    # Large plans use one GeoJSON layer for all lines and one clustered layer
+    # for all stops instead of a marker object per stop
+    compact = sum(len(route) - 2 for route in routes) > COMPACT_MIN_STOPS
+    zoom = fit_zoom(locations.coords_at([node for route in routes for node in route])) if compact else 13
+    route_map = folium.Map(location=locations[depot_index][1], zoom_start=zoom, control_scale=True)
     
     # Add tile layers with proper attributions
     folium.TileLayer(
@@ -267,6 +258,21 @@ def generate_map(routes, locations, depot_index):
     
     # Route colors
     colors = ["#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4"]
+
+    if compact:
+        paths, names, stops = [], [], []
+        for i, route in enumerate(routes):
+            if len(route) <= 2:
+                continue
+            color = colors[i % len(colors)]
+            paths.append((locations.coords_at(route).tolist(), color))
+            names.append(f"Bus {i+1} Route")
+            visits = route[1:-1]
+            for j, (name, lat, lon) in enumerate(zip(locations.names[visits], locations.lats[visits].tolist(),
+                                                     locations.lons[visits].tolist()), 1):
+                stops.append((lat, lon, f"Bus {i+1} Stop {j}: {name}", color))
+        add_compact_layers(route_map, paths, stops, zoom, names)
+        return route_map
     
     for i, route in enumerate(routes):
         # Add route start marker
@@ -278,7 +284,7 @@ def generate_map(routes, locations, depot_index):
         ).add_to(route_map)
         
         # Add route lines and stop markers
-        route_points = [locations[node][1] for node in route]
+        route_points = locations.coords_at(route).tolist()
         folium.PolyLine(
             route_points,
             color=colors[i % len(colors)],
@@ -300,6 +306,60 @@ def generate_map(routes, locations, depot_index):
     
     return route_map
 
+def solve_routes(vehicle_capacity, num_vehicles, depot_index, use_portfolio):
+    # solved routes for the current stops, or None when no plan fits
+    distance_matrix = create_distance_matrix(st.session_state.locations)
+    if use_portfolio:
+        routes, _ = solve_cvrp_portfolio(
+            distance_matrix,
+            st.session_state.demands,
+            vehicle_capacity,
+            num_vehicles,
+            depot=depot_index
+        )
+    else:
+        # Start the search from the previous routes when stops were edited
+        initial_routes = None
+        if st.session_state.routes and st.session_state.solved_locations:
+            old_to_new, added = match_stops(st.session_state.solved_locations,
+                                            st.session_state.locations)
+            initial_routes = repair_routes(
+                unpack_routes(st.session_state.routes),
+                old_to_new,
+                added,
+                distance_matrix,
+                st.session_state.demands,
+                vehicle_capacity,
+                num_vehicles,
+                depot_index
+            )
+        routes = solve_cvrp(
+            distance_matrix,
+            st.session_state.demands,
+            vehicle_capacity,
+            num_vehicles,
+            depot=depot_index,
+            initial_routes=initial_routes,
+            # a repaired warm start settles quickly
+            no_improvement_seconds=1 if initial_routes else None,
+            savings_start=True
+        )
+    if not routes:
+        return None
+    return {"routes": pack_routes(routes, distance_matrix, st.session_state.demands)}
+
+def default_map_html(locations):
+    # all stops as grey markers, rendered once per stop list
+    import folium
+    default_map = folium.Map(location=locations[0][1], zoom_start=12)
+    for loc in locations:
+        folium.Marker(
+            loc[1],
+            popup=loc[0],
+            icon=folium.Icon(color='gray', icon='map-marker')
+        ).add_to(default_map)
+    return {"map_html": default_map.get_root().render()}
+
 # Main execution
 col1, col2 = st.columns([1, 3])
 
@@ -319,21 +379,25 @@ with col1:
         
         if st.button("🚀 Optimize Routes", help="Calculate optimal routes based on current configuration"):
             if len(st.session_state.locations) > 1:
-                distance_matrix = create_distance_matrix(st.session_state.locations)
-                st.session_state.routes = solve_cvrp(
-                    distance_matrix,
-                    st.session_state.demands,
-                    vehicle_capacity,
-                    num_vehicles,
-                    depot=depot_index
+                key = problem_fingerprint(
+                    "cvrp",
+                    st.session_state.locations,
+                    demands=list(st.session_state.demands),
+                    vehicle_capacity=vehicle_capacity,
+                    num_vehicles=num_vehicles,
+                    depot=depot_index,
+                    portfolio=use_portfolio
                 )
+                entry = get_result_cache().get_or_compute(
+                    key,
+                    lambda: solve_routes(vehicle_capacity, num_vehicles, depot_index, use_portfolio)
+                )
+                st.session_state.routes = entry["routes"] if entry else None
+                st.session_state.route_key = key if entry else None
+                # a view is enough: the stop list is rebuilt, never edited in place
+                st.session_state.solved_locations = st.session_state.locations[:]
                 
                 if st.session_state.routes:
-                    st.session_state.map_data = generate_map(
-                        st.session_state.routes,
-                        st.session_state.locations,
-                        depot_index
-                    )
                     st.success("Optimal routes calculated successfully!")
                 else:
                     st.error("Failed to compute optimal routes. Try adjusting vehicle count or capacity.")
@@ -341,8 +405,9 @@ with col1:
                 st.warning("Please add at least 2 stops to calculate routes.")
 
         if st.button("🔄 Reset Map", help="Clear the current map display"):
-            st.session_state.map_data = None
+            st.session_state.route_key = None
             st.session_state.routes = None
+            st.session_state.solved_locations = None
             st.rerun()
 
     if st.session_state.routes:
@@ -357,9 +422,11 @@ with col1:
             """
         ):
             st.subheader("Route Details")
-            for i, route in enumerate(st.session_state.routes):
+            packed = st.session_state.routes
+            for i, route in enumerate(unpack_routes(packed)):
                 with st.expander(f"🚌 Bus {i+1} Route", expanded=(i == 0)):
-                    st.write(f"**Capacity used:** {sum(st.session_state.demands[node] for node in route[1:-1])}/{vehicle_capacity}")
+                    st.write(f"**Capacity used:** {packed['load'][i]}/{vehicle_capacity}")
+                    st.write(f"**Distance:** {packed['km'][i]:.2f} km")
                     st.write("**Stops:**")
                     for j, node in enumerate(route):
                         if j == 0 or j == len(route)-1:
@@ -370,20 +437,32 @@ with col1:
 with col2:
     st.subheader("Route Visualization")
     
-    if st.session_state.map_data:
-        # Use folium_static for persistent map display
-        folium_static(st.session_state.map_data, width=800, height=600)
+    if st.session_state.routes:
+        # Rendered once per solved problem from the packed routes; the HTML
+        # lives only in the shared cache, never in the session
+        packed = st.session_state.routes
+        cache = get_result_cache()
+        if st.session_state.route_key not in cache:
+            cache.put(st.session_state.route_key, {"routes": packed})
+        with profiling.span("generate_map"):
+            map_html = cache.field(
+                st.session_state.route_key,
+                "map_html",
+                lambda: generate_map(
+                    unpack_routes(packed),
+                    st.session_state.solved_locations,
+                    int(packed["nodes"][0])
+                ).get_root().render()
+            )
+        components.html(map_html, width=800, height=600)
     else:
         # Show default map with all locations when no routes are calculated
         if st.session_state.locations:
-            default_map = folium.Map(location=st.session_state.locations[0][1], zoom_start=12)
-            for loc in st.session_state.locations:
-                folium.Marker(
-                    loc[1],
-                    popup=loc[0],
-                    icon=folium.Icon(color='gray', icon='map-marker')
-                ).add_to(default_map)
-            folium_static(default_map, width=800, height=600)
+            entry = get_result_cache().get_or_compute(
+                problem_fingerprint("stops", st.session_state.locations),
+                lambda: default_map_html(st.session_state.locations)
+            )
+            components.html(entry["map_html"], width=800, height=600)
         else:
             st.info("Add stops in the sidebar to begin route planning")
 
@@ -393,4 +472,17 @@ st.markdown("""
         <hr>
         <p>Multi-Bus Optimal Route Planner | Jabalpur Transport Authority</p>
     </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+# Stage timings of this run
+trace = profiling.end()
+if trace is not None:
+    st.session_state["last_trace"] = trace.to_dict()
+if st.session_state.get("last_trace"):
+    report = st.session_state["last_trace"]
+    with st.expander("⏱️ Stage timings"):
+        st.json({key: report[key] for key in ("seconds", "stages", "counters")})
+        if "profile" in report:
+            st.code(report["profile"])
+        if "allocations" in report:
+            st.code("\n".join(report["allocations"]))
@@ -0,0 +1,148 @@
+import numpy as np
+
+import profiling
+from distance_utils import compute_distance_matrix
+from savings import solve_cvrp_savings
+from spatial_index import nearest_neighbor_route
+from tsp_solver import (
+    add_stop_rules,
+    count_search,
+    resolve_time_limit,
+    restrict_to_graph,
+    routing_matrix,
+    search_parameters_for,
+    search_stats,
+    solve_from_routes,
+    sparse_transit,
+)
+
+
+# Create distance matrix function (tiled across all cores for big instances)
+def create_distance_matrix(locations, workers=None):
+    return compute_distance_matrix(locations, workers=workers)
+
+
+def _solve_model(manager, routing, transit_cb, num_stops, demands, vehicle_capacity, num_vehicles,
+                 stats, time_limit, deadline, first_solution_strategy, metaheuristic,
+                 initial_routes, no_improvement_seconds, no_improvement_solutions):
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_cb)
+
+    demand_cb = routing.RegisterUnaryTransitVector(np.asarray(demands, dtype=np.int64).tolist())
+    routing.AddDimensionWithVehicleCapacity(
+        demand_cb,
+        0,
+        [vehicle_capacity] * num_vehicles,
+        True,
+        "Capacity"
+    )
+
+    add_stop_rules(routing, no_improvement_seconds, no_improvement_solutions)
+
+    search_params = search_parameters_for(
+        first_solution_strategy,
+        metaheuristic,
+        resolve_time_limit(num_stops, time_limit, deadline)
+    )
+
+    # Warm start from routes solved earlier, when given and still feasible
+    solution = solve_from_routes(routing, manager, search_params, initial_routes)
+    count_search(routing)
+    if stats is not None:
+        stats.update(search_stats(routing))
+
+    if solution:
+        routes = []
+        for vehicle_id in range(num_vehicles):
+            idx = routing.Start(vehicle_id)
+            route = []
+            while not routing.IsEnd(idx):
+                route.append(manager.IndexToNode(idx))
+                idx = solution.Value(routing.NextVar(idx))
+            route.append(manager.IndexToNode(idx))
+            routes.append(route)
+        return routes
+
+    return None
+
+
+# CVRP solver function
+@profiling.stage("solve_cvrp")
+def solve_cvrp(distance_matrix, demands, vehicle_capacity, num_vehicles, depot=0, stats=None,
+               time_limit=10, deadline=None,
+               first_solution_strategy="PATH_CHEAPEST_ARC", metaheuristic="GUIDED_LOCAL_SEARCH",
+               initial_routes=None, no_improvement_seconds=None, no_improvement_solutions=None,
+               savings_start=False):
+    # savings_start: begin from Clarke-Wright routes polished by the
+    # inter-route local search instead of the first solution strategy
+    if initial_routes is None and savings_start:
+        initial_routes = solve_cvrp_savings(distance_matrix, demands, vehicle_capacity,
+                                            num_vehicles, depot)
+
+    from ortools.constraint_solver import pywrapcp
+    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot)
+    routing = pywrapcp.RoutingModel(manager)
+
+    # Arc costs and demands are handed over as native arrays, so the
+    # search never calls back into python
+    transit_cb = routing.RegisterTransitMatrix(routing_matrix(distance_matrix).tolist())
+    return _solve_model(manager, routing, transit_cb, len(distance_matrix), demands,
+                        vehicle_capacity, num_vehicles, stats, time_limit, deadline,
+                        first_solution_strategy, metaheuristic, initial_routes,
+                        no_improvement_seconds, no_improvement_solutions)
+
+
+def split_tour(tour, demands, vehicle_capacity, depot=0):
+    # cut a giant tour into consecutive depot-to-depot routes that each fit
+    routes, route, load = [], [depot], 0
+    for node in tour:
+        if node == depot:
+            continue
+        if load + demands[node] > vehicle_capacity and len(route) > 1:
+            routes.append(route + [depot])
+            route, load = [depot], 0
+        route.append(node)
+        load += demands[node]
+    if len(route) > 1:
+        routes.append(route + [depot])
+    return routes
+
+
+@profiling.stage("solve_cvrp_sparse")
+def solve_cvrp_sparse(graph, demands, vehicle_capacity, num_vehicles, depot=0, stats=None,
+                      time_limit=10, deadline=None,
+                      first_solution_strategy="SAVINGS", metaheuristic="GUIDED_LOCAL_SEARCH",
+                      initial_routes=None, no_improvement_seconds=None, no_improvement_solutions=None):
+    """solve_cvrp over a CandidateGraph built with ``depot=depot``.
+
+    Routes may only use graph arcs: each stop's k nearest neighbours and
+    the depot fan. Without ``initial_routes`` the search starts from a
+    nearest-neighbour tour split by capacity; its arcs are added to the
+    graph so that start is always feasible. SAVINGS is the fallback first
+    solution because arc-by-arc strategies rarely complete a route inside
+    the restricted graph.
+    """
+    n = len(graph)
+    if initial_routes is None:
+        # giant nearest-neighbour tour split by capacity; falls back to the
+        # first solution strategy when it needs more vehicles than we have
+        tour = nearest_neighbor_route(graph.lats, graph.lons, depot, False)
+        routes = split_tour(tour, demands, vehicle_capacity, depot)
+        if len(routes) <= num_vehicles:
+            initial_routes = routes + [[depot, depot]] * (num_vehicles - len(routes))
+    if len(graph.neighbors(depot)) < n - 1:
+        graph = graph.with_arcs(np.full(n, depot), np.arange(n))
+    if initial_routes is not None:
+        sources = [a for route in initial_routes for a in route[:-1]]
+        targets = [b for route in initial_routes for b in route[1:]]
+        graph = graph.with_arcs(sources, targets)
+
+    from ortools.constraint_solver import pywrapcp
+    manager = pywrapcp.RoutingIndexManager(n, num_vehicles, depot)
+    routing = pywrapcp.RoutingModel(manager)
+    transit_cb = sparse_transit(routing, manager, graph)
+    restrict_to_graph(routing, manager, graph)
+    if stats is not None:
+        stats["arcs"] = len(graph.indices)
+    return _solve_model(manager, routing, transit_cb, n, demands, vehicle_capacity, num_vehicles,
+                        stats, time_limit, deadline, first_solution_strategy, metaheuristic,
+                        initial_routes, no_improvement_seconds, no_improvement_solutions)
@@ -0,0 +1,217 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cvrp_solver import solve_cvrp
+from distance_utils import distance_matrix_from_arrays, route_leg_distances
+from spatial_index import project
+
+# buses per cluster: small enough that each sub-model solves in well under
+# a second, large enough that routes inside a cluster can trade stops
+VEHICLES_PER_CLUSTER = 3
+# clusters are filled to this share of their buses' capacity, leaving the
+# rest as slack for the boundary exchange
+CLUSTER_FILL = 0.9
+# share of the time budget spent on the boundary exchange
+EXCHANGE_SHARE = 0.3
+
+
+def first_fit_decreasing(nodes, demands, vehicle_capacity):
+    """Bin-pack ``nodes`` by demand, largest first. The bins are loads
+    that fit one vehicle each, so their count is a fleet size for which the
+    stops are known to be feasible."""
+    bins, loads = [], []
+    for node in sorted(nodes, key=lambda n: -demands[n]):
+        for b, load in enumerate(loads):
+            if load + demands[node] <= vehicle_capacity:
+                bins[b].append(node)
+                loads[b] += demands[node]
+                break
+        else:
+            bins.append([node])
+            loads.append(demands[node])
+    return bins
+
+
+def sweep_clusters(lats, lons, demands, vehicle_capacity, num_vehicles, depot=0,
+                   vehicles_per_cluster=VEHICLES_PER_CLUSTER):
+    """Capacity-aware sweep: sort stops by angle around the depot and cut
+    the sweep whenever a cluster's buses would be full. Clusters grow until
+    their bin-packed bus counts fit the fleet.
+
+    Returns (clusters, vehicles): stop index lists in sweep order and the
+    number of buses given to each, or (None, None) when the fleet cannot
+    carry the total demand.
+    """
+    xs, ys = project(lats, lons)
+    stops = np.array([i for i in range(len(xs)) if i != depot], dtype=np.int64)
+    angles = np.arctan2(ys[stops] - ys[depot], xs[stops] - xs[depot])
+    # start the sweep at the widest angular gap so no cluster straddles it
+    order = stops[np.argsort(angles)]
+    if len(order) > 1:
+        sorted_angles = np.sort(angles)
+        gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * math.pi))
+        cut = (int(gaps.argmax()) + 1) % len(order)
+        order = np.roll(order, -cut)
+
+    if sum(demands[i] for i in order.tolist()) > num_vehicles * vehicle_capacity:
+        return None, None
+    while True:
+        limit = vehicles_per_cluster * vehicle_capacity * CLUSTER_FILL
+        clusters, current, load = [], [], 0
+        for stop in order.tolist():
+            if current and load + demands[stop] > limit:
+                clusters.append(current)
+                current, load = [], 0
+            current.append(stop)
+            load += demands[stop]
+        if current:
+            clusters.append(current)
+
+        # load / capacity is only a lower bound when demands do not pack
+        # evenly; a first-fit-decreasing packing is a fleet that surely works
+        vehicles = [max(1, len(first_fit_decreasing(cluster, demands, vehicle_capacity)))
+                    for cluster in clusters]
+        if sum(vehicles) <= num_vehicles or len(clusters) <= 1:
+            break
+        # every cluster wastes part of its last buses; bigger ones waste less
+        vehicles_per_cluster *= 2
+    if sum(vehicles) > num_vehicles:
+        # even one cluster packs into more buses than there are: the solver
+        # gets the whole fleet and may still find a tighter assignment
+        vehicles = [num_vehicles]
+
+    loads = [sum(demands[i] for i in cluster) for cluster in clusters]
+    # spare buses go to the clusters with the least slack
+    for _ in range(num_vehicles - sum(vehicles)):
+        slack = [vehicles[c] * vehicle_capacity - loads[c] for c in range(len(clusters))]
+        vehicles[int(np.argmin(slack))] += 1
+    return clusters, vehicles
+
+
+def _solve_part(lats, lons, demands, vehicle_capacity, num_vehicles, time_limit,
+                initial_routes=None, method="ellipsoidal"):
+    # one sub-problem with its own depot at index 0; runs in a worker
+    matrix = distance_matrix_from_arrays(lats, lons, method)
+    routes = solve_cvrp(matrix, demands, vehicle_capacity, num_vehicles, 0,
+                        time_limit=time_limit, initial_routes=initial_routes,
+                        no_improvement_seconds=max(time_limit / 4, 0.2))
+    if routes is None and initial_routes is None:
+        # the first solution strategy can miss a tight packing: start from one
+        bins = first_fit_decreasing(range(1, len(demands)), demands, vehicle_capacity)
+        if len(bins) <= num_vehicles:
+            packed = [[0] + nodes + [0] for nodes in bins] + [[0, 0]] * (num_vehicles - len(bins))
+            routes = solve_cvrp(matrix, demands, vehicle_capacity, num_vehicles, 0,
+                                time_limit=time_limit, initial_routes=packed,
+                                no_improvement_seconds=max(time_limit / 4, 0.2))
+    if routes is None:
+        return None, None
+    total = sum(matrix[r[i]][r[i + 1]] for r in routes for i in range(len(r) - 1))
+    return routes, float(total)
+
+
+def _part_args(nodes, lats, lons, demands, depot):
+    # sub-problem arrays for ``nodes`` with the depot prepended
+    index = [depot] + list(nodes)
+    return lats[index], lons[index], [0] + [demands[i] for i in nodes]
+
+
+def _to_local(routes, nodes):
+    local = {node: i + 1 for i, node in enumerate(nodes)}
+    return [[0] + [local[n] for n in route[1:-1]] + [0] for route in routes]
+
+
+def _to_global(routes, nodes, depot):
+    return [[depot] + [nodes[n - 1] for n in route[1:-1]] + [depot] for route in routes]
+
+
+def _routes_length(routes, lats, lons, method="ellipsoidal"):
+    return float(sum(route_leg_distances(lats, lons, route, method).sum() for route in routes))
+
+
+def solve_cvrp_decomposed(lats, lons, demands, vehicle_capacity, num_vehicles, depot=0,
+                          time_limit=10, workers=None, vehicles_per_cluster=VEHICLES_PER_CLUSTER,
+                          method="ellipsoidal"):
+    """Cluster-first, route-second CVRP for hundreds of stops.
+
+    Stops are swept into capacity-sized clusters, each cluster is routed
+    by solve_cvrp in its own process, then neighbouring clusters are
+    re-solved in pairs (warm-started from their current routes) so stops
+    near a boundary can move to the other side. Only cluster-sized
+    matrices are ever built. Returns routes like solve_cvrp, or None.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    demands = list(demands)
+    deadline = time.time() + time_limit
+    clusters, vehicles = sweep_clusters(lats, lons, demands, vehicle_capacity, num_vehicles,
+                                        depot, vehicles_per_cluster)
+    if clusters is None:
+        return None
+
+    workers = workers or min(len(clusters), os.cpu_count() or 1)
+    route_time = time_limit * (1 - EXCHANGE_SHARE) * min(1.0, workers / len(clusters))
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(_solve_part, *_part_args(nodes, lats, lons, demands, depot),
+                               vehicle_capacity, count, route_time, None, method)
+                   for nodes, count in zip(clusters, vehicles)]
+        solved, failed = [], []
+        for c, (nodes, future) in enumerate(zip(clusters, futures)):
+            routes, total = future.result()
+            if routes is None:
+                failed.append(c)
+            solved.append(None if routes is None else [_to_global(routes, nodes, depot), total])
+
+        # a cluster that still found no routes borrows a bus another cluster
+        # left idle and is solved again
+        for c in failed:
+            while solved[c] is None:
+                donor = next((d for d in range(len(clusters))
+                              if solved[d] is not None and [depot, depot] in solved[d][0]), None)
+                if donor is None:
+                    return None
+                solved[donor][0].remove([depot, depot])
+                vehicles[donor] -= 1
+                vehicles[c] += 1
+                routes, total = pool.submit(
+                    _solve_part, *_part_args(clusters[c], lats, lons, demands, depot),
+                    vehicle_capacity, vehicles[c], route_time, None, method).result()
+                if routes is not None:
+                    solved[c] = [_to_global(routes, clusters[c], depot), total]
+
+        # boundary exchange: even pairs (0,1), (2,3), ... then odd pairs,
+        # each pass solved in parallel
+        for offset in (0, 1):
+            pairs = [(c, c + 1) for c in range(offset, len(clusters) - 1, 2)]
+            remaining = deadline - time.time()
+            if not pairs or remaining <= 0.2:
+                break
+            pair_time = remaining / 2 * min(1.0, workers / len(pairs))
+            jobs = []
+            for a, b in pairs:
+                nodes = clusters[a] + clusters[b]
+                routes = solved[a][0] + solved[b][0]
+                jobs.append(pool.submit(_solve_part, *_part_args(nodes, lats, lons, demands, depot),
+                                        vehicle_capacity, len(routes), pair_time,
+                                        _to_local(routes, nodes), method))
+            for (a, b), job in zip(pairs, jobs):
+                routes, total = job.result()
+                if routes is None or total >= solved[a][1] + solved[b][1] - 1e-6:
+                    continue
+                nodes = clusters[a] + clusters[b]
+                routes = _to_global(routes, nodes, depot)
+                # hand the merged routes back to the two clusters by angle
+                # of each route's first stop, keeping their bus counts
+                routes.sort(key=lambda r: nodes.index(r[1]) if len(r) > 2 else len(nodes))
+                first, second = routes[:vehicles[a]], routes[vehicles[a]:]
+                clusters[a] = [n for r in first for n in r[1:-1]]
+                clusters[b] = [n for r in second for n in r[1:-1]]
+                solved[a] = [first, _routes_length(first, lats, lons, method)]
+                solved[b] = [second, _routes_length(second, lats, lons, method)]
+
+    routes = [route for routes, _ in solved for route in routes]
+    routes += [[depot, depot] for _ in range(num_vehicles - len(routes))]
+    return routes
@@ -1,41 +1,201 @@
-# from geopy.distance import geodesic
-
-# def compute_distance_matrix(named_locations):
-#     size = len(named_locations)
-#     matrix = [[0.0 for _ in range(size)] for _ in range(size)]
-
-#     for i in range(size):
-#         for j in range(i + 1, size):
-#             coord1 = named_locations[i][1]
-#             coord2 = named_locations[j][1]
-#             dist = geodesic(coord1, coord2).km
-#             matrix[i][j] = dist
-#             matrix[j][i] = dist  #optimized 
-
-#     return matrix
-
-from geopy.distance import geodesic
-
-def build_distance_matrix(locations):
-    matrix = []
-    for i in range(len(locations)):
-        row = []
-        for j in range(len(locations)):
-            coord_i = locations[i][1]
-            coord_j = locations[j][1]
-            row.append(geodesic(coord_i, coord_j).km)
-        matrix.append(row)
-    return matrix
+import math
+import os
+
+import numpy as np
+
+import profiling
+from location_set import LocationSet
+
+# WGS-84 ellipsoid, the same one geopy's geodesic uses
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+# IUGG mean earth radius, used by the haversine mode
+EARTH_RADIUS_KM = 6371.0088
+
+# Error against geopy's geodesic; global figures are the worst over 20000
+# pairs drawn uniformly on the sphere:
+#   "haversine"   - spherical, under 0.56% relative error globally (~130 m
+#                   across Jabalpur)
+#   "ellipsoidal" - Lambert's formula on WGS-84, under 2e-6 relative error and
+#                   under 5 m absolute up to 1000 km; under 4e-6 relative up to
+#                   15000 km, growing near antipodal pairs to 1.7e-4 at worst
+#   "geodesic"    - geopy's exact solver, one python call per unordered pair
+# Road methods come from a local OSM extract (see road_network.py):
+#   "road"        - shortest driving distance in km
+#   "road_time"   - fastest driving time in minutes
+DISTANCE_METHODS = ("ellipsoidal", "haversine", "geodesic", "road", "road_time")
+# one-way streets make these differ between i -> j and j -> i
+ASYMMETRIC_METHODS = ("road", "road_time")
+
+
+def coords_to_arrays(locations):
+    # [(name, (lat, lon)), ...] -> (lats, lons) float64 arrays; a
+    # LocationSet hands over its own read-only columns without copying
+    if isinstance(locations, LocationSet):
+        return locations.lats, locations.lons
+    if len(locations) == 0:
+        return np.empty(0), np.empty(0)
+    coords = np.array([loc[1] for loc in locations], dtype=np.float64)
+    return coords[:, 0].copy(), coords[:, 1].copy()
+
+
+def _central_angle(lat1, lon1, lat2, lon2):
+    # all in radians, broadcastable
+    h = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    return EARTH_RADIUS_KM * _central_angle(lat1, lon1, lat2, lon2)
+
+
+def ellipsoidal_distances(lat1, lon1, lat2, lon2):
+    # Lambert's formula: great-circle angle between reduced latitudes plus a
+    # first-order flattening correction
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sigma = _central_angle(beta1, lon1, beta2, lon2)
+
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    half = sigma / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(half) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(half) ** 2
+        dist = WGS84_A_KM * (sigma - WGS84_F / 2 * (x + y))
+    # coincident points give 0/0 in y
+    return np.where(sigma > 0, dist, 0.0)
+
+
+def _road(method, network):
+    # (network, metric) for a road method; the default network is the
+    # extract named by ROAD_NETWORK_PATH
+    from road_network import get_road_network
+    return network or get_road_network(), "time" if method == "road_time" else "distance"
+
+
+def ellipsoidal_distance(lat1, lon1, lat2, lon2):
+    # scalar ellipsoidal_distances for hot python loops (no numpy overhead)
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    beta1 = math.atan((1 - WGS84_F) * math.tan(lat1))
+    beta2 = math.atan((1 - WGS84_F) * math.tan(lat2))
+    h = (math.sin((beta2 - beta1) / 2) ** 2
+         + math.cos(beta1) * math.cos(beta2) * math.sin((lon2 - lon1) / 2) ** 2)
+    sigma = 2 * math.asin(math.sqrt(min(max(h, 0.0), 1.0)))
+    if sigma == 0 or sigma == math.pi:
+        return WGS84_A_KM * sigma
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    half = sigma / 2
+    x = (sigma - math.sin(sigma)) * math.sin(p) ** 2 * math.cos(q) ** 2 / math.cos(half) ** 2
+    y = (sigma + math.sin(sigma)) * math.cos(p) ** 2 * math.sin(q) ** 2 / math.sin(half) ** 2
+    return WGS84_A_KM * (sigma - WGS84_F / 2 * (x + y))
+
 
+def pairwise_distances(lat1, lon1, lat2, lon2, method="ellipsoidal", network=None):
+    # Distances in km from every point of set 1 (rows) to every point of set 2
+    if method in ASYMMETRIC_METHODS:
+        network, metric = _road(method, network)
+        return network.pairwise(lat1, lon1, lat2, lon2, metric)
+    lat1 = np.asarray(lat1, dtype=np.float64)[:, None]
+    lon1 = np.asarray(lon1, dtype=np.float64)[:, None]
+    lat2 = np.asarray(lat2, dtype=np.float64)[None, :]
+    lon2 = np.asarray(lon2, dtype=np.float64)[None, :]
 
-def compute_distance_matrix(locations):
-    size = len(locations)
-    matrix = [[0] * size for _ in range(size)]
+    if method == "ellipsoidal":
+        return ellipsoidal_distances(lat1, lon1, lat2, lon2)
+    if method == "haversine":
+        return haversine_distances(lat1, lon1, lat2, lon2)
+    if method == "geodesic":
+        from geopy.distance import geodesic
+        out = np.empty((lat1.shape[0], lat2.shape[1]))
+        profiling.count("geodesic_calls", out.size)
+        for i in range(out.shape[0]):
+            for j in range(out.shape[1]):
+                out[i, j] = geodesic((lat1[i, 0], lon1[i, 0]), (lat2[0, j], lon2[0, j])).km
+        return out
+    raise ValueError(f"Unknown distance method: {method!r} (expected one of {DISTANCE_METHODS})")
 
+
+def paired_distances(lat1, lon1, lat2, lon2, method="ellipsoidal"):
+    # element-wise km from point i of set 1 to point i of set 2
+    lat1, lon1, lat2, lon2 = (np.asarray(a, dtype=np.float64) for a in (lat1, lon1, lat2, lon2))
+    if method == "ellipsoidal":
+        return ellipsoidal_distances(lat1, lon1, lat2, lon2)
+    if method == "haversine":
+        return haversine_distances(lat1, lon1, lat2, lon2)
+    if method == "geodesic":
+        from geopy.distance import geodesic
+        profiling.count("geodesic_calls", len(lat1))
+        return np.array([geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+    raise ValueError(f"Unknown distance method: {method!r} (expected one of {DISTANCE_METHODS})")
+
+
+def route_leg_distances(lats, lons, route, method="ellipsoidal", network=None):
+    # km of each consecutive leg of ``route``, without a full matrix
+    if method in ASYMMETRIC_METHODS:
+        network, metric = _road(method, network)
+        return network.leg_costs(lats, lons, route, metric)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    route = np.asarray(route, dtype=np.int64)
+    if len(route) < 2:
+        return np.empty(0)
+    a, b = route[:-1], route[1:]
+    return paired_distances(lats[a], lons[a], lats[b], lons[b], method)
+
+
+def geodesic_matrix(lats, lons):
+    # exact solver is slow, so only solve the upper triangle and mirror it
+    from geopy.distance import geodesic
+    size = len(lats)
+    matrix = np.zeros((size, size))
+    profiling.count("geodesic_calls", size * (size - 1) // 2)
     for i in range(size):
-        for j in range(size):
-            if i != j:
-                matrix[i][j] = geodesic(locations[i][1], locations[j][1]).km
-            else:
-                matrix[i][j] = 0.0
-    return matrix
\ No newline at end of file
+        for j in range(i + 1, size):
+            matrix[i, j] = geodesic((lats[i], lons[i]), (lats[j], lons[j])).km
+    return matrix + matrix.T
+
+
+def _use_pool(size, method, workers):
+    from parallel_matrix import GEODESIC_PARALLEL_MIN_STOPS, PARALLEL_MIN_STOPS
+    workers = workers or os.cpu_count() or 1
+    threshold = GEODESIC_PARALLEL_MIN_STOPS if method == "geodesic" else PARALLEL_MIN_STOPS
+    return workers > 1 and size >= threshold
+
+
+def distance_matrix_from_arrays(lats, lons, method="ellipsoidal", network=None, workers=None):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    size = len(lats)
+
+    if method in ASYMMETRIC_METHODS:
+        network, metric = _road(method, network)
+        return network.distance_matrix(lats, lons, metric)
+
+    # large matrices are filled tile by tile on every core
+    if _use_pool(size, method, workers):
+        from parallel_matrix import parallel_distance_matrix
+        return parallel_distance_matrix(lats, lons, method, workers)
+
+    if method == "geodesic":
+        return geodesic_matrix(lats, lons)
+
+    matrix = pairwise_distances(lats, lons, lats, lons, method)
+    np.fill_diagonal(matrix, 0.0)
+    return matrix
+
+
+def build_distance_matrix(locations, method="ellipsoidal", network=None, workers=None):
+    return compute_distance_matrix(locations, method, network, workers)
+
+
+@profiling.stage("compute_distance_matrix")
+def compute_distance_matrix(locations, method="ellipsoidal", network=None, workers=None):
+    # n x n numpy array in km (minutes for "road_time"); indexes like the old
+    # nested lists (matrix[i][j])
+    lats, lons = coords_to_arrays(locations)
+    return distance_matrix_from_arrays(lats, lons, method, network, workers)
@@ -0,0 +1,211 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import profiling
+
+DEFAULT_CACHE_PATH = os.path.join(".route_cache", "geocode.sqlite")
+USER_AGENT = "JabalpurRoutePlanner/1.0"
+
+
+def _nominatim_params(place, key):
+    return {'q': place + ", Jabalpur", 'format': 'json', 'limit': 1, 'countrycodes': 'in'}
+
+
+def _nominatim_parse(data):
+    if data:
+        return float(data[0]['lat']), float(data[0]['lon'])
+    return None
+
+
+def _opencage_params(place, key):
+    return {'q': place + ", Jabalpur, India", 'key': key, 'limit': 1, 'no_annotations': 1}
+
+
+def _opencage_parse(data):
+    results = data.get("results", [])
+    if results:
+        coords = results[0]["geometry"]
+        return float(coords["lat"]), float(coords["lng"])
+    return None
+
+
+# Tried in order until one finds the place. Rates follow each service's
+# free-tier policy (requests per second, with ``burst`` requests of slack);
+# point ``url`` at a local stand-in geocoder for testing.
+DEFAULT_PROVIDERS = [
+    {
+        "name": "nominatim",
+        "url": "https://nominatim.openstreetmap.org/search",
+        "params": _nominatim_params,
+        "parse": _nominatim_parse,
+        "key": None,
+        "rate": 1.0,
+        "burst": 1,
+    },
+    {
+        "name": "opencage",
+        "url": "https://api.opencagedata.com/geocode/v1/json",
+        "params": _opencage_params,
+        "parse": _opencage_parse,
+        "key": os.environ.get("OPENCAGE_KEY", "32d1e78b3e2848999a5947c8894cfe31"),
+        "needs_key": True,
+        "rate": 1.0,
+        "burst": 1,
+    },
+]
+
+
+def normalize_query(place):
+    # "  Gwarighat ,, " and "gwarighat" are the same lookup
+    return " ".join(place.replace(",", " , ").split()).strip(" ,").lower()
+
+
+class TokenBucket:
+    """Rate limiter shared by every thread and event loop using a provider.
+
+    Each request reserves a token under a plain lock; when the bucket is
+    empty the token is borrowed and the caller sleeps until it refills.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # seconds to wait before using the reserved token
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class GeocodeCache:
+    """Durable query -> coordinates store. Entries never expire; places
+    that no provider found are stored as (None, None)."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "query TEXT PRIMARY KEY, lat REAL, lon REAL, provider TEXT, created REAL)"
+            )
+
+    def get_many(self, queries):
+        found = {}
+        queries = list(queries)
+        with self._lock:
+            for start in range(0, len(queries), 500):
+                chunk = queries[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT query, lat, lon FROM geocode WHERE query IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                for query, lat, lon in rows:
+                    found[query] = (lat, lon)
+        return found
+
+    def put(self, query, coords, provider):
+        lat, lon = coords if coords else (None, None)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+                (query, lat, lon, provider, time.time())
+            )
+
+
+class Geocoder:
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, providers=None, max_connections=8, timeout=10):
+        self.providers = [p for p in (providers or DEFAULT_PROVIDERS)
+                          if p.get("key") or not p.get("needs_key")]
+        self.cache = GeocodeCache(cache_path)
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._buckets = {p["name"]: TokenBucket(p["rate"], p["burst"]) for p in self.providers}
+        # one pooled session keeps connections to each provider alive
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=len(self.providers) or 1, pool_maxsize=max_connections)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def _fetch(self, provider, place):
+        profiling.count("geocode_requests")
+        response = self._session.get(provider["url"], params=provider["params"](place, provider.get("key")),
+                                     timeout=self.timeout)
+        if not response.ok:
+            raise requests.HTTPError(f"{provider['name']} returned {response.status_code}")
+        return provider["parse"](response.json())
+
+    async def _lookup(self, place, slots, errors):
+        query = normalize_query(place)
+        failed = False
+        for provider in self.providers:
+            await self._buckets[provider["name"]].acquire()
+            try:
+                async with slots:
+                    coords = await asyncio.to_thread(self._fetch, provider, place)
+            except Exception as e:
+                errors.append(f"{place}: {e}")
+                failed = True
+                continue
+            if coords:
+                self.cache.put(query, coords, provider["name"])
+                return query, coords
+        # only remember "not found" when every provider actually answered
+        if not failed:
+            self.cache.put(query, None, None)
+        return query, (None, None)
+
+    async def geocode_many_async(self, places, errors=None):
+        errors = [] if errors is None else errors
+        queries = {}
+        for place in places:
+            queries.setdefault(normalize_query(place), place)
+        results = self.cache.get_many(queries)
+        profiling.count("geocode_cache_hits", len(results))
+
+        missing = [place for query, place in queries.items() if query not in results]
+        if missing:
+            slots = asyncio.Semaphore(self.max_connections)
+            for query, coords in await asyncio.gather(
+                    *(self._lookup(place, slots, errors) for place in missing)):
+                results[query] = coords
+        return [tuple(results[normalize_query(place)]) for place in places]
+
+    @profiling.stage("geocode")
+    def geocode_many(self, places, errors=None):
+        # [(lat, lon) or (None, None)] aligned with ``places``; provider
+        # failures are appended to ``errors`` when given. Runs its own event
+        # loop, so code already inside one must await geocode_many_async.
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.geocode_many_async(list(places), errors))
+        raise RuntimeError("geocode_many() called from a running event loop; "
+                           "await geocode_many_async() instead")
+
+    def geocode(self, place, errors=None):
+        return self.geocode_many([place], errors)[0]
+
+    def close(self):
+        self._session.close()
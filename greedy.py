@@ -1,10 +1,10 @@
 
 
 from sample_input import locations
-from distance_utils import compute_distance_matrix
 # from tsp_solver import solve_tsp
 from tsp_solver import solve_tsp_greedy
 from map_visualizer import plot_route
+import profiling
 
 return_to_start = True
 
@@ -16,13 +16,6 @@ def print_directions(locations, route):
 
 
 def main():
-    distance_matrix = compute_distance_matrix(locations)
-
-    distance_matrix = compute_distance_matrix(locations)
-
-
-    
-
     route, total_km = solve_tsp_greedy(locations)
 
     print("Greedy Route:")
@@ -44,4 +37,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # ROUTE_PROFILE=1 (or memory / cprofile) prints per-stage timings as JSON
+    with profiling.trace_from_env() as trace:
+        main()
+    if trace is not None:
+        print(trace.to_json(indent=2))
@@ -0,0 +1,73 @@
+import numpy as np
+
+# solve_tsp switches to the exact solver at or below this many stops
+EXACT_MAX_STOPS = 16
+# refuse instances whose DP tables (plus temporaries) would exceed this
+MAX_MEMORY_BYTES = 512 * 1024 * 1024
+
+
+def held_karp_memory(num_stops):
+    # float64 cost table + int8 parent table over 2^(n-1) subsets, plus the
+    # largest per-layer candidate block
+    if num_stops < 2:
+        return 0
+    cells = (1 << (num_stops - 1)) * (num_stops - 1)
+    return cells * (8 + 1) + cells // 2 * 8
+
+
+def solve_tsp_exact(distance_matrix, return_to_start=True, max_memory=MAX_MEMORY_BYTES):
+    """Provably optimal tour from stop 0 by bitmask dynamic programming.
+
+    cost[mask, j] is the shortest path that leaves stop 0, visits exactly
+    the stops in ``mask`` (bit j is stop j + 1) and ends at stop j + 1.
+    Each subset size is one vectorized layer. With ``return_to_start``
+    False the tour is an open path that may end anywhere.
+    """
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    n = len(matrix)
+    if n == 0:
+        return None, None
+    if n == 1:
+        return ([0, 0] if return_to_start else [0]), 0.0
+    if held_karp_memory(n) > max_memory:
+        raise ValueError(f"Held-Karp on {n} stops needs about "
+                         f"{held_karp_memory(n) / 2 ** 20:.0f} MB (limit {max_memory / 2 ** 20:.0f} MB)")
+
+    m = n - 1
+    inner = matrix[1:, 1:]
+    full = (1 << m) - 1
+    cost = np.full((full + 1, m), np.inf)
+    parent = np.full((full + 1, m), -1, dtype=np.int8)
+    singles = 1 << np.arange(m)
+    cost[singles, np.arange(m)] = matrix[0, 1:]
+
+    masks = np.arange(full + 1)
+    sizes = np.zeros(full + 1, dtype=np.int64)
+    for bit in range(m):
+        sizes += (masks >> bit) & 1
+
+    for size in range(2, m + 1):
+        layer = masks[sizes == size]
+        for j in range(m):
+            with_j = layer[(layer >> j) & 1 == 1]
+            candidates = cost[with_j ^ (1 << j)] + inner[:, j]
+            best = candidates.argmin(axis=1)
+            parent[with_j, j] = best
+            cost[with_j, j] = candidates[np.arange(len(with_j)), best]
+
+    final = cost[full] + (matrix[1:, 0] if return_to_start else 0.0)
+    last = int(final.argmin())
+    total = float(final[last])
+
+    route = []
+    mask = full
+    while last >= 0:
+        route.append(last + 1)
+        previous = int(parent[mask, last])
+        mask ^= 1 << last
+        last = previous
+    route.append(0)
+    route.reverse()
+    if return_to_start:
+        route.append(0)
+    return route, round(total, 2)
@@ -0,0 +1,398 @@
+import time
+from collections import deque
+
+import numpy as np
+
+EPS = 1e-9
+
+
+def tour_length(route, distance_matrix):
+    total = 0.0
+    for i in range(len(route) - 1):
+        total += distance_matrix[route[i]][route[i + 1]]
+    return float(total)
+
+
+def neighbor_lists(distance_matrix, k=10):
+    # k nearest other nodes of every node, closest first
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    n = len(matrix)
+    k = min(k, n - 1)
+    if k <= 0:
+        return [[] for _ in range(n)]
+    masked = matrix.copy()
+    np.fill_diagonal(masked, np.inf)
+    nearest = np.argpartition(masked, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(masked, nearest, axis=1), axis=1)
+    return np.take_along_axis(nearest, order, axis=1).tolist()
+
+
+def _as_cycle(route, distance_matrix):
+    """Turn a route into (cycle, D, open_path, labels) for the engines below.
+
+    Nodes are relabelled 0..m-1 over the stops in the route (``labels``
+    maps back) and the cycle starts at the route's start. Closed routes
+    ([0, ..., 0]) drop the repeated end. Open routes get a dummy node that
+    is free to reach from the start and costs the same constant from every
+    other node, so the best cycle through it is the best path from the
+    fixed start to any end.
+    """
+    closed = len(route) > 1 and route[0] == route[-1]
+    stops = list(route[:-1]) if closed else list(route)
+    labels = sorted(stops)
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    if len(labels) != len(matrix):
+        matrix = matrix[np.ix_(labels, labels)]
+    local = {node: i for i, node in enumerate(labels)}
+    cycle = [local[node] for node in stops]
+    D = matrix.tolist()
+    if closed:
+        return cycle, D, False, labels
+
+    n = len(D)
+    big = 1.0 + 2.0 * float(matrix.max(initial=0.0)) * n
+    dummy_row = [big] * n + [0.0]
+    dummy_row[cycle[0]] = 0.0
+    for i in range(n):
+        D[i].append(dummy_row[i])
+    D.append(dummy_row)
+    cycle.append(n)
+    return cycle, D, True, labels
+
+
+def _as_route(cycle, open_path, labels, start):
+    i = cycle.index(start)
+    cycle = cycle[i:] + cycle[:i]
+    if not open_path:
+        return [labels[node] for node in cycle] + [labels[start]]
+    # the dummy should sit next to the start; walk away from it
+    dummy = len(labels)
+    if cycle[1] == dummy:
+        cycle = [start] + cycle[1:][::-1]
+    return [labels[node] for node in cycle if node != dummy]
+
+
+def _reverse(tour, pos, i, j):
+    # reverse tour[i..j] going forward cyclically; flips the complement
+    # instead when that is shorter (same cycle, opposite orientation)
+    n = len(tour)
+    length = (j - i) % n + 1
+    if 2 * length > n:
+        i, j = (j + 1) % n, (i - 1) % n
+        length = n - length
+    if i + length <= n:
+        # no wrap-around: the slice reverses in C, only pos is a python loop
+        segment = tour[i:i + length]
+        segment.reverse()
+        tour[i:i + length] = segment
+        for k, node in enumerate(segment, i):
+            pos[node] = k
+        return
+    for _ in range(length // 2):
+        a, b = tour[i], tour[j]
+        tour[i], tour[j] = b, a
+        pos[b], pos[a] = i, j
+        i = (i + 1) % n
+        j = (j - 1) % n
+
+
+def _expired(deadline):
+    # deadline is an absolute time.time(); the engines stop with the tour
+    # as it stands once it has passed
+    return deadline is not None and time.time() >= deadline
+
+
+def _start_queue(tour, focus):
+    # every node starts active unless the caller focuses on a few
+    queue = deque(tour if focus is None else dict.fromkeys(focus))
+    queued = [False] * len(tour)
+    for node in queue:
+        queued[node] = True
+    return queue, queued
+
+
+def _two_opt_cycle(tour, D, neighbors, focus=None, deadline=None):
+    n = len(tour)
+    if n < 4:
+        return tour
+    pos = [0] * n
+    for i, node in enumerate(tour):
+        pos[node] = i
+    queue, queued = _start_queue(tour, focus)
+
+    # don't-look bits: a node leaves the queue once no improving move
+    # starts from it, and re-enters only when one of its edges changes
+    while queue and not _expired(deadline):
+        a = queue.popleft()
+        queued[a] = False
+        improved = False
+        for forward in (True, False):
+            i = pos[a]
+            b = tour[(i + 1) % n] if forward else tour[(i - 1) % n]
+            d_ab = D[a][b]
+            for c in neighbors[a]:
+                d_ac = D[a][c]
+                if d_ac >= d_ab:
+                    break
+                j = pos[c]
+                d = tour[(j + 1) % n] if forward else tour[(j - 1) % n]
+                if c == b or d == a:
+                    continue
+                delta = d_ac + D[b][d] - d_ab - D[c][d]
+                if delta < -EPS:
+                    if forward:
+                        _reverse(tour, pos, (i + 1) % n, j)
+                    else:
+                        _reverse(tour, pos, i, (j - 1) % n)
+                    for node in (a, b, c, d):
+                        if not queued[node]:
+                            queued[node] = True
+                            queue.append(node)
+                    improved = True
+                    break
+            if improved:
+                break
+    return tour
+
+
+def _local_focus(focus, labels, neighbors):
+    # focus stops as cycle positions, widened by their neighbor lists
+    if focus is None:
+        return None
+    local = {node: i for i, node in enumerate(labels)}
+    focus = [local[node] for node in focus if node in local]
+    return focus + [j for i in focus for j in neighbors[i]]
+
+
+def two_opt(route, distance_matrix, neighbors=None, k=10, focus=None):
+    """2-opt on a precomputed matrix.
+
+    Moves are scored as O(1) edge deltas, candidates come from k-nearest
+    neighbor lists and don't-look bits skip settled nodes. ``route`` is a
+    closed tour ([0, ..., 0]) or an open path with a fixed start; the result
+    has the same shape. ``focus`` works as in improve_route.
+    """
+    if len(route) < 4:
+        return list(route)
+    cycle, D, open_path, labels = _as_cycle(route, distance_matrix)
+    if neighbors is None or open_path or len(labels) != len(distance_matrix):
+        neighbors = neighbor_lists(D, k)
+    start = cycle[0]
+    cycle = _two_opt_cycle(cycle, D, neighbors, _local_focus(focus, labels, neighbors))
+    return _as_route(cycle, open_path, labels, start)
+
+
+def _flip(tour, pos, a, b, c, d):
+    # 2-opt move: drop edges (a, b) and (c, d), add (a, c) and (b, d).
+    # b follows a and d follows c in the same direction, whichever way
+    # the tour currently runs.
+    n = len(tour)
+    if tour[(pos[a] + 1) % n] == b:
+        _reverse(tour, pos, pos[b], pos[c])
+    else:
+        _reverse(tour, pos, pos[a], pos[d])
+
+
+def _positions(tour):
+    pos = [0] * len(tour)
+    for i, node in enumerate(tour):
+        pos[node] = i
+    return pos
+
+
+def _or_opt_cycle(tour, D, neighbors, max_segment=3, focus=None, deadline=None):
+    n = len(tour)
+    if n < 5:
+        return tour
+    pos = _positions(tour)
+    queue, queued = _start_queue(tour, focus)
+
+    while queue and not _expired(deadline):
+        s1 = queue.popleft()
+        queued[s1] = False
+        moved = None
+        for length in range(1, min(max_segment, n - 3) + 1):
+            i = pos[s1]
+            s2 = tour[(i + length - 1) % n]
+            p = tour[(i - 1) % n]
+            nx = tour[(i + length) % n]
+            segment = {tour[(i + m) % n] for m in range(length)}
+            removed = D[p][s1] + D[s2][nx] - D[p][nx]
+            if removed <= EPS:
+                continue
+            best = -EPS
+            for end in (s1, s2):
+                for c in neighbors[end]:
+                    if D[end][c] >= removed:
+                        break
+                    if c in segment:
+                        continue
+                    j = pos[c]
+                    for u, v in ((c, tour[(j + 1) % n]), (tour[(j - 1) % n], c)):
+                        if u in segment or v in segment or v == s1 or u == s2:
+                            continue
+                        keep = D[u][s1] + D[s2][v] - D[u][v]
+                        rev = D[u][s2] + D[s1][v] - D[u][v]
+                        gain = removed - min(keep, rev)
+                        if gain > best + EPS:
+                            best = gain
+                            moved = (u, v, keep <= rev, p, s2, nx)
+            if moved:
+                break
+        if moved:
+            u, v, keep, p, s2, nx = moved
+            # segment insertion as a sequence of 2-opt flips
+            _flip(tour, pos, p, s1, u, v)
+            _flip(tour, pos, p, u, nx, s2)
+            if keep:
+                _flip(tour, pos, u, s2, s1, v)
+            for node in (s1, s2, p, nx, u, v):
+                if not queued[node]:
+                    queued[node] = True
+                    queue.append(node)
+    return tour
+
+
+def _lk_cycle(tour, D, neighbors, breadth=(5, 3, 1), max_depth=6, focus=None, deadline=None):
+    """LK-style chains of sequential 2-opt flips with bounded backtracking.
+
+    From t1 the edge (t1, t2) is broken and the chain repeatedly adds
+    (t2, t3), breaks (t3, t4) and flips, so (t1, t4) closes the tour. The
+    first chain whose closed tour is shorter is kept. Depth 2 chains are
+    the segment-reversal 3-opt moves.
+    """
+    n = len(tour)
+    if n < 5:
+        return tour
+    pos = _positions(tour)
+    queue, queued = _start_queue(tour, focus)
+
+    def step(t1, t2, gain, depth, added):
+        forward = tour[(pos[t1] + 1) % n] == t2
+        candidates = []
+        for t3 in neighbors[t2]:
+            g1 = gain - D[t2][t3]
+            if g1 <= EPS:
+                break
+            j = pos[t3]
+            t4 = tour[(j - 1) % n] if forward else tour[(j + 1) % n]
+            if t3 == t1 or t4 == t2 or t3 == t2 or (t3, t4) in added or (t4, t3) in added:
+                continue
+            candidates.append((D[t3][t4] - D[t2][t3], t3, t4))
+        candidates.sort(reverse=True)
+        width = breadth[depth] if depth < len(breadth) else 1
+        for _, t3, t4 in candidates[:width]:
+            _flip(tour, pos, t1, t2, t4, t3)
+            new_gain = gain - D[t2][t3] + D[t3][t4]
+            if new_gain - D[t4][t1] > EPS:
+                return [t1, t2, t3, t4]
+            if depth + 1 < max_depth:
+                added.append((t2, t3))
+                touched = step(t1, t4, new_gain, depth + 1, added)
+                added.pop()
+                if touched:
+                    return touched + [t2, t3]
+            _flip(tour, pos, t1, t4, t2, t3)
+        return None
+
+    while queue and not _expired(deadline):
+        t1 = queue.popleft()
+        queued[t1] = False
+        i = pos[t1]
+        for t2 in (tour[(i + 1) % n], tour[(i - 1) % n]):
+            touched = step(t1, t2, D[t1][t2], 0, [])
+            if touched:
+                for node in touched:
+                    if not queued[node]:
+                        queued[node] = True
+                        queue.append(node)
+                break
+    return tour
+
+
+def _improve_route(route, distance_matrix, engine, k):
+    if len(route) < 5:
+        return list(route)
+    cycle, D, open_path, labels = _as_cycle(route, distance_matrix)
+    neighbors = neighbor_lists(D, k)
+    start = cycle[0]
+    cycle = engine(cycle, D, neighbors)
+    return _as_route(cycle, open_path, labels, start)
+
+
+def or_opt(route, distance_matrix, k=10, max_segment=3):
+    # move segments of up to ``max_segment`` stops, optionally reversed
+    return _improve_route(route, distance_matrix,
+                          lambda c, D, nb: _or_opt_cycle(c, D, nb, max_segment), k)
+
+
+def three_opt(route, distance_matrix, k=10):
+    # sequential 3-opt: every 2- and 3-edge exchange reachable by flips
+    return _improve_route(route, distance_matrix,
+                          lambda c, D, nb: _lk_cycle(c, D, nb, breadth=(k, k), max_depth=2), k)
+
+
+def lin_kernighan(route, distance_matrix, k=10, breadth=(5, 3, 1), max_depth=6):
+    return _improve_route(route, distance_matrix,
+                          lambda c, D, nb: _lk_cycle(c, D, nb, breadth, max_depth), k)
+
+
+def _improve_cycle(cycle, D, neighbors, max_rounds=10, focus=None, deadline=None):
+    def length(c):
+        return sum(D[c[i - 1]][c[i]] for i in range(len(c)))
+
+    cycle = _two_opt_cycle(cycle, D, neighbors, focus, deadline)
+    best = length(cycle)
+    for _ in range(max_rounds):
+        cycle = _or_opt_cycle(cycle, D, neighbors, focus=focus, deadline=deadline)
+        cycle = _lk_cycle(cycle, D, neighbors, focus=focus, deadline=deadline)
+        current = length(cycle)
+        if current >= best - EPS or _expired(deadline):
+            break
+        best = current
+    return cycle
+
+
+def improve_route(route, distance_matrix, k=10, max_rounds=10, focus=None):
+    """2-opt, then Or-opt and LK chains in turn until neither helps.
+
+    ``focus`` limits the starting candidates to the given stops (plus their
+    neighbor lists); moves still spread to every stop they touch.
+    """
+    if len(route) < 5:
+        return list(route)
+    cycle, D, open_path, labels = _as_cycle(route, distance_matrix)
+    neighbors = neighbor_lists(D, k)
+    start = cycle[0]
+    cycle = _improve_cycle(cycle, D, neighbors, max_rounds, _local_focus(focus, labels, neighbors))
+    return _as_route(cycle, open_path, labels, start)
+
+
+def improve_tour(route, rows, neighbors, max_rounds=10, big=None, deadline=None):
+    """improve_route on a tour over every stop 0..n-1 with distances given
+    as rows (``rows[a][b]``) and neighbor lists instead of a dense matrix,
+    e.g. from a sparse CandidateGraph.
+
+    Open paths need ``big``, an upper bound on any tour length; the dummy
+    node's costs are written into ``rows``. Each move reverses up to half
+    the tour in python, so the search grows roughly quadratically with n
+    (about 10 s at 10k stops); past ``deadline`` (a time.time()) it stops
+    and returns the tour improved so far.
+    """
+    if len(route) < 5:
+        return list(route)
+    closed = route[0] == route[-1]
+    cycle = list(route[:-1]) if closed else list(route)
+    start = cycle[0]
+    labels = list(range(len(rows)))
+    if not closed:
+        n = len(rows)
+        dummy_row = [big] * n + [0.0]
+        dummy_row[start] = 0.0
+        for i in range(n):
+            rows[i][n] = dummy_row[i]
+        rows = list(rows) + [dummy_row]
+        neighbors = list(neighbors) + [[start]]
+        cycle.append(n)
+    cycle = _improve_cycle(cycle, rows, neighbors, max_rounds, deadline=deadline)
+    return _as_route(cycle, not closed, labels, start)
@@ -0,0 +1,151 @@
+import sys
+
+import numpy as np
+
+
+def _frozen(array):
+    # the columns are shared by every view of a set, so nobody writes to them
+    array.flags.writeable = False
+    return array
+
+
+def _name_table(names):
+    # equal names share one string object however many stops carry them
+    table = np.empty(len(names), dtype=object)
+    table[:] = [sys.intern(str(name)) for name in names]
+    return table
+
+
+def _positions(key):
+    # boolean masks select stops as numpy does; anything else is indices
+    key = np.asarray(key)
+    return key if key.dtype == np.bool_ else key.astype(np.intp)
+
+
+class LocationSet:
+    """Stops as contiguous float64 lat/lon columns and a name table.
+
+    A drop-in for the ``[(name, (lat, lon)), ...]`` lists used elsewhere:
+    ``locations[i]`` and iteration still give (name, (lat, lon)) pairs, but
+    slices are views sharing the columns, a list or array of indices (a
+    route) or a boolean mask selects those stops, and ``index``/``find``
+    look names up in a hash index instead of scanning. ``append`` and
+    ``pop`` build new columns, so views taken earlier keep seeing the stops
+    they were made of.
+    """
+
+    __slots__ = ("names", "lats", "lons", "_index", "_folded")
+
+    def __init__(self, names=(), lats=(), lons=()):
+        self.names = _frozen(_name_table(names))
+        self.lats = _frozen(np.array(lats, dtype=np.float64).reshape(-1))
+        self.lons = _frozen(np.array(lons, dtype=np.float64).reshape(-1))
+        if not len(self.names) == len(self.lats) == len(self.lons):
+            raise ValueError(f"{len(self.names)} names for {len(self.lats)} latitudes "
+                             f"and {len(self.lons)} longitudes")
+        self._index = None
+        self._folded = None
+
+    @classmethod
+    def _view(cls, names, lats, lons):
+        view = cls.__new__(cls)
+        view.names, view.lats, view.lons = _frozen(names), _frozen(lats), _frozen(lons)
+        view._index = None
+        view._folded = None
+        return view
+
+    @classmethod
+    def from_locations(cls, locations):
+        if isinstance(locations, cls):
+            return locations
+        locations = list(locations)
+        coords = np.array([coords for _, coords in locations], dtype=np.float64).reshape(-1, 2)
+        return cls([name for name, _ in locations], coords[:, 0], coords[:, 1])
+
+    def __len__(self):
+        return len(self.lats)
+
+    def __iter__(self):
+        return zip(self.names.tolist(), zip(self.lats.tolist(), self.lons.tolist()))
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.names[key], (float(self.lats[key]), float(self.lons[key]))
+        if not isinstance(key, slice):
+            key = _positions(key)
+        return self._view(self.names[key], self.lats[key], self.lons[key])
+
+    def __eq__(self, other):
+        if not isinstance(other, LocationSet):
+            try:
+                other = LocationSet.from_locations(other)
+            except (TypeError, ValueError):
+                return NotImplemented
+        return (len(self) == len(other) and np.array_equal(self.lats, other.lats)
+                and np.array_equal(self.lons, other.lons) and np.array_equal(self.names, other.names))
+
+    __hash__ = None
+
+    def __contains__(self, item):
+        # a name, or a (name, (lat, lon)) pair like the lists this replaces
+        if isinstance(item, str):
+            return self.find(item) is not None
+        name, (lat, lon) = item
+        return bool(((self.names == name) & (self.lats == lat) & (self.lons == lon)).any())
+
+    def __reduce__(self):
+        return LocationSet, (self.names, self.lats, self.lons)
+
+    def __repr__(self):
+        return f"LocationSet({len(self)} stops)"
+
+    def find(self, name, ignore_case=False):
+        """Index of the first stop called ``name``, or None."""
+        if ignore_case:
+            if self._folded is None:
+                self._folded = {}
+                for i, n in enumerate(self.names.tolist()):
+                    self._folded.setdefault(n.casefold(), i)
+            return self._folded.get(name.casefold())
+        if self._index is None:
+            self._index = {}
+            for i, n in enumerate(self.names.tolist()):
+                self._index.setdefault(n, i)
+        return self._index.get(name)
+
+    def index(self, name):
+        i = self.find(name)
+        if i is None:
+            raise ValueError(f"{name!r} is not in the location set")
+        return i
+
+    def coords_at(self, indices=slice(None)):
+        # (k, 2) [lat, lon] rows of the stops at ``indices``, e.g. a route
+        if not isinstance(indices, slice):
+            indices = _positions(indices)
+        return np.column_stack((self.lats[indices], self.lons[indices]))
+
+    def append(self, location):
+        name, (lat, lon) = location
+        self.names = _frozen(np.concatenate((self.names, _name_table([name]))))
+        self.lats = _frozen(np.append(self.lats, float(lat)))
+        self.lons = _frozen(np.append(self.lons, float(lon)))
+        # the name indexes stay valid, only the new stop is added to them
+        name = self.names[-1]
+        if self._index is not None:
+            self._index.setdefault(name, len(self) - 1)
+        if self._folded is not None:
+            self._folded.setdefault(name.casefold(), len(self) - 1)
+
+    def pop(self, i=-1):
+        location = self[i]
+        self.names = _frozen(np.delete(self.names, i))
+        self.lats = _frozen(np.delete(self.lats, i))
+        self.lons = _frozen(np.delete(self.lons, i))
+        self._index = self._folded = None
+        return location
+
+
+def as_location_set(locations):
+    # LocationSets pass through; (name, (lat, lon)) sequences are converted
+    return LocationSet.from_locations(locations)
@@ -1,12 +1,37 @@
 
-import folium #for map
+import math
 import os
-import webbrowser #open to new browser
-from geopy.distance import geodesic  #cal distance between two points
+import numpy as np
+
+import profiling
+from location_set import as_location_set
+
+# above this many stops maps switch to compact layers: one GeoJSON layer
+# for all route lines and one client-side cluster layer for all stops
+COMPACT_MIN_STOPS = 200
+# lines are simplified to about this many screen pixels at the fit zoom
+SIMPLIFY_PIXELS = 1.5
+
+ROUTE_COLORS = ["#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4"]
+
+# folium, geopy and webbrowser are imported where used: loading folium
+# alone takes longer than solving most routes, and headless runs that
+# never draw a map should not pay for it
+
+# builds each stop's marker in the browser from a [lat, lon, label, color] row
+_STOP_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: 6, color: row[3], fillColor: row[3], fillOpacity: 0.9, weight: 1});
+    marker.bindTooltip(row[2]);
+    return marker;
+}
+"""
 
 
 
 def compute_total_distance(locations, route):
+    from geopy.distance import geodesic  #cal distance between two points
     total = 0.0
     for i in range(len(route) - 1):
         point_a = locations[route[i]]
@@ -15,21 +40,127 @@ def compute_total_distance(locations, route):
     return total
 
 
-def plot_route(locations, route, total_distance):
-    coords = [locations[i][1] for i in route]
-    names = [locations[i][0] for i in route]
+def douglas_peucker(points, tolerance):
+    # indices of the points kept by Douglas-Peucker simplification of an
+    # (n, 2) polyline, iterative so long routes don't hit the recursion limit
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = points[first], points[last]
+        inner = points[first + 1:last]
+        ab = b - a
+        length = math.hypot(*ab)
+        if length == 0:
+            dist = np.hypot(*(inner - a).T)
+        else:
+            dist = np.abs(ab[0] * (inner[:, 1] - a[1]) - ab[1] * (inner[:, 0] - a[0])) / length
+        i = int(dist.argmax())
+        if dist[i] > tolerance:
+            mid = first + 1 + i
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+    return np.flatnonzero(keep)
+
+
+def fit_zoom(coords, width_px=800):
+    # web-mercator zoom at which all coords fit in about width_px pixels
+    lats, lons = np.asarray(coords, dtype=np.float64).T
+    span = max(lons.max() - lons.min(), (lats.max() - lats.min()) / math.cos(math.radians(lats.mean())), 1e-6)
+    return int(max(1, min(18, math.log2(360 * width_px / (256 * span)))))
+
+
+def simplify_path(coords, zoom):
+    # drop vertices closer than SIMPLIFY_PIXELS to the line at this zoom;
+    # lon is scaled by cos(lat) so the tolerance is isotropic
+    points = np.asarray(coords, dtype=np.float64)
+    if len(points) < 3:
+        return points.tolist()
+    scale = math.cos(math.radians(points[:, 0].mean()))
+    plane = np.column_stack([points[:, 1] * scale, points[:, 0]])
+    tolerance = SIMPLIFY_PIXELS * 360 / (256 * 2 ** zoom) * scale
+    return points[douglas_peucker(plane, tolerance)].tolist()
+
+
+def add_compact_layers(route_map, paths, stops, zoom, names=None):
+    """All route lines as one GeoJSON layer and all stops as one clustered
+    layer built in the browser.
+
+    ``paths`` are (coords, color) per route, simplified for ``zoom``;
+    ``stops`` are (lat, lon, label, color) rows.
+    """
+    import folium
+    from folium.plugins import FastMarkerCluster  #client-side clustering
+    features = []
+    for i, (coords, color) in enumerate(paths):
+        line = simplify_path(coords, zoom)
+        features.append({
+            "type": "Feature",
+            "properties": {"color": color, "name": names[i] if names else f"Route {i + 1}"},
+            # GeoJSON positions are (lon, lat)
+            "geometry": {"type": "LineString",
+                         "coordinates": [[round(lon, 6), round(lat, 6)] for lat, lon in line]},
+        })
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        name="Routes",
+        style_function=lambda feature: {"color": feature["properties"]["color"],
+                                        "weight": 4.5, "opacity": 0.8},
+        tooltip=folium.GeoJsonTooltip(fields=["name"], labels=False),
+    ).add_to(route_map)
+    rows = [[round(lat, 6), round(lon, 6), label, color] for lat, lon, label, color in stops]
+    FastMarkerCluster(rows, callback=_STOP_CALLBACK, name="Stops").add_to(route_map)
+
 
-    route_map = folium.Map(location=coords[0], zoom_start=13)
-    folium.PolyLine(coords, color="blue", weight=4.5, opacity=0.8).add_to(route_map)
+@profiling.stage("plot_route")
+def plot_route(locations, route, total_distance, compact=None,
+               filename="optimized_route_map.html", open_browser=True):
+    import folium #for map
+    locations = as_location_set(locations)
+    coords = locations.coords_at(route).tolist()
+    names = locations.names[route].tolist()
+    if compact is None:
+        compact = len(route) > COMPACT_MIN_STOPS
 
-    for idx, (name, (lat, lon)) in enumerate([locations[i] for i in route]):
+    zoom = fit_zoom(coords) if compact else 13
+    route_map = folium.Map(location=coords[0], zoom_start=zoom)
+    if compact:
+        # a closed tour lists its start twice; the start gets its own marker
+        visits = route[1:-1] if len(route) > 1 and route[0] == route[-1] else route[1:]
+        stops = [(lat, lon, f"{idx+2}. {name}", "#3388ff") for idx, (name, lat, lon) in
+                 enumerate(zip(locations.names[visits], locations.lats[visits].tolist(),
+                               locations.lons[visits].tolist()))]
+        add_compact_layers(route_map, [(coords, "blue")], stops, zoom, names=["Route"])
         folium.Marker(
-            location=(lat, lon),
-            popup=f"{idx+1}. {name}",
-            tooltip=f"{idx+1}. {name}",
-            icon=folium.Icon(color="green" if idx == 0 else "blue", icon="info-sign")
+            location=coords[0],
+            tooltip=f"1. {names[0]}",
+            icon=folium.Icon(color="green", icon="info-sign")
         ).add_to(route_map)
+    else:
+        folium.PolyLine(coords, color="blue", weight=4.5, opacity=0.8).add_to(route_map)
+
+        for idx, (name, (lat, lon)) in enumerate(zip(names, coords)):
+            folium.Marker(
+                location=(lat, lon),
+                popup=f"{idx+1}. {name}",
+                tooltip=f"{idx+1}. {name}",
+                icon=folium.Icon(color="green" if idx == 0 else "blue", icon="info-sign")
+            ).add_to(route_map)
+
+    _add_total(route_map, coords[0], total_distance)
+    return _save(route_map, filename, open_browser)
+
 
+def _add_total(route_map, location, total_distance):
+    import folium
     html = f"""
         <div style="font-size: 14px; color: black; background-color: white;
                     padding: 6px; border-radius: 8px;">
@@ -37,11 +168,56 @@ def plot_route(locations, route, total_distance):
         </div>
     """
     folium.Marker(
-        location=coords[0],
+        location=location,
         icon=folium.DivIcon(html=html)
     ).add_to(route_map)
 
-    filename = "optimized_route_map.html"
+
+def _save(route_map, filename, open_browser):
+    # interactive runs announce the file and open it; batch runs stay quiet
     route_map.save(filename)
-    print(f"Map saved as {filename}")
-    webbrowser.open("file://" + os.path.realpath(filename))
\ No newline at end of file
+    if open_browser:
+        import webbrowser #open to new browser
+        print(f"Map saved as {filename}")
+        webbrowser.open("file://" + os.path.realpath(filename))
+    return filename
+
+
+@profiling.stage("plot_routes")
+def plot_routes(locations, routes, total_distance, filename="optimized_routes_map.html",
+                open_browser=False, compact=None):
+    """Vehicle routes ([depot, ..., depot]) on one map, one colour each."""
+    import folium
+    locations = as_location_set(locations)
+    depot = routes[0][0]
+    paths, names, stops = [], [], []
+    for i, route in enumerate(routes):
+        if len(route) <= 2:
+            continue
+        color = ROUTE_COLORS[i % len(ROUTE_COLORS)]
+        paths.append((locations.coords_at(route).tolist(), color))
+        names.append(f"Vehicle {i+1}")
+        visits = route[1:-1]
+        for j, (name, lat, lon) in enumerate(zip(locations.names[visits], locations.lats[visits].tolist(),
+                                                 locations.lons[visits].tolist()), 1):
+            stops.append((lat, lon, f"Vehicle {i+1} stop {j}: {name}", color))
+    if compact is None:
+        compact = len(stops) > COMPACT_MIN_STOPS
+
+    zoom = fit_zoom(np.concatenate([locations.coords_at(route) for route in routes])) if compact else 13
+    route_map = folium.Map(location=locations[depot][1], zoom_start=zoom)
+    if compact:
+        add_compact_layers(route_map, paths, stops, zoom, names)
+    else:
+        for (path, color), name in zip(paths, names):
+            folium.PolyLine(path, color=color, weight=4.5, opacity=0.8, tooltip=name).add_to(route_map)
+        for lat, lon, label, color in stops:
+            folium.CircleMarker((lat, lon), radius=6, color=color, fill=True, fill_color=color,
+                                tooltip=label).add_to(route_map)
+    folium.Marker(
+        locations[depot][1],
+        tooltip=f"Depot: {locations[depot][0]}",
+        icon=folium.Icon(color="black", icon="home")
+    ).add_to(route_map)
+    _add_total(route_map, locations[depot][1], total_distance)
+    return _save(route_map, filename, open_browser)
@@ -0,0 +1,273 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+import profiling
+from distance_utils import ASYMMETRIC_METHODS, coords_to_arrays, pairwise_distances
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: the store is then safe for one process only
+    fcntl = None
+
+DEFAULT_CACHE_DIR = ".route_cache"
+# stops kept before the least recently used are evicted; the matrix file
+# holds capacity**2 float64s, so 4096 stops is 128 MB
+DEFAULT_MAX_STOPS = 4096
+
+
+def coord_key(lat, lon):
+    # stable per-coordinate hash (1e-9 degrees is well under a millimetre)
+    return hashlib.blake2b(f"{lat:.9f},{lon:.9f}".encode(), digest_size=8).hexdigest()
+
+
+class DistanceMatrixCache:
+    """Distance matrix persisted in a memory-mapped file.
+
+    Each distinct coordinate owns a slot (a row and a column of the stored
+    matrix). A distance is computed the first time its two stops are
+    requested together, and a byte map alongside the matrix records which
+    pairs are filled in. Past ``max_stops`` the least recently requested
+    stops are evicted; discarding a stop just frees its slot for reuse.
+
+    Processes sharing a store serialise on an flock of its lock file and
+    reload the index whenever another process has rewritten it. An index
+    whose capacity does not match the files on disk (a crash mid-resize)
+    is thrown away and the store starts empty.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, method="ellipsoidal", initial_capacity=64,
+                 max_stops=DEFAULT_MAX_STOPS):
+        self.method = method
+        self.max_stops = max_stops
+        self.initial_capacity = initial_capacity
+        self.dir = os.path.join(path, method)
+        self._index_path = os.path.join(self.dir, "index.json")
+        self._matrix_path = os.path.join(self.dir, "matrix.dat")
+        self._known_path = os.path.join(self.dir, "known.dat")
+        self._lock_path = os.path.join(self.dir, "lock")
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._pid = None
+        self._token = None
+        self._matrix = self._known = None
+        os.makedirs(self.dir, exist_ok=True)
+        with self._locked():
+            pass
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            # flock belongs to the open file, which a forked worker would share
+            if self._pid != os.getpid():
+                self._lock_file = open(self._lock_path, "a")
+                self._pid = os.getpid()
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                self._sync()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _index_token(self):
+        # every save replaces index.json, so a new inode means a new index
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _sync(self):
+        token = self._index_token()
+        if token is not None and token == self._token:
+            return
+        if token is None or not self._load(token):
+            self._reset(self.initial_capacity)
+
+    def _load(self, token):
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+            capacity = index["capacity"]
+            if (index["method"] != self.method
+                    or os.path.getsize(self._matrix_path) != capacity * capacity * 8
+                    or os.path.getsize(self._known_path) != capacity * capacity):
+                return False
+            self._size = index["size"]
+            self._slots = index["slots"]
+            self._free = index["free"]
+            lats, lons = index["lats"], index["lons"]
+        except (OSError, ValueError, KeyError):
+            return False
+        self._capacity = capacity
+        self._lats = np.zeros(capacity)
+        self._lons = np.zeros(capacity)
+        self._lats[:self._size] = lats
+        self._lons[:self._size] = lons
+        self._map("r+")
+        self._token = token
+        return True
+
+    def _map(self, mode):
+        self._close()
+        shape = (self._capacity, self._capacity)
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float64, mode=mode, shape=shape)
+        self._known = np.memmap(self._known_path, dtype=np.uint8, mode=mode, shape=shape)
+
+    def _close(self):
+        for array in (self._matrix, self._known):
+            if array is not None:
+                array._mmap.close()
+        self._matrix = self._known = None
+
+    def _reset(self, capacity):
+        self._capacity = capacity
+        self._size = 0  # high-water mark of used slots
+        self._slots = {}  # least recently requested first
+        self._free = []
+        self._lats = np.zeros(capacity)
+        self._lons = np.zeros(capacity)
+        self._map("w+")
+        self._save_index()
+
+    def __len__(self):
+        with self._locked():
+            return len(self._slots)
+
+    def __contains__(self, coords):
+        with self._locked():
+            return coord_key(*coords) in self._slots
+
+    def _grow(self, needed):
+        capacity = max(needed, min(2 * self._capacity, max(self.max_stops, self.initial_capacity)))
+        for path, array in ((self._matrix_path, self._matrix), (self._known_path, self._known)):
+            grown = np.memmap(path + ".tmp", dtype=array.dtype, mode="w+", shape=(capacity, capacity))
+            grown[:self._size, :self._size] = array[:self._size, :self._size]
+            grown.flush()
+            del grown
+        self._close()
+        # the index still names the old capacity until it is saved below; if
+        # we die in between, the size check in _load discards the store
+        os.replace(self._matrix_path + ".tmp", self._matrix_path)
+        os.replace(self._known_path + ".tmp", self._known_path)
+        self._lats = np.concatenate([self._lats, np.zeros(capacity - self._capacity)])
+        self._lons = np.concatenate([self._lons, np.zeros(capacity - self._capacity)])
+        self._capacity = capacity
+        self._map("r+")
+        self._save_index()
+
+    def _save_index(self):
+        index = {
+            "method": self.method,
+            "capacity": self._capacity,
+            "size": self._size,
+            "slots": self._slots,
+            "free": self._free,
+            "lats": self._lats[:self._size].tolist(),
+            "lons": self._lons[:self._size].tolist(),
+        }
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path)
+        self._token = self._index_token()
+
+    def _evict(self, keep):
+        # free the least recently requested slot not needed by this request
+        for key in self._slots:
+            if key not in keep:
+                self._free.append(self._slots.pop(key))
+                return
+
+    def _add(self, lats, lons):
+        keys = [coord_key(lat, lon) for lat, lon in zip(lats, lons)]
+        requested = set(keys)
+        for key in keys:
+            slot = self._slots.pop(key, None)
+            if slot is None:
+                if len(self._slots) >= self.max_stops and not self._free:
+                    self._evict(requested)
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    if self._size == self._capacity:
+                        self._grow(self._size + 1)
+                    slot = self._size
+                    self._size += 1
+                # a reused slot forgets every distance it had
+                self._known[slot, :] = 0
+                self._known[:, slot] = 0
+            # re-inserting moves the key to the most recently requested end
+            self._slots[key] = slot
+        slots = np.array([self._slots[key] for key in keys], dtype=np.int64)
+        for slot, lat, lon in zip(slots.tolist(), lats, lons):
+            self._lats[slot] = lat
+            self._lons[slot] = lon
+
+        # only pairs within this request are computed
+        unique = np.unique(slots)
+        missing = self._known[np.ix_(unique, unique)] == 0
+        rows = unique[missing.any(axis=1) | missing.any(axis=0)]
+        if len(rows):
+            block = pairwise_distances(self._lats[rows], self._lons[rows],
+                                       self._lats[unique], self._lons[unique], self.method)
+            self._matrix[rows[:, None], unique[None, :]] = block
+            if self.method in ASYMMETRIC_METHODS:
+                block = pairwise_distances(self._lats[unique], self._lons[unique],
+                                           self._lats[rows], self._lons[rows], self.method)
+                self._matrix[unique[:, None], rows[None, :]] = block
+            else:
+                self._matrix[unique[:, None], rows[None, :]] = block.T
+            self._matrix[rows, rows] = 0.0
+            self._known[rows[:, None], unique[None, :]] = 1
+            self._known[unique[:, None], rows[None, :]] = 1
+            self._matrix.flush()
+            self._known.flush()
+        self._save_index()
+        return slots
+
+    def matrix_for(self, lats, lons):
+        with self._locked():
+            slots = self._add(lats, lons)
+            return np.array(self._matrix[np.ix_(slots, slots)])
+
+    def get_matrix(self, locations):
+        lats, lons = coords_to_arrays(locations)
+        return self.matrix_for(lats, lons)
+
+    def discard(self, coords):
+        # drop a stop's row and column by releasing its slot
+        with self._locked():
+            slot = self._slots.pop(coord_key(*coords), None)
+            if slot is not None:
+                self._free.append(slot)
+                self._save_index()
+
+    def clear(self):
+        # also shrinks the files back to the initial capacity
+        with self._locked():
+            self._reset(self.initial_capacity)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path=DEFAULT_CACHE_DIR, method="ellipsoidal"):
+    # one instance per store so every caller in the process shares the lock
+    key = (os.path.abspath(path), method)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = DistanceMatrixCache(path, method)
+        return _caches[key]
+
+
+@profiling.stage("cached_distance_matrix")
+def cached_distance_matrix(locations, method="ellipsoidal", path=DEFAULT_CACHE_DIR):
+    return get_cache(path, method).get_matrix(locations)
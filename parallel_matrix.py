@@ -0,0 +1,89 @@
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from distance_utils import geodesic_matrix, pairwise_distances
+
+# below this many stops one vectorized call beats starting a pool
+PARALLEL_MIN_STOPS = 2000
+# geopy's exact solver is ~10^4 times slower per pair, so it pays off sooner
+GEODESIC_PARALLEL_MIN_STOPS = 200
+# rows/columns per tile: a 512 x 512 float64 tile is 2 MB of temporaries
+TILE_SIZE = 512
+# geodesic tiles are small so a few hundred stops still spread over cores
+GEODESIC_TILE_SIZE = 64
+
+_shared = {}
+
+
+def _attach(name, size, lats, lons, method):
+    # pool initializer: map the parent's output buffer once per worker
+    block = shared_memory.SharedMemory(name=name)
+    _shared["block"] = block
+    _shared["matrix"] = np.ndarray((size, size), dtype=np.float64, buffer=block.buf)
+    _shared["lats"] = lats
+    _shared["lons"] = lons
+    _shared["method"] = method
+
+
+def _fill_tile(i0, i1, j0, j1):
+    # computes one tile and writes it (and its mirror) straight into the
+    # shared matrix; nothing but the coordinates goes back to the parent
+    matrix, lats, lons = _shared["matrix"], _shared["lats"], _shared["lons"]
+    method = _shared["method"]
+    if i0 == j0 and method == "geodesic":
+        block = geodesic_matrix(lats[i0:i1], lons[i0:i1])
+    else:
+        block = pairwise_distances(lats[i0:i1], lons[i0:i1], lats[j0:j1], lons[j0:j1], method)
+    if i0 == j0:
+        np.fill_diagonal(block, 0.0)
+    matrix[i0:i1, j0:j1] = block
+    if i0 != j0:
+        matrix[j0:j1, i0:i1] = block.T
+    return i0, j0
+
+
+def _tiles(size, tile):
+    # upper-triangle tiles, largest work first
+    starts = range(0, size, tile)
+    tiles = [(i, min(i + tile, size), j, min(j + tile, size)) for i in starts for j in starts if j >= i]
+    # the short tiles on the ragged edge go last, so they fill in the tail
+    return sorted(tiles, key=lambda t: (t[1] - t[0]) * (t[3] - t[2]), reverse=True)
+
+
+def _shared_matrix(block, size):
+    # the array keeps the shared block alive and closes it once collected
+    matrix = np.ndarray((size, size), dtype=np.float64, buffer=block.buf)
+    weakref.finalize(matrix, block.close)
+    return matrix
+
+
+def parallel_distance_matrix(lats, lons, method="ellipsoidal", workers=None, tile=None):
+    """Symmetric n x n matrix filled tile by tile from a process pool.
+
+    Workers write into one shared memory block, so results are never
+    pickled or copied; only upper-triangle tiles are computed and each is
+    mirrored in place. The returned array is backed by that block.
+    """
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+    size = len(lats)
+    workers = workers or os.cpu_count() or 1
+    tile = tile or (GEODESIC_TILE_SIZE if method == "geodesic" else TILE_SIZE)
+
+    block = shared_memory.SharedMemory(create=True, size=max(size * size * 8, 1))
+    try:
+        with ProcessPoolExecutor(workers, initializer=_attach,
+                                 initargs=(block.name, size, lats, lons, method)) as pool:
+            for _ in pool.map(_fill_tile, *zip(*_tiles(size, tile))):
+                pass
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    # the name is no longer needed once every worker has exited
+    block.unlink()
+    return _shared_matrix(block, size)
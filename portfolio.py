@@ -0,0 +1,136 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import profiling
+from cvrp_solver import solve_cvrp
+from held_karp import EXACT_MAX_STOPS, solve_tsp_exact
+from tsp_solver import default_time_limit, solve_tsp
+
+# (first solution strategy, metaheuristic, seed). Seed 0 keeps the input
+# order; other seeds relabel the stops, which changes OR-Tools' tie-breaking
+# and so where each search ends up.
+DEFAULT_CONFIGS = [
+    ("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH", 0),
+    ("SAVINGS", "GUIDED_LOCAL_SEARCH", 0),
+    ("PARALLEL_CHEAPEST_INSERTION", "GUIDED_LOCAL_SEARCH", 0),
+    ("PATH_CHEAPEST_ARC", "SIMULATED_ANNEALING", 0),
+    ("PATH_CHEAPEST_ARC", "TABU_SEARCH", 0),
+    ("CHRISTOFIDES", "GUIDED_LOCAL_SEARCH", 0),
+    ("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH", 1),
+    ("SAVINGS", "TABU_SEARCH", 2),
+]
+
+# seconds kept back from the budget for pool start-up and result collection
+STARTUP_MARGIN = 0.5
+
+_shared = {}
+
+
+def _attach(name, shape):
+    # pool initializer: map the parent's matrix instead of receiving a copy
+    block = shared_memory.SharedMemory(name=name)
+    _shared["block"] = block
+    _shared["matrix"] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+
+def _permutation(n, seed, fixed):
+    # new index i stands for old stop perm[i]; ``fixed`` keeps its index
+    perm = np.arange(n)
+    if seed:
+        rest = np.array([i for i in range(n) if i != fixed])
+        perm[rest] = np.random.default_rng(seed).permutation(rest)
+    return perm
+
+
+def _tsp_worker(config, return_to_start, deadline):
+    strategy, metaheuristic, seed = config
+    matrix = _shared["matrix"]
+    perm = _permutation(len(matrix), seed, 0)
+    if seed:
+        matrix = matrix[np.ix_(perm, perm)]
+    route, total = solve_tsp(matrix, return_to_start, deadline=deadline,
+                             first_solution_strategy=strategy, metaheuristic=metaheuristic,
+                             exact_max_stops=0)
+    if route is None:
+        return None
+    return total, [int(perm[i]) for i in route], config
+
+
+def _cvrp_worker(config, demands, vehicle_capacity, num_vehicles, depot, deadline):
+    strategy, metaheuristic, seed = config
+    matrix = _shared["matrix"]
+    perm = _permutation(len(matrix), seed, depot)
+    shuffled = matrix[np.ix_(perm, perm)] if seed else matrix
+    routes = solve_cvrp(shuffled, [demands[i] for i in perm],
+                        vehicle_capacity, num_vehicles, depot, deadline=deadline,
+                        first_solution_strategy=strategy, metaheuristic=metaheuristic)
+    if routes is None:
+        return None
+    routes = [[int(perm[i]) for i in route] for route in routes]
+    total = sum(matrix[r[i]][r[i + 1]] for r in routes for i in range(len(r) - 1))
+    return round(float(total), 2), routes, config
+
+
+def _run_portfolio(distance_matrix, configs, workers, worker, *args):
+    matrix = np.ascontiguousarray(distance_matrix, dtype=np.float64)
+    configs = configs or DEFAULT_CONFIGS
+    workers = workers or min(len(configs), os.cpu_count() or 1)
+    # all workers share one deadline, so configs queued behind a busy
+    # worker would start too late to matter
+    configs = configs[:workers]
+
+    block = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+    try:
+        np.ndarray(matrix.shape, dtype=np.float64, buffer=block.buf)[:] = matrix
+        best = None
+        with ProcessPoolExecutor(workers, initializer=_attach,
+                                 initargs=(block.name, matrix.shape)) as pool:
+            futures = [pool.submit(worker, config, *args) for config in configs]
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None and (best is None or result[0] < best[0]):
+                    best = result
+        return best
+    finally:
+        block.close()
+        block.unlink()
+
+
+@profiling.stage("solve_tsp_portfolio")
+def solve_tsp_portfolio(distance_matrix, return_to_start=True, time_limit=None,
+                        workers=None, configs=None):
+    """Run several OR-Tools strategies in parallel and keep the best tour.
+
+    Returns (route, total_distance, config) like solve_tsp plus the winning
+    (strategy, metaheuristic, seed). Every worker shares the same deadline,
+    so the whole call takes about ``time_limit`` seconds of wall time.
+    """
+    if len(distance_matrix) <= EXACT_MAX_STOPS:
+        route, total = solve_tsp_exact(distance_matrix, return_to_start)
+        return route, total, ("HELD_KARP", None, 0)
+    if time_limit is None:
+        time_limit = default_time_limit(len(distance_matrix))
+    deadline = time.time() + time_limit - STARTUP_MARGIN
+    best = _run_portfolio(distance_matrix, configs, workers, _tsp_worker,
+                          return_to_start, deadline)
+    if best is None:
+        return None, None, None
+    total, route, config = best
+    return route, total, config
+
+
+@profiling.stage("solve_cvrp_portfolio")
+def solve_cvrp_portfolio(distance_matrix, demands, vehicle_capacity, num_vehicles, depot=0,
+                         time_limit=10, workers=None, configs=None):
+    # CVRP counterpart of solve_tsp_portfolio: returns (routes, config)
+    deadline = time.time() + time_limit - STARTUP_MARGIN
+    best = _run_portfolio(distance_matrix, configs, workers, _cvrp_worker,
+                          list(demands), vehicle_capacity, num_vehicles, depot, deadline)
+    if best is None:
+        return None, None
+    _, routes, config = best
+    return routes, config
@@ -0,0 +1,190 @@
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# ROUTE_PROFILE=1 times stages, =memory adds tracemalloc peaks and top
+# allocations, =cprofile adds a cProfile listing
+PROFILE_ENV = "ROUTE_PROFILE"
+TOP_ENTRIES = 25
+
+# the trace of the current run; a context variable so Streamlit sessions
+# (one script thread each) never record into each other's trace
+_current = contextvars.ContextVar("route_trace", default=None)
+_NULL = contextlib.nullcontext()
+
+
+def _rss_peak_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Trace:
+    """Wall time, call count and peak memory per stage, plus counters.
+
+    Peak memory is the tracemalloc peak above the stage's starting point
+    when ``memory`` is set, otherwise the process's peak RSS after it.
+    """
+
+    def __init__(self, memory=False, profile=False):
+        self.memory = memory
+        self.stages = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.allocations = None
+        self._frames = []
+        self._owns_tracemalloc = memory and not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+        self.profiler = cProfile.Profile() if profile else None
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._frames:
+                # the reset below would hide the parent's peak so far
+                self._frames[-1][1] = max(self._frames[-1][1], peak)
+            tracemalloc.reset_peak()
+            frame = [current, current]
+            self._frames.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += time.perf_counter() - start
+            if self.memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame[1])
+                self._frames.pop()
+                if self._frames:
+                    self._frames[-1][1] = max(self._frames[-1][1], peak)
+                stage["peak_bytes"] = max(stage.get("peak_bytes", 0), peak - frame[0])
+            else:
+                rss = _rss_peak_mb()
+                if rss is not None:
+                    stage["rss_peak_mb"] = round(rss, 1)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def close(self):
+        if self.seconds is not None:
+            return
+        self.seconds = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.memory:
+            top = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ENTRIES]
+            self.allocations = [f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} "
+                                f"{stat.size / 1024:.1f} KiB in {stat.count} blocks" for stat in top]
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+
+    def profile_text(self, limit=TOP_ENTRIES):
+        if self.profiler is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def to_dict(self):
+        report = {
+            "seconds": round(self.seconds if self.seconds is not None
+                             else time.perf_counter() - self.started, 6),
+            "stages": {name: {**stage, "seconds": round(stage["seconds"], 6)}
+                       for name, stage in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+        if self.allocations is not None:
+            report["allocations"] = self.allocations
+        if self.profiler is not None:
+            report["profile"] = self.profile_text()
+        return report
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def current():
+    return _current.get()
+
+
+def span(name):
+    # ``with span("solve"):`` records into the current trace, if any
+    trace = _current.get()
+    return _NULL if trace is None else trace.span(name)
+
+
+def stage(name):
+    """Decorator timing every call of a function as stage ``name``."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            with trace.span(name):
+                return fn(*args, **kwargs)
+        return timed
+    return decorate
+
+
+def count(name, n=1):
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, n)
+
+
+def begin(memory=False, profile=False):
+    """Start a trace for this run (context), replacing any left behind by
+    an interrupted one."""
+    end()
+    trace = Trace(memory, profile)
+    _current.set(trace)
+    return trace
+
+
+def end():
+    trace = _current.get()
+    if trace is not None:
+        trace.close()
+        _current.set(None)
+    return trace
+
+
+@contextlib.contextmanager
+def trace(memory=False, profile=False):
+    token = _current.set(Trace(memory, profile))
+    try:
+        yield _current.get()
+    finally:
+        _current.get().close()
+        _current.reset(token)
+
+
+def trace_from_env():
+    """``trace()`` configured by ROUTE_PROFILE, or a no-op yielding None."""
+    mode = os.environ.get(PROFILE_ENV, "").strip().lower()
+    if mode in ("", "0", "off", "false"):
+        return contextlib.nullcontext()
+    return trace(memory=mode == "memory", profile=mode == "cprofile")
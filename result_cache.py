@@ -0,0 +1,174 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from location_set import as_location_set
+
+# total size of cached results (routes, metrics and map HTML) per process
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def problem_fingerprint(kind, locations, **params):
+    """Stable hash of everything a solved result depends on.
+
+    ``locations`` are a LocationSet or (name, (lat, lon)) pairs, which hash
+    the same; coordinates are taken at 9 decimals like the matrix cache.
+    Extra parameters (demands, capacity, vehicle count, depot, method...)
+    are hashed by value.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(kind.encode())
+    locations = as_location_set(locations)
+    for name, lat, lon in zip(locations.names.tolist(), locations.lats.tolist(), locations.lons.tolist()):
+        digest.update(f"{name}\x1f{lat:.9f},{lon:.9f}\x1e".encode())
+    for key in sorted(params):
+        digest.update(f"{key}={params[key]!r}\x1e".encode())
+    return digest.hexdigest()
+
+
+def pack_routes(routes, distance_matrix=None, demands=None):
+    """Routes as one int32 node array with route offsets, plus per-route
+    km and load when the matrix and demands are given.
+
+    A few bytes per stop instead of a list of Python ints per route, so
+    sessions and cache entries can hold results for large plans.
+    """
+    lengths = [len(route) for route in routes]
+    packed = {
+        "nodes": np.fromiter((n for route in routes for n in route), dtype=np.int32,
+                             count=sum(lengths)),
+        "offsets": np.concatenate(([0], np.cumsum(lengths))).astype(np.int32),
+    }
+    if distance_matrix is not None:
+        matrix = np.asarray(distance_matrix, dtype=np.float64)
+        packed["km"] = np.array([matrix[route[:-1], route[1:]].sum() for route in routes])
+    if demands is not None:
+        packed["load"] = np.array([sum(demands[n] for n in route[1:-1]) for route in routes],
+                                  dtype=np.int64)
+    return packed
+
+
+def unpack_routes(packed):
+    # back to a list of [node, ...] lists for solvers and rendering
+    nodes, offsets = packed["nodes"].tolist(), packed["offsets"].tolist()
+    return [nodes[a:b] for a, b in zip(offsets, offsets[1:])]
+
+
+def _size(value):
+    # rough deep size of the plain values stored here
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size(k) + _size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """LRU cache of solved results with a memory cap, shared by all sessions.
+
+    Entries are dicts (e.g. routes, total_km, map_html); fields can be
+    added later with ``update``, so a map rendered for one session is
+    reused by the next. Concurrent requests for the same fingerprint wait
+    for one computation instead of each running the solver.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _store(self, key, entry):
+        # caller holds the lock
+        self.bytes -= self._sizes.pop(key, 0)
+        size = _size(entry)
+        if size > self.max_bytes:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._sizes[key] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old, _ = self._entries.popitem(last=False)
+            self.bytes -= self._sizes.pop(old)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._store(key, dict(entry))
+
+    def update(self, key, **fields):
+        # add fields (e.g. rendered HTML) to an entry that is still cached
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._store(key, {**entry, **fields})
+
+    def get_or_compute(self, key, compute):
+        """Cached entry for ``key``, or ``compute()`` run once however many
+        callers ask for the same key at the same time. ``None`` results are
+        not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry
+            self.misses += 1
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            # the owner's failure (or a rerun interrupting it) is not ours:
+            # fall back to computing here
+            return future.result() or compute()
+        entry = None
+        try:
+            entry = compute()
+            if entry is not None:
+                entry = dict(entry)
+        finally:
+            with self._lock:
+                del self._pending[key]
+                if entry is not None:
+                    self._store(key, entry)
+            future.set_result(entry)
+        return entry
+
+    def field(self, key, name, compute):
+        # one field of a cached entry, computed and stored on first use
+        entry = self.get(key) or {}
+        if name not in entry:
+            value = compute()
+            self.update(key, **{name: value})
+            return value
+        return entry[name]
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes,
+                "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,309 @@
+import heapq
+import json
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from distance_utils import EARTH_RADIUS_KM, ellipsoidal_distances
+from spatial_index import GridIndex, project
+
+# Default extract for method="road" in distance_utils
+DEFAULT_NETWORK_PATH = os.environ.get("ROAD_NETWORK_PATH", os.path.join("data", "jabalpur.geojson"))
+
+# km/h by OSM highway class when a way has no usable maxspeed tag
+DEFAULT_SPEEDS = {
+    "motorway": 80, "trunk": 60, "primary": 45, "secondary": 35, "tertiary": 30,
+    "unclassified": 25, "residential": 20, "service": 15, "living_street": 10,
+    "motorway_link": 50, "trunk_link": 40, "primary_link": 35, "secondary_link": 30,
+    "tertiary_link": 25, "road": 25,
+}
+# ways of any other highway class (footway, path, ...) are not driveable
+FALLBACK_SPEED = None
+# speed for the straight-line hop between a stop and its snapped node
+ACCESS_SPEED = 15
+# pairs with no road path fall back to straight-line distance times this
+UNREACHABLE_DETOUR = 1.5
+# road searches give up past this times the straight line to the farthest
+# target (plus a km of slack); longer detours count as unreachable
+SEARCH_DETOUR = 3.0
+# bytes of (sources x graph nodes) costs one batch of searches may hold
+SEARCH_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def _speed(tags):
+    highway = tags.get("highway")
+    speed = DEFAULT_SPEEDS.get(highway, FALLBACK_SPEED)
+    if speed is None:
+        return None
+    maxspeed = str(tags.get("maxspeed", "")).split(" ")[0]
+    if maxspeed.isdigit():
+        speed = min(speed, int(maxspeed)) if int(maxspeed) > 0 else speed
+    return speed
+
+
+def _oneway(tags):
+    value = str(tags.get("oneway", "")).lower()
+    if value in ("yes", "true", "1"):
+        return 1
+    if value == "-1":
+        return -1
+    return 1 if tags.get("junction") == "roundabout" or tags.get("highway") == "motorway" else 0
+
+
+class RoadNetwork:
+    """Directed road graph in CSR form (indptr/indices/weights arrays).
+
+    Edge weights are kept both as km and as minutes at the way's speed.
+    Stops are snapped to the nearest node of the largest connected part of
+    the graph, so every snapped pair is normally reachable.
+    """
+
+    def __init__(self, lats, lons, edges_from, edges_to, lengths_km, minutes):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        n = len(self.lats)
+        order = np.argsort(edges_from, kind="stable")
+        self.indices = np.asarray(edges_to, dtype=np.int32)[order]
+        self.lengths = np.asarray(lengths_km, dtype=np.float64)[order]
+        self.minutes = np.asarray(minutes, dtype=np.float64)[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(np.asarray(edges_from)[order], minlength=n), out=self.indptr[1:])
+        self._snap_index = None
+
+    def __len__(self):
+        return len(self.lats)
+
+    @classmethod
+    def from_ways(cls, ways):
+        # ways: iterable of ([(lat, lon), ...], tags)
+        node_ids = {}
+        lats, lons = [], []
+        src, dst, speeds = [], [], []
+
+        def node(lat, lon):
+            key = (round(lat, 7), round(lon, 7))
+            if key not in node_ids:
+                node_ids[key] = len(lats)
+                lats.append(lat)
+                lons.append(lon)
+            return node_ids[key]
+
+        for points, tags in ways:
+            speed = _speed(tags)
+            if speed is None or len(points) < 2:
+                continue
+            direction = _oneway(tags)
+            ids = [node(lat, lon) for lat, lon in points]
+            for a, b in zip(ids, ids[1:]):
+                if a == b:
+                    continue
+                if direction >= 0:
+                    src.append(a)
+                    dst.append(b)
+                    speeds.append(speed)
+                if direction <= 0:
+                    src.append(b)
+                    dst.append(a)
+                    speeds.append(speed)
+
+        lats = np.array(lats)
+        lons = np.array(lons)
+        src = np.array(src, dtype=np.int64)
+        dst = np.array(dst, dtype=np.int64)
+        lengths = ellipsoidal_distances(lats[src], lons[src], lats[dst], lons[dst])
+        minutes = lengths / np.array(speeds, dtype=np.float64) * 60
+        return cls(lats, lons, src, dst, lengths, minutes)
+
+    def _largest_component(self):
+        # weakly connected components by union-find over the edge list
+        parent = np.arange(len(self))
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        sources = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        for a, b in zip(sources.tolist(), self.indices.tolist()):
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[ra] = rb
+        roots = np.array([find(x) for x in range(len(self))])
+        return np.flatnonzero(roots == np.bincount(roots).argmax())
+
+    def snap(self, lats, lons):
+        """Nearest graph node of each stop and the straight-line km to it."""
+        if self._snap_index is None:
+            keep = self._largest_component()
+            xs, ys = project(self.lats, self.lons)
+            self._snap_nodes = keep
+            self._snap_index = GridIndex(xs[keep], ys[keep])
+            self._cos_lat0 = np.cos(np.radians(self.lats.mean()))
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        # stops go through the graph's own projection so they line up with it
+        xs = EARTH_RADIUS_KM * np.radians(lons) * self._cos_lat0
+        ys = EARTH_RADIUS_KM * np.radians(lats)
+        nodes = np.array([self._snap_nodes[self._snap_index.nearest(x, y)] for x, y in zip(xs, ys)],
+                         dtype=np.int64)
+        offsets = ellipsoidal_distances(lats, lons, self.lats[nodes], self.lons[nodes])
+        return nodes, offsets
+
+    def _shortest(self, sources, targets, weights):
+        # many-to-many shortest path costs between graph nodes, searched in
+        # chunks of sources so the dense scipy output stays bounded
+        try:
+            from scipy.sparse import csr_matrix
+            from scipy.sparse.csgraph import dijkstra
+        except ImportError:
+            return np.array([self._dijkstra(s, targets, weights) for s in sources])
+        graph = csr_matrix((weights, self.indices, self.indptr), shape=(len(self), len(self)))
+        unique, inverse = np.unique(sources, return_inverse=True)
+        targets = np.asarray(targets, dtype=np.int64)
+        # weight per km of the slowest edge turns a km bound into a weight bound
+        per_km = np.divide(weights, self.lengths, out=np.ones_like(weights), where=self.lengths > 0)
+        per_km = float(per_km.max()) if len(per_km) else 1.0
+        chunk = max(1, SEARCH_CHUNK_BYTES // (8 * len(self)))
+        costs = np.empty((len(unique), len(targets)))
+        for start in range(0, len(unique), chunk):
+            part = unique[start:start + chunk]
+            straight = ellipsoidal_distances(self.lats[part][:, None], self.lons[part][:, None],
+                                             self.lats[targets][None, :], self.lons[targets][None, :])
+            limit = (float(straight.max()) * SEARCH_DETOUR + 1.0) * per_km
+            costs[start:start + chunk] = dijkstra(graph, directed=True, indices=part, limit=limit)[:, targets]
+        return costs[inverse]
+
+    def _dijkstra(self, source, targets, weights):
+        # plain heap Dijkstra that stops once every target is settled
+        remaining = set(int(t) for t in targets)
+        dist = {int(source): 0.0}
+        done = set()
+        heap = [(0.0, int(source))]
+        indptr, indices = self.indptr, self.indices
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            remaining.discard(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = int(indices[e])
+                nd = d + weights[e]
+                if nd < dist.get(v, np.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return np.array([dist.get(int(t), np.inf) if int(t) in done else np.inf for t in targets])
+
+    def pairwise(self, lat1, lon1, lat2, lon2, metric="distance"):
+        """Road km (metric="distance") or minutes ("time") from each stop in
+        set 1 to each stop in set 2. Not symmetric on one-way streets."""
+        lat1, lon1, lat2, lon2 = (np.asarray(a, dtype=np.float64) for a in (lat1, lon1, lat2, lon2))
+        src, src_off = self.snap(lat1, lon1)
+        dst, dst_off = self.snap(lat2, lon2)
+        straight = ellipsoidal_distances(lat1[:, None], lon1[:, None], lat2[None, :], lon2[None, :])
+        access = src_off[:, None] + dst_off[None, :]
+        if metric == "distance":
+            costs = self._shortest(src, dst, self.lengths) + access
+        elif metric == "time":
+            costs = self._shortest(src, dst, self.minutes) + access / ACCESS_SPEED * 60
+            straight = straight / ACCESS_SPEED * 60
+        else:
+            raise ValueError(f"Unknown road metric: {metric!r} (expected 'distance' or 'time')")
+        costs = np.where(np.isfinite(costs), costs, straight * UNREACHABLE_DETOUR)
+        # stops snapped to the same node are joined by the direct hop
+        return np.where(src[:, None] == dst[None, :], straight, costs)
+
+    def leg_costs(self, lats, lons, route, metric="distance"):
+        # cost of each consecutive leg of ``route``, one search per distinct stop
+        route = np.asarray(route, dtype=np.int64)
+        if len(route) < 2:
+            return np.empty(0)
+        stops, local = np.unique(route, return_inverse=True)
+        lats = np.asarray(lats, dtype=np.float64)[stops]
+        lons = np.asarray(lons, dtype=np.float64)[stops]
+        matrix = self.distance_matrix(lats, lons, metric)
+        return matrix[local[:-1], local[1:]]
+
+    def distance_matrix(self, lats, lons, metric="distance"):
+        matrix = self.pairwise(lats, lons, lats, lons, metric)
+        np.fill_diagonal(matrix, 0.0)
+        return matrix
+
+
+def _geojson_ways(path):
+    with open(path) as f:
+        data = json.load(f)
+    features = data.get("features", [data] if data.get("type") == "Feature" else [])
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        tags = feature.get("properties") or {}
+        lines = []
+        if geometry.get("type") == "LineString":
+            lines = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiLineString":
+            lines = geometry["coordinates"]
+        for line in lines:
+            # GeoJSON positions are (lon, lat)
+            yield [(pt[1], pt[0]) for pt in line], tags
+
+
+def _osm_xml_ways(path):
+    nodes = {}
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            nodes[elem.get("id")] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+            if "highway" in tags:
+                refs = [nd.get("ref") for nd in elem.iter("nd")]
+                yield [nodes[r] for r in refs if r in nodes], tags
+            elem.clear()
+
+
+def _pbf_ways(path):
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Reading .pbf extracts needs pyosmium (pip install osmium); "
+                          "or convert the extract with `osmium export -f geojson`") from None
+
+    ways = []
+
+    class Handler(osmium.SimpleHandler):
+        def way(self, w):
+            if "highway" in w.tags:
+                ways.append(([(n.lat, n.lon) for n in w.nodes if n.location.valid()],
+                             {tag.k: tag.v for tag in w.tags}))
+
+    Handler().apply_file(path, locations=True)
+    return ways
+
+
+def load_road_network(path=DEFAULT_NETWORK_PATH):
+    """Build a RoadNetwork from a .geojson, .osm (XML) or .pbf extract."""
+    lower = path.lower()
+    if lower.endswith((".geojson", ".json")):
+        ways = _geojson_ways(path)
+    elif lower.endswith(".osm"):
+        ways = _osm_xml_ways(path)
+    elif lower.endswith(".pbf"):
+        ways = _pbf_ways(path)
+    else:
+        raise ValueError(f"Unsupported road extract format: {path}")
+    return RoadNetwork.from_ways(ways)
+
+
+_networks = {}
+
+
+def get_road_network(path=DEFAULT_NETWORK_PATH):
+    # each extract is parsed once per process
+    if path not in _networks:
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No road network extract at {path}; set ROAD_NETWORK_PATH or pass a network")
+        _networks[path] = load_road_network(path)
+    return _networks[path]
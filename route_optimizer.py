@@ -1,14 +1,21 @@
 
 
 from sample_input import locations
-from distance_utils import compute_distance_matrix
-from tsp_solver import solve_tsp
+from matrix_cache import cached_distance_matrix
+from tsp_solver import solve_tsp, solve_tsp_local
+from portfolio import solve_tsp_portfolio
 # from tsp_solver import solve_tsp_greedy
 from map_visualizer import plot_route
+import profiling
 
 # Set this to False if you do NOT want to return to the origin
 return_to_start = True
 
+# "ortools" runs Guided Local Search for the full time limit,
+# "local" runs the native 2-opt / Or-opt / LK engine (milliseconds),
+# "portfolio" runs several OR-Tools strategies on all CPU cores
+solver = "ortools"
+
 def print_directions(locations, route):
     print(" Delivery Route Directions:")
     for i in range(len(route)):
@@ -17,11 +24,22 @@ def print_directions(locations, route):
 
 
 def main():
-    distance_matrix = compute_distance_matrix(locations)
-
-    distance_matrix = compute_distance_matrix(locations)
+    # Reuses rows/columns from earlier runs; only new stops are computed
+    distance_matrix = cached_distance_matrix(locations)
 
-    route, total_distance = solve_tsp(distance_matrix)
+    if solver == "local":
+        route, total_distance = solve_tsp_local(distance_matrix, return_to_start)
+    elif solver == "portfolio":
+        route, total_distance, config = solve_tsp_portfolio(distance_matrix, return_to_start)
+        print("Best strategy:", config)
+    else:
+        # Stops once 2 s pass without a better tour, printing each improvement
+        route, total_distance = solve_tsp(
+            distance_matrix,
+            return_to_start,
+            no_improvement_seconds=2,
+            on_solution=lambda route, km: print(f"  found route: {km} km")
+        )
 
     
 
@@ -46,4 +64,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # ROUTE_PROFILE=1 (or memory / cprofile) prints per-stage timings as JSON
+    with profiling.trace_from_env() as trace:
+        main()
+    if trace is not None:
+        print(trace.to_json(indent=2))
@@ -0,0 +1,410 @@
+"""Long-lived HTTP/JSON routing service.
+
+    python routing_service.py --port 8080 --workers 8
+
+    POST /v1/tsp          {"stops": [...], "return_to_start": true, "deadline": 5}
+    POST /v1/cvrp         {"stops": [...], "capacity": 50, "vehicles": 3, "deadline": 20}
+    DELETE /v1/jobs/<id>  cancel a waiting or running request
+    GET /healthz          queue depth, worker count and counters
+
+Request bodies are batch.py job objects (stops, id, solver, time_limit,
+depot...) plus an optional ``deadline`` in seconds and ``profile`` flag;
+responses are batch.py result records. Solving happens in a pool of
+worker processes started and warmed (OR-Tools, NumPy, module caches)
+once at startup, so a request never pays for imports or process start.
+
+Requests wait in one FIFO queue. When the queue is full, or the estimated
+wait already exceeds the request's deadline, the request is refused at
+once with 503 and Retry-After instead of queueing up latency. The
+deadline also caps the OR-Tools search, so a solve ends in time to
+answer; a request still waiting when it passes gets 504. Requests whose
+client disconnects, or that are cancelled with DELETE, leave the queue
+at once; a solve already running in a worker finishes by its deadline
+and its result is dropped.
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import math
+import os
+import re
+import signal
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+
+from batch import SOLVERS, parse_job, solve_job
+from result_cache import ResultCache, problem_fingerprint
+
+DEFAULT_PORT = 8080
+# requests waiting for a worker before new ones are refused
+MAX_QUEUE = 64
+DEFAULT_DEADLINE = 30.0
+MAX_DEADLINE = 300.0
+# a request is not started with less time than this left
+MIN_SOLVE_SECONDS = 0.05
+# deadline time kept back for moving the result out of the worker
+RESULT_MARGIN = 0.1
+MAX_BODY_BYTES = 16 * 1024 * 1024
+HEADER_TIMEOUT = 10.0
+# weight of the newest solve in the running service-time estimate
+SERVICE_TIME_WEIGHT = 0.2
+
+_JOB_PATH = re.compile(r"^/v1/jobs/([^/]+)$")
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"service overloaded, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+def _warm_worker():
+    # runs once per worker process: Ctrl-C is the parent's to handle, and a
+    # tiny TSP and CVRP pull in and initialise everything a real job uses
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stops = [(f"warm{i}", (23.16 + 0.01 * (i % 3), 79.93 + 0.01 * i)) for i in range(6)]
+    solve_job({"index": 0, "id": "warm", "locations": stops, "demands": None})
+    solve_job({"index": 0, "id": "warm", "locations": stops, "demands": [0, 1, 1, 1, 1, 1],
+               "capacity": 3, "vehicles": 2, "time_limit": 0.1})
+
+
+class _Pending:
+    __slots__ = ("job", "profile", "future", "deadline", "queued_at", "state")
+
+    def __init__(self, job, profile, future, deadline, queued_at):
+        self.job = job
+        self.profile = profile
+        self.future = future
+        self.deadline = deadline
+        self.queued_at = queued_at
+        # queued -> running -> done; done also covers cancelled and expired
+        self.state = "queued"
+
+
+class RoutingService:
+    """Queue, admission control and warm worker pool behind the HTTP layer.
+
+    ``solve`` is usable on its own from any coroutine on the service's
+    event loop.
+    """
+
+    def __init__(self, workers=None, max_queue=MAX_QUEUE, default_deadline=DEFAULT_DEADLINE,
+                 solver="auto", method="ellipsoidal", cache_bytes=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.default_deadline = default_deadline
+        self.solver = solver
+        self.method = method
+        self.cache = ResultCache(cache_bytes) if cache_bytes else ResultCache()
+        self.pool = None
+        self.queued = 0
+        self.running = 0
+        # running estimate of seconds per solve, for admission control
+        self.service_seconds = 1.0
+        self.counts = {}
+        self._pending = {}
+        self._queue = None
+        self._dispatchers = []
+        self._ids = itertools.count(1)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        await self._start_pool()
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(self.workers, initializer=_warm_worker)
+
+    async def _start_pool(self):
+        # one task per worker at once makes the pool start every process now
+        loop = asyncio.get_running_loop()
+        self.pool = self._new_pool()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, os.getpid) for _ in range(self.workers)))
+
+    async def close(self):
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        for pending in list(self._pending.values()):
+            if not pending.future.done():
+                pending.future.set_exception(Cancelled("service shutting down"))
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _key(self, job):
+        demands = job.get("demands")
+        return problem_fingerprint(
+            "service", job["locations"], demands=None if demands is None else tuple(demands),
+            capacity=job.get("capacity"), vehicles=job.get("vehicles"), depot=job.get("depot", 0),
+            return_to_start=job.get("return_to_start", True),
+            solver=job.get("solver") or self.solver, method=self.method)
+
+    def _admit(self, seconds):
+        # refuse now rather than queue a request that cannot be answered in time
+        if self.queued >= self.max_queue:
+            wait = (self.queued // self.workers + 1) * self.service_seconds
+            raise Overloaded(max(1, math.ceil(wait)))
+        wait = (self.queued + self.running) // self.workers * self.service_seconds
+        if wait + MIN_SOLVE_SECONDS > seconds:
+            raise Overloaded(max(1, math.ceil(wait)))
+
+    async def solve(self, job, deadline=None, disconnected=None, profile=False):
+        """Result record for a parsed job.
+
+        Raises Overloaded, DeadlineExceeded or Cancelled; ``disconnected``
+        is an awaitable that completes when the caller has gone away.
+        """
+        loop = asyncio.get_running_loop()
+        seconds = min(float(deadline or self.default_deadline), MAX_DEADLINE)
+        key = self._key(job)
+        cached = None if profile else self.cache.get(key)
+        if cached is not None:
+            self._count("cached")
+            return {**cached, "index": job["index"], "id": job["id"], "cached": True}
+        if job["id"] in self._pending:
+            raise ValueError(f"request {job['id']!r} is already in progress")
+        try:
+            self._admit(seconds)
+        except Overloaded:
+            self._count("rejected")
+            raise
+
+        now = loop.time()
+        pending = _Pending(job, profile, loop.create_future(), now + seconds, now)
+        self._pending[job["id"]] = pending
+        self.queued += 1
+        self._queue.put_nowait(pending)
+        waiters = {pending.future} if disconnected is None else {pending.future, disconnected}
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=seconds, return_when=asyncio.FIRST_COMPLETED)
+            if pending.future in done:
+                result = pending.future.result()
+            elif done:
+                self._count("disconnected")
+                raise Cancelled("client disconnected")
+            else:
+                self._count("expired")
+                raise DeadlineExceeded(f"no result within {seconds:g}s")
+        finally:
+            self._pending.pop(job["id"], None)
+            if pending.state == "queued":
+                self.queued -= 1
+                pending.state = "done"
+            if not pending.future.done():
+                pending.future.cancel()
+        if result["status"] == "ok":
+            self.cache.put(key, {k: v for k, v in result.items() if k not in ("profile", "queue_seconds")})
+        return result
+
+    def cancel(self, request_id):
+        pending = self._pending.get(request_id)
+        if pending is None or pending.future.done():
+            return False
+        self._count("cancelled")
+        pending.future.set_exception(Cancelled(f"request {request_id!r} cancelled"))
+        return True
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await self._queue.get()
+            if pending.state != "queued":
+                continue
+            self.queued -= 1
+            remaining = pending.deadline - loop.time()
+            if remaining < MIN_SOLVE_SECONDS + RESULT_MARGIN:
+                pending.state = "done"
+                if not pending.future.done():
+                    self._count("expired")
+                    pending.future.set_exception(DeadlineExceeded("deadline passed while queued"))
+                continue
+
+            pending.state = "running"
+            self.running += 1
+            # the solvers take an absolute wall-clock deadline
+            job = dict(pending.job, deadline=time.time() + remaining - RESULT_MARGIN)
+            started = loop.time()
+            pool = self.pool
+            try:
+                result = await loop.run_in_executor(
+                    pool, functools.partial(solve_job, job, self.solver, self.method, None, pending.profile))
+            except Exception as e:
+                result = {"index": job["index"], "id": job["id"], "status": "error",
+                          "error": f"worker failed: {type(e).__name__}: {e}"}
+                if isinstance(e, BrokenProcessPool) and self.pool is pool:
+                    # a worker died (out of memory, killed); later jobs get a new pool
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = self._new_pool()
+            finally:
+                self.running -= 1
+                pending.state = "done"
+            elapsed = loop.time() - started
+            self.service_seconds += SERVICE_TIME_WEIGHT * (elapsed - self.service_seconds)
+            self._count(result["status"])
+            if pending.future.done():
+                # cancelled or timed out while the worker was busy
+                self._count("abandoned")
+                continue
+            result["queue_seconds"] = round(started - pending.queued_at, 4)
+            pending.future.set_result(result)
+
+    def health(self):
+        return {"workers": self.workers, "queued": self.queued, "running": self.running,
+                "max_queue": self.max_queue, "service_seconds": round(self.service_seconds, 4),
+                "counts": dict(self.counts), "cache": self.cache.stats()}
+
+    async def handle_solve(self, kind, body, disconnected):
+        try:
+            data = json.loads(body)
+            job = parse_job(data, next(self._ids), None)
+            deadline = data.get("deadline")
+            if deadline is not None and not float(deadline) > 0:
+                raise ValueError("deadline must be a positive number of seconds")
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            return HTTPStatus.BAD_REQUEST, {"status": "error", "error": f"bad request: {e!r}"}
+        if job["id"] is None:
+            job["id"] = f"req-{job['index']}"
+        if kind == "tsp":
+            job["capacity"] = job["vehicles"] = None
+        elif job.get("capacity") is None or job.get("vehicles") is None:
+            return HTTPStatus.BAD_REQUEST, {"id": job["id"], "status": "error",
+                                            "error": "CVRP requests need capacity and vehicles"}
+        if (job.get("solver") or self.solver) not in SOLVERS:
+            return HTTPStatus.BAD_REQUEST, {"id": job["id"], "status": "error",
+                                            "error": f"unknown solver (expected one of {SOLVERS})"}
+        try:
+            result = await self.solve(job, deadline, disconnected, bool(data.get("profile")))
+        except ValueError as e:
+            return HTTPStatus.CONFLICT, {"id": job["id"], "status": "error", "error": str(e)}
+        except Overloaded as e:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"id": job["id"], "status": "overloaded",
+                                                    "error": str(e), "retry_after": e.retry_after}
+        except DeadlineExceeded as e:
+            return HTTPStatus.GATEWAY_TIMEOUT, {"id": job["id"], "status": "timeout", "error": str(e)}
+        except Cancelled as e:
+            return HTTPStatus.CONFLICT, {"id": job["id"], "status": "cancelled", "error": str(e)}
+        status = {"ok": HTTPStatus.OK, "infeasible": HTTPStatus.UNPROCESSABLE_ENTITY}
+        return status.get(result["status"], HTTPStatus.BAD_REQUEST), result
+
+    async def route(self, method, path, body, disconnected):
+        if path == "/healthz":
+            if method != "GET":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "use GET"}
+            return HTTPStatus.OK, self.health()
+        if path in ("/v1/tsp", "/v1/cvrp"):
+            if method != "POST":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "use POST"}
+            return await self.handle_solve(path[4:], body, disconnected)
+        match = _JOB_PATH.match(path)
+        if match:
+            if method != "DELETE":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "use DELETE"}
+            if self.cancel(match.group(1)):
+                return HTTPStatus.OK, {"id": match.group(1), "cancelled": True}
+            return HTTPStatus.NOT_FOUND, {"id": match.group(1), "error": "no such request in progress"}
+        return HTTPStatus.NOT_FOUND, {"error": f"no route for {path}"}
+
+    async def handle_connection(self, reader, writer):
+        # one request per connection (Connection: close), so after the body
+        # any read that returns means the client has hung up
+        disconnected = None
+        try:
+            body = None
+            try:
+                method, path, headers = await asyncio.wait_for(_read_head(reader), HEADER_TIMEOUT)
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "body too large"}
+                else:
+                    body = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT)
+            except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                status, payload = HTTPStatus.BAD_REQUEST, {"error": f"bad HTTP request: {e!r}"}
+            if body is not None:
+                disconnected = asyncio.ensure_future(reader.read(1))
+                try:
+                    status, payload = await self.route(method, path.split("?", 1)[0], body, disconnected)
+                except Exception as e:
+                    # a bug must still answer the client, not drop the connection
+                    traceback.print_exc()
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {
+                        "status": "error", "error": f"internal error: {type(e).__name__}: {e}"}
+            if disconnected is not None and disconnected.done():
+                return
+            extra = ""
+            if status == HTTPStatus.SERVICE_UNAVAILABLE and "retry_after" in payload:
+                extra = f"Retry-After: {payload['retry_after']}\r\n"
+            data = json.dumps(payload).encode()
+            writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                         f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                         f"{extra}Connection: close\r\n\r\n".encode("latin-1") + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if disconnected is not None:
+                disconnected.cancel()
+            writer.close()
+
+
+async def _read_head(reader):
+    line = await reader.readline()
+    method, path, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return method.upper(), path, headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def serve(host="127.0.0.1", port=DEFAULT_PORT, **options):
+    service = RoutingService(**options)
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port, backlog=1024)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    print(f"routing service on http://{host}:{port} with {service.workers} warm workers", flush=True)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await service.close()
+        await server.wait_closed()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve TSP and CVRP solves over HTTP/JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, help="solver processes (default: all cores)")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="waiting requests before 503s")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE,
+                        help="seconds per request when the request sets none")
+    parser.add_argument("--solver", choices=SOLVERS, default="auto")
+    parser.add_argument("--method", default="ellipsoidal", help="distance method")
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.host, args.port, workers=args.workers, max_queue=args.max_queue,
+                      default_deadline=args.deadline, solver=args.solver, method=args.method))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import heapq
+
+import numpy as np
+
+from local_search import EPS, improve_route, neighbor_lists
+
+# above this many stops savings are only considered between near neighbours
+SAVINGS_ALL_PAIRS = 300
+SAVINGS_NEIGHBORS = 40
+
+
+def clarke_wright(distance_matrix, demands, vehicle_capacity, depot=0, k=None):
+    """Clarke-Wright parallel savings.
+
+    Every stop starts on its own route; the pair with the largest saving
+    d(i, depot) + d(depot, j) - d(i, j) is popped from a heap and the two
+    routes are joined end to end when i and j are route ends and the load
+    fits. ``k`` limits the pairs to each stop's k nearest neighbours.
+    Returns routes as [depot, ..., depot].
+    """
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    n = len(matrix)
+    if k is None and n > SAVINGS_ALL_PAIRS:
+        k = SAVINGS_NEIGHBORS
+    if k is None:
+        i, j = np.triu_indices(n, 1)
+    else:
+        nearest = np.array(neighbor_lists(matrix, k))
+        i = np.repeat(np.arange(n), nearest.shape[1])
+        j = nearest.ravel()
+        i, j = np.minimum(i, j), np.maximum(i, j)
+    keep = (i != depot) & (j != depot)
+    i, j = i[keep], j[keep]
+    saving = matrix[i, depot] + matrix[depot, j] - matrix[i, j]
+    keep = saving > EPS
+    heap = list(zip((-saving[keep]).tolist(), i[keep].tolist(), j[keep].tolist()))
+    heapq.heapify(heap)
+
+    routes = {stop: [stop] for stop in range(n) if stop != depot}
+    route_of = {stop: stop for stop in routes}
+    load = {stop: demands[stop] for stop in routes}
+    while heap:
+        _, a, b = heapq.heappop(heap)
+        ra, rb = route_of[a], route_of[b]
+        if ra == rb or load[ra] + load[rb] > vehicle_capacity:
+            continue
+        A, B = routes[ra], routes[rb]
+        if A[-1] == a and B[0] == b:
+            merged = A + B
+        elif A[0] == a and B[-1] == b:
+            merged = B + A
+        elif A[-1] == a and B[-1] == b:
+            merged = A + B[::-1]
+        elif A[0] == a and B[0] == b:
+            merged = A[::-1] + B
+        else:
+            continue
+        # keep the longer route's id so fewer stops are relabelled
+        if len(A) < len(B):
+            ra, rb = rb, ra
+        for stop in routes[rb]:
+            route_of[stop] = ra
+        routes[ra] = merged
+        load[ra] += load.pop(rb)
+        del routes[rb]
+    return [[depot] + route + [depot] for route in routes.values()]
+
+
+class _RouteState:
+    # routes with every stop's (route, position) and prefix loads, so each
+    # move is scored and capacity-checked in O(1)
+    def __init__(self, routes, demands):
+        self.routes = [list(route) for route in routes]
+        self.demands = demands
+        self.route_of = {}
+        self.pos = {}
+        self.prefix = [None] * len(self.routes)
+        for r in range(len(self.routes)):
+            self.refresh(r)
+
+    def refresh(self, r):
+        route = self.routes[r]
+        prefix = [0]
+        for p, node in enumerate(route):
+            if 0 < p < len(route) - 1:
+                self.route_of[node] = r
+                self.pos[node] = p
+            prefix.append(prefix[-1] + (self.demands[node] if 0 < p < len(route) - 1 else 0))
+        self.prefix[r] = prefix
+
+    def load(self, r):
+        return self.prefix[r][-1]
+
+    def segment_load(self, r, start, stop):
+        # demand of routes[r][start:stop]
+        return self.prefix[r][stop] - self.prefix[r][start]
+
+
+def _best_move(state, D, u, v, vehicle_capacity, max_segment, symmetric):
+    # best improving inter-route move between u's route and v's route
+    r, s = state.route_of[u], state.route_of[v]
+    R, S = state.routes[r], state.routes[s]
+    p, q = state.pos[u], state.pos[v]
+    pu, nu, pv, nv = R[p - 1], R[p + 1], S[q - 1], S[q + 1]
+    load_r, load_s = state.load(r), state.load(s)
+    best = (-EPS, None)
+
+    # cross-exchange: R[p:p+a] moves behind v, S[q+1:q+1+b] takes its
+    # place; b == 0 is a (segment) relocate
+    for a in range(1, max_segment + 1):
+        if p + a > len(R) - 1:
+            break
+        xa, na = R[p + a - 1], R[p + a]
+        seg_x = state.segment_load(r, p, p + a)
+        for b in range(0, max_segment + 1):
+            if q + b > len(S) - 2:
+                break
+            seg_y = state.segment_load(s, q + 1, q + 1 + b)
+            if load_r - seg_x + seg_y > vehicle_capacity or load_s - seg_y + seg_x > vehicle_capacity:
+                continue
+            if b == 0:
+                delta = (D[pu][na] + D[v][u] + D[xa][nv]
+                         - D[pu][u] - D[xa][na] - D[v][nv])
+            else:
+                y0, yb, nb = S[q + 1], S[q + b], S[q + b + 1]
+                delta = (D[pu][y0] + D[yb][na] + D[v][u] + D[xa][nb]
+                         - D[pu][u] - D[xa][na] - D[v][y0] - D[yb][nb])
+            if delta < best[0]:
+                best = (delta, ("cross", r, s, p, q, a, b))
+
+    # swap u and v
+    if load_r - state.demands[u] + state.demands[v] <= vehicle_capacity and \
+            load_s - state.demands[v] + state.demands[u] <= vehicle_capacity:
+        delta = (D[pu][v] + D[v][nu] + D[pv][u] + D[u][nv]
+                 - D[pu][u] - D[u][nu] - D[pv][v] - D[v][nv])
+        if delta < best[0]:
+            best = (delta, ("swap", r, s, p, q))
+
+    # 2-opt*: exchange the tails after u and after v
+    head_r, head_s = state.segment_load(r, 0, p + 1), state.segment_load(s, 0, q + 1)
+    if head_r + load_s - head_s <= vehicle_capacity and head_s + load_r - head_r <= vehicle_capacity:
+        delta = D[u][nv] + D[v][nu] - D[u][nu] - D[v][nv]
+        if delta < best[0]:
+            best = (delta, ("tails", r, s, p, q))
+    # ... or join u to v directly, reversing one head and one tail
+    if symmetric and head_r + head_s <= vehicle_capacity and \
+            load_r - head_r + load_s - head_s <= vehicle_capacity:
+        delta = D[u][v] + D[nu][nv] - D[u][nu] - D[v][nv]
+        if delta < best[0]:
+            best = (delta, ("heads", r, s, p, q))
+    return best
+
+
+def _apply(state, move):
+    kind, r, s = move[:3]
+    R, S = state.routes[r], state.routes[s]
+    if kind == "cross":
+        p, q, a, b = move[3:]
+        X, Y = R[p:p + a], S[q + 1:q + 1 + b]
+        state.routes[r] = R[:p] + Y + R[p + a:]
+        state.routes[s] = S[:q + 1] + X + S[q + 1 + b:]
+    elif kind == "swap":
+        p, q = move[3:]
+        R[p], S[q] = S[q], R[p]
+    elif kind == "tails":
+        p, q = move[3:]
+        state.routes[r], state.routes[s] = R[:p + 1] + S[q + 1:], S[:q + 1] + R[p + 1:]
+    else:
+        p, q = move[3:]
+        state.routes[r], state.routes[s] = R[:p + 1] + S[:q + 1][::-1], R[p + 1:][::-1] + S[q + 1:]
+    state.refresh(r)
+    state.refresh(s)
+
+
+def improve_routes(routes, distance_matrix, demands, vehicle_capacity, k=10, max_segment=3,
+                   intra=True):
+    """Inter-route local search: relocate, swap, 2-opt* and cross-exchange
+    between routes, each scored as an O(1) edge delta with O(1) capacity
+    checks from prefix loads. Candidates pair every stop with its k nearest
+    neighbours on other routes; the best move per pair is applied until
+    none improves. With ``intra`` each route is then polished by
+    local_search.improve_route.
+    """
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    D = matrix.tolist()
+    symmetric = np.allclose(matrix, matrix.T)
+    neighbors = neighbor_lists(matrix, k)
+    state = _RouteState(routes, list(demands))
+
+    def polish(r):
+        if len(state.routes[r]) > 4:
+            state.routes[r] = improve_route(state.routes[r], matrix)
+            state.refresh(r)
+
+    if intra:
+        for r in range(len(state.routes)):
+            polish(r)
+
+    queue = list(state.route_of)
+    while queue:
+        touched = set()
+        for u in queue:
+            if u not in state.route_of:
+                continue
+            for v in neighbors[u]:
+                if v not in state.route_of or state.route_of[v] == state.route_of[u]:
+                    continue
+                delta, move = _best_move(state, D, u, v, vehicle_capacity, max_segment, symmetric)
+                if move is not None:
+                    r, s = move[1], move[2]
+                    _apply(state, move)
+                    touched.update(state.routes[r][1:-1])
+                    touched.update(state.routes[s][1:-1])
+                    break
+        queue = [u for u in state.route_of if u in touched]
+
+    if intra:
+        for r in range(len(state.routes)):
+            polish(r)
+    return state.routes
+
+
+def solve_cvrp_savings(distance_matrix, demands, vehicle_capacity, num_vehicles, depot=0, k=10):
+    """Savings routes improved by inter-route local search, in the shape
+    solve_cvrp returns (one [depot, ..., depot] per vehicle), or None when
+    they need more vehicles than there are."""
+    routes = clarke_wright(distance_matrix, demands, vehicle_capacity, depot)
+    if any(demands[stop] > vehicle_capacity for route in routes for stop in route[1:-1]):
+        return None
+    routes += [[depot, depot] for _ in range(max(0, num_vehicles - len(routes)))]
+    routes = improve_routes(routes, distance_matrix, demands, vehicle_capacity, k)
+    routes = [route for route in routes if len(route) > 2]
+    if len(routes) > num_vehicles:
+        return None
+    return routes + [[depot, depot] for _ in range(num_vehicles - len(routes))]
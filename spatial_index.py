@@ -0,0 +1,170 @@
+import math
+
+import numpy as np
+
+from distance_utils import EARTH_RADIUS_KM
+
+# queries more rings than this outside the grid scan every live point
+FAR_RINGS = 16
+
+
+def project(lats, lons):
+    # equirectangular projection to km around the mean latitude; nearest
+    # neighbors in this plane match geodesic ones at city/region scale
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if len(lats) == 0:
+        return lats.copy(), lons.copy()
+    lat0 = np.radians(lats.mean())
+    xs = EARTH_RADIUS_KM * np.radians(lons) * np.cos(lat0)
+    ys = EARTH_RADIUS_KM * np.radians(lats)
+    return xs, ys
+
+
+class GridIndex:
+    """Uniform grid over projected points with nearest-live-point queries.
+
+    Points are removed in O(1); once half of them are gone the grid is
+    rebuilt with larger cells so searches stay short as the set empties.
+    """
+
+    def __init__(self, xs, ys, points_per_cell=2):
+        self.xs = np.asarray(xs, dtype=np.float64).tolist()
+        self.ys = np.asarray(ys, dtype=np.float64).tolist()
+        self.points_per_cell = points_per_cell
+        self._alive = [True] * len(self.xs)
+        self._count = len(self.xs)
+        # the grid always spans every original point, so queries from any
+        # of them (removed or not) land inside it
+        if self.xs:
+            self._min_x, self._min_y = min(self.xs), min(self.ys)
+            self._width = max(max(self.xs) - self._min_x, max(self.ys) - self._min_y, 1e-9)
+        else:
+            self._min_x = self._min_y = 0.0
+            self._width = 1.0
+        self._build(range(len(self.xs)))
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, i):
+        return self._alive[i]
+
+    def _build(self, indices):
+        indices = list(indices)
+        self._built_count = len(indices)
+        self._cells = {}
+        self._slot = {}
+        cells_per_side = max(1, int(math.sqrt(len(indices) / self.points_per_cell)))
+        self._cell_size = self._width / cells_per_side
+        # points on the far edge land in cell ``cells_per_side``
+        self._last_cell = cells_per_side
+        for i in indices:
+            cell = self._cell_of(self.xs[i], self.ys[i])
+            bucket = self._cells.setdefault(cell, [])
+            self._slot[i] = len(bucket)
+            bucket.append(i)
+
+    def _cell_of(self, x, y):
+        return (int((x - self._min_x) // self._cell_size),
+                int((y - self._min_y) // self._cell_size))
+
+    def remove(self, i):
+        if not self._alive[i]:
+            return
+        self._alive[i] = False
+        self._count -= 1
+        bucket = self._cells[self._cell_of(self.xs[i], self.ys[i])]
+        slot = self._slot.pop(i)
+        last = bucket.pop()
+        if last != i:
+            bucket[slot] = last
+            self._slot[last] = slot
+        if self._count and self._count * 2 < self._built_count:
+            self._build(j for j in self._slot)
+
+    def nearest(self, x, y):
+        if not self._count:
+            return None
+        cx, cy = self._cell_of(x, y)
+        best, best_d2 = None, math.inf
+        cells = self._cells
+        xs, ys = self.xs, self.ys
+        last = self._last_cell
+        # rings from the grid's near edge (a query may lie outside it) out
+        # to its far corner, each clipped to the grid
+        first = max(0, -cx, cx - last, -cy, cy - last)
+        final = max(cx, last - cx, cy, last - cy)
+        if first > FAR_RINGS:
+            # far outside, the rings would sweep most of the grid anyway
+            return min(self._slot, key=lambda j: (xs[j] - x) ** 2 + (ys[j] - y) ** 2)
+        for ring in range(first, final + 1):
+            # rings 0..ring-1 are done; anything unseen is (ring-1) cells away
+            if best is not None and ring > 0 and best_d2 <= ((ring - 1) * self._cell_size) ** 2:
+                break
+            for gx in range(max(cx - ring, 0), min(cx + ring, last) + 1):
+                if abs(gx - cx) == ring:
+                    gys = range(max(cy - ring, 0), min(cy + ring, last) + 1)
+                else:
+                    gys = [gy for gy in (cy - ring, cy + ring) if 0 <= gy <= last]
+                for gy in gys:
+                    bucket = cells.get((gx, gy))
+                    if not bucket:
+                        continue
+                    for j in bucket:
+                        d2 = (xs[j] - x) ** 2 + (ys[j] - y) ** 2
+                        if d2 < best_d2:
+                            best, best_d2 = j, d2
+        return best
+
+
+def nearest_neighbor_route(lats, lons, start=0, return_to_start=True):
+    # greedy tour: repeatedly hop to the closest unvisited stop
+    xs, ys = project(lats, lons)
+    n = len(xs)
+    if n == 0:
+        return []
+    index = GridIndex(xs, ys)
+    index.remove(start)
+    route = [start]
+    current = start
+    for _ in range(n - 1):
+        current = index.nearest(index.xs[current], index.ys[current])
+        index.remove(current)
+        route.append(current)
+    if return_to_start:
+        route.append(start)
+    return route
+
+
+def k_nearest(lats, lons, k):
+    """(n, k) int32 array of each point's k nearest other points, closest
+    first, by projected distance. Memory stays O(n k) for any n."""
+    xs, ys = project(lats, lons)
+    n = len(xs)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=np.int32)
+    points = np.column_stack([xs, ys])
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        cKDTree = None
+    if cKDTree is not None:
+        _, nearest = cKDTree(points).query(points, k + 1)
+        # drop each point itself (not always column 0 when points coincide)
+        keep = nearest != np.arange(n)[:, None]
+        keep[keep.sum(axis=1) > k, -1] = False
+        return nearest[keep].reshape(n, k).astype(np.int32)
+
+    # blocks of rows against every point, a few MB at a time
+    nearest = np.empty((n, k), dtype=np.int32)
+    rows = max(1, (1 << 22) // n)
+    for start in range(0, n, rows):
+        stop = min(n, start + rows)
+        d2 = (xs[start:stop, None] - xs[None, :]) ** 2 + (ys[start:stop, None] - ys[None, :]) ** 2
+        d2[np.arange(stop - start), np.arange(start, stop)] = np.inf
+        block = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(d2, block, axis=1), axis=1)
+        nearest[start:stop] = np.take_along_axis(block, order, axis=1)
+    return nearest
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from geocoder import Geocoder, _nominatim_params, _nominatim_parse
+
+PLACES = {"gwarighat, jabalpur": ("23.1401", "79.9187"), "bhedaghat, jabalpur": ("23.1288", "79.8017")}
+
+
+@pytest.fixture
+def stand_in():
+    # a local Nominatim look-alike: /search answers from PLACES, /fail is down
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)["q"][0]
+            requests_seen.append((url.path, query, time.monotonic()))
+            if url.path == "/fail":
+                self.send_response(503)
+                self.end_headers()
+                return
+            hit = PLACES.get(query.lower())
+            body = json.dumps([{"lat": hit[0], "lon": hit[1]}] if hit else []).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", requests_seen
+    server.shutdown()
+    server.server_close()
+
+
+def provider(base, path="/search", name="stand-in", rate=50.0, burst=1):
+    return {"name": name, "url": base + path, "params": _nominatim_params,
+            "parse": _nominatim_parse, "key": None, "rate": rate, "burst": burst}
+
+
+def test_results_come_from_the_cache_on_the_second_run(stand_in, tmp_path):
+    base, seen = stand_in
+    cache = str(tmp_path / "geocode.sqlite")
+    places = ["Gwarighat", " gwarighat ,", "Bhedaghat", "Nowhere"]
+
+    geocoder = Geocoder(cache, [provider(base)])
+    first = geocoder.geocode_many(places)
+    geocoder.close()
+    assert first == [(23.1401, 79.9187), (23.1401, 79.9187), (23.1288, 79.8017), (None, None)]
+    assert len(seen) == 3  # the two spellings of Gwarighat are one query
+
+    geocoder = Geocoder(cache, [provider(base)])
+    assert geocoder.geocode_many(places) == first
+    geocoder.close()
+    assert len(seen) == 3
+
+
+def test_requests_are_spaced_by_the_provider_rate(stand_in, tmp_path):
+    base, seen = stand_in
+    geocoder = Geocoder(str(tmp_path / "geocode.sqlite"), [provider(base, rate=20.0)])
+    geocoder.geocode_many([f"stop {i}" for i in range(5)])
+    geocoder.close()
+    times = sorted(t for _, _, t in seen)
+    # one token up front, then one every 1/20 s
+    assert len(times) == 5
+    assert times[-1] - times[0] >= 4 / 20 - 0.02
+
+
+def test_failing_provider_falls_through_and_is_not_cached_as_missing(stand_in, tmp_path):
+    base, seen = stand_in
+    cache = str(tmp_path / "geocode.sqlite")
+    providers = [provider(base, "/fail", name="down"), provider(base)]
+    errors = []
+    geocoder = Geocoder(cache, providers)
+    assert geocoder.geocode_many(["Gwarighat", "Nowhere"], errors) == [(23.1401, 79.9187), (None, None)]
+    geocoder.close()
+    assert len(errors) == 2 and all("down returned 503" in e for e in errors)
+
+    # "Nowhere" was only not found because a provider failed, so it is retried
+    before = len(seen)
+    geocoder = Geocoder(cache, [provider(base)])
+    geocoder.geocode_many(["Gwarighat", "Nowhere"])
+    geocoder.close()
+    assert [query for _, query, _ in seen[before:]] == ["Nowhere, Jabalpur"]
+
+
+def test_geocode_many_refuses_a_running_event_loop(stand_in, tmp_path):
+    base, _ = stand_in
+    geocoder = Geocoder(str(tmp_path / "geocode.sqlite"), [provider(base)])
+
+    async def inside_loop():
+        with pytest.raises(RuntimeError, match="geocode_many_async"):
+            geocoder.geocode_many(["Gwarighat"])
+        return await geocoder.geocode_many_async(["Gwarighat"])
+
+    assert asyncio.run(inside_loop()) == [(23.1401, 79.9187)]
+    geocoder.close()
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from location_set import LocationSet
+
+STOPS = [("Pageup", (23.1661, 79.9248)), ("Dumna Airport", (23.1833, 80.0577)),
+         ("Russel Chowk", (23.1634, 79.9372))]
+
+
+def test_boolean_mask_selects_stops():
+    places = LocationSet.from_locations(STOPS)
+    assert list(places[places.lats > 23.165]) == STOPS[:2]
+    assert list(places[np.array([True, False, False])]) == STOPS[:1]
+    assert list(places[[False, False, True]]) == STOPS[2:]
+
+
+def test_index_arrays_still_select_a_route():
+    places = LocationSet.from_locations(STOPS)
+    assert list(places[[2, 0]]) == [STOPS[2], STOPS[0]]
+    assert list(places[np.array([1, 0])]) == [STOPS[1], STOPS[0]]
+
+
+def test_coords_at_takes_masks():
+    places = LocationSet.from_locations(STOPS)
+    np.testing.assert_array_equal(places.coords_at(places.lons > 80), [[23.1833, 80.0577]])
+
+
+def test_mask_of_wrong_length_is_rejected():
+    places = LocationSet.from_locations(STOPS)
+    with pytest.raises(IndexError):
+        places[np.array([True, False])]
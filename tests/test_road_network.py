@@ -0,0 +1,51 @@
+import numpy as np
+
+import road_network
+from distance_utils import compute_distance_matrix, ellipsoidal_distances
+from road_network import RoadNetwork
+
+LAT0, LON0 = 23.16, 79.93
+STEP = 0.0009  # about 100 m of latitude
+
+
+def street_grid(size=11):
+    # a 1 km square of two-way streets, one every 100 m
+    rows = [([(LAT0 + i * STEP, LON0 + j * STEP) for j in range(size)], {"highway": "residential"})
+            for i in range(size)]
+    cols = [([(LAT0 + j * STEP, LON0 + i * STEP) for j in range(size)], {"highway": "residential"})
+            for i in range(size)]
+    return RoadNetwork.from_ways(rows + cols)
+
+
+def test_road_distance_follows_the_streets():
+    net = street_grid()
+    corners = [("a", (LAT0, LON0)), ("b", (LAT0 + 10 * STEP, LON0 + 10 * STEP))]
+    matrix = compute_distance_matrix(corners, "road", network=net)
+    east = ellipsoidal_distances(LAT0, LON0, LAT0, LON0 + 10 * STEP)
+    north = ellipsoidal_distances(LAT0, LON0, LAT0 + 10 * STEP, LON0)
+    assert np.isclose(matrix[0, 1], east + north, rtol=1e-3)
+
+
+def test_stop_outside_the_extract_snaps_to_the_nearest_node():
+    net = street_grid()
+    # about 20 km north-east of the grid
+    far = ("far", (LAT0 + 0.15, LON0 + 0.15))
+    stops = [("a", (LAT0, LON0)), ("b", (LAT0 + 5 * STEP, LON0 + 2 * STEP)), far]
+    matrix = compute_distance_matrix(stops, "road", network=net)
+    assert np.isfinite(matrix).all()
+    nodes, offsets = net.snap([far[1][0]], [far[1][1]])
+    corner = ellipsoidal_distances(LAT0 + 10 * STEP, LON0 + 10 * STEP, *far[1])
+    assert np.isclose(net.lats[nodes[0]], LAT0 + 10 * STEP)
+    assert np.isclose(net.lons[nodes[0]], LON0 + 10 * STEP)
+    assert np.isclose(offsets[0], corner)
+    assert matrix[0, 2] > corner
+
+
+def test_chunked_search_matches_one_batch(monkeypatch):
+    net = street_grid()
+    rng = np.random.default_rng(0)
+    lats = LAT0 + rng.random(30) * 10 * STEP
+    lons = LON0 + rng.random(30) * 10 * STEP
+    whole = net.distance_matrix(lats, lons)
+    monkeypatch.setattr(road_network, "SEARCH_CHUNK_BYTES", 8 * len(net) * 4)
+    assert np.allclose(net.distance_matrix(lats, lons), whole)
@@ -0,0 +1,42 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from candidate_graph import compute_candidate_graph
+from location_set import LocationSet
+from tsp_solver import iter_tsp_solutions, solve_tsp_sparse
+
+
+def random_matrix(n, seed=0):
+    points = np.random.default_rng(seed).random((n, 2))
+    return np.linalg.norm(points[:, None] - points[None], axis=2)
+
+
+def test_iter_tsp_solutions_raises_search_errors():
+    ragged = np.array([[0, 1], [1]], dtype=object)
+    with pytest.raises(ValueError):
+        list(iter_tsp_solutions(ragged))
+
+
+def test_closing_iter_tsp_solutions_stops_the_search():
+    before = threading.active_count()
+    solutions = iter_tsp_solutions(random_matrix(60), time_limit=10)
+    next(solutions)
+    solutions.close()
+    started = time.monotonic()
+    while threading.active_count() > before and time.monotonic() - started < 5:
+        time.sleep(0.01)
+    assert threading.active_count() == before
+
+
+def test_solve_tsp_sparse_searches_until_a_bare_deadline():
+    rng = np.random.default_rng(0)
+    places = LocationSet([f"s{i}" for i in range(300)], 23 + rng.random(300) * 0.1,
+                         79.9 + rng.random(300) * 0.1)
+    graph = compute_candidate_graph(places)
+    started = time.time()
+    route, _ = solve_tsp_sparse(graph, deadline=started + 2)
+    assert sorted(route[:-1]) == list(range(300))
+    assert time.time() - started >= 1.5
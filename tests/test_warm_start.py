@@ -0,0 +1,41 @@
+from distance_utils import compute_distance_matrix
+from warm_start import insertion_cost, reoptimize_route
+
+A = ("Pageup", (23.1661, 79.9248))
+B = ("Dumna Airport", (23.1833, 80.0577))
+C = ("Russel Chowk", (23.1634, 79.9372))
+
+
+def test_insertion_into_one_stop_route():
+    matrix = compute_distance_matrix([A, C])
+    cost, position = insertion_cost([0], 1, matrix, open_end=True)
+    assert position == 1
+    assert cost == matrix[0, 1]
+
+
+def test_reoptimize_open_route_with_one_surviving_stop():
+    # B is removed and C added: the repair starts from the one-stop route [A]
+    matrix = compute_distance_matrix([A, C])
+    assert reoptimize_route([A, B], [0, 1], [A, C], matrix) == [0, 1]
+
+
+def test_reoptimize_closed_route_keeps_start():
+    locations = [A, B, C]
+    matrix = compute_distance_matrix(locations)
+    route = reoptimize_route([A, B], [0, 1, 0], locations, matrix)
+    assert route[0] == route[-1] == 0
+    assert sorted(route[:-1]) == [0, 1, 2]
+
+
+def test_reoptimize_with_two_opt_skips_the_full_engine(monkeypatch):
+    import warm_start
+
+    def full_engine(*args, **kwargs):
+        raise AssertionError("2-opt repair ran the full engine")
+
+    monkeypatch.setattr(warm_start, "improve_route", full_engine)
+    points = [(f"s{i}", (23.1 + 0.01 * (i % 3), 79.9 + 0.013 * i)) for i in range(8)]
+    matrix = compute_distance_matrix(points)
+    route = reoptimize_route(points[:7], list(range(7)) + [0], points, matrix, method="2-opt")
+    assert route[0] == route[-1] == 0
+    assert sorted(route[:-1]) == list(range(8))
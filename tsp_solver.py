@@ -1,71 +1,347 @@
-from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-from geopy.distance import geodesic
+import queue
+import threading
+import time
 
+import numpy as np
 
-def solve_tsp(distance_matrix, return_to_start=True):
+import profiling
+from distance_utils import coords_to_arrays, route_leg_distances
+from held_karp import EXACT_MAX_STOPS, solve_tsp_exact
+from local_search import improve_route, improve_tour, tour_length
+from spatial_index import nearest_neighbor_route
+
+
+# arc cost OR-Tools sees for an arc outside a sparse candidate graph
+FORBIDDEN_ARC = 1 << 40
+
+
+def routing_matrix(distance_matrix):
+    # km -> integer metres, scaled once instead of inside a python callback
+    return np.rint(np.asarray(distance_matrix, dtype=np.float64) * 1000).astype(np.int64)
+
+
+def search_stats(routing):
+    solver = routing.solver()
+    return {
+        "solutions": solver.Solutions(),
+        "branches": solver.Branches(),
+        "failures": solver.Failures(),
+        "wall_time_ms": solver.WallTime(),
+    }
+
+
+def count_search(routing):
+    # OR-Tools search effort as counters of the current trace
+    if profiling.current() is not None:
+        for key, value in search_stats(routing).items():
+            profiling.count(f"ortools_{key}", value)
+
+
+def default_time_limit(num_stops):
+    # seconds of search scaled with instance size: ~1.5 s for 10 stops,
+    # capped at the old fixed 15 s from about 300 stops up
+    return min(15.0, 1.0 + 0.05 * num_stops)
+
+
+def _read_route(routing, manager, value, vehicle=0, return_to_start=True):
+    index = routing.Start(vehicle)
+    route = []
+    while not routing.IsEnd(index):
+        route.append(manager.IndexToNode(index))
+        index = value(routing.NextVar(index))
+    if return_to_start:
+        route.append(manager.IndexToNode(index))
+    return route
+
+
+def add_stop_rules(routing, no_improvement_seconds=None, no_improvement_solutions=None,
+                   on_improvement=None, should_stop=None):
+    """Finish the search early once it stops improving.
+
+    ``on_improvement(cost)`` is called for every solution better than the
+    previous best while the search runs. ``should_stop()`` is polled at
+    every solution and ends the search as soon as it returns true.
+    """
+    solver = routing.solver()
+    state = {"best": None, "since_best": 0, "best_at": time.monotonic()}
+
+    def at_solution():
+        if should_stop is not None and should_stop():
+            solver.FinishCurrentSearch()
+            return
+        cost = routing.CostVar().Value()
+        now = time.monotonic()
+        if state["best"] is None or cost < state["best"]:
+            state.update(best=cost, since_best=0, best_at=now)
+            if on_improvement is not None:
+                on_improvement(cost)
+            return
+        state["since_best"] += 1
+        if no_improvement_solutions is not None and state["since_best"] >= no_improvement_solutions:
+            solver.FinishCurrentSearch()
+        elif no_improvement_seconds is not None and now - state["best_at"] >= no_improvement_seconds:
+            solver.FinishCurrentSearch()
+
+    routing.AddAtSolutionCallback(at_solution)
+
+
+def resolve_time_limit(num_stops, time_limit=None, deadline=None):
+    # deadline is an absolute time.time() the caller needs an answer by
+    if time_limit is None:
+        time_limit = default_time_limit(num_stops)
+    if deadline is not None:
+        time_limit = min(time_limit, deadline - time.time())
+    return max(time_limit, 0.01)
+
+
+def search_parameters_for(first_solution_strategy, metaheuristic, time_limit):
+    from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = getattr(
+        routing_enums_pb2.FirstSolutionStrategy, first_solution_strategy)
+    search_parameters.local_search_metaheuristic = getattr(
+        routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+    return search_parameters
+
+
+def solve_from_routes(routing, manager, search_parameters, initial_routes=None):
+    # initial_routes: one node list per vehicle; depots are dropped
+    if initial_routes is not None:
+        routing.CloseModelWithParameters(search_parameters)
+        depots = {manager.IndexToNode(routing.Start(v)) for v in range(routing.vehicles())}
+        assignment = routing.ReadAssignmentFromRoutes(
+            [[manager.NodeToIndex(node) for node in route if node not in depots]
+             for route in initial_routes],
+            True
+        )
+        if assignment is not None:
+            return routing.SolveFromAssignmentWithParameters(assignment, search_parameters)
+    return routing.SolveWithParameters(search_parameters)
+
+
+def sparse_transit(routing, manager, graph):
+    # Arc costs (integer metres) looked up per call in the candidate graph;
+    # only O(n k) arcs are ever held in memory
+    rows = [{j: int(round(km * 1000)) for j, km in graph.row(i).items()} for i in range(len(graph))]
+
+    def cost(from_index, to_index):
+        a, b = manager.IndexToNode(from_index), manager.IndexToNode(to_index)
+        return 0 if a == b else rows[a].get(b, FORBIDDEN_ARC)
+
+    trace = profiling.current()
+    if trace is not None:
+        lookup = cost
+
+        def cost(from_index, to_index):
+            trace.count("transit_callbacks")
+            return lookup(from_index, to_index)
+
+    return routing.RegisterTransitCallback(cost)
+
+
+def restrict_to_graph(routing, manager, graph):
+    # Shrink every NextVar domain to the graph's arcs, so the search never
+    # considers any other pair of stops
+    depots = {manager.IndexToNode(routing.Start(v)) for v in range(routing.vehicles())}
+    ends = [routing.End(v) for v in range(routing.vehicles())]
+
+    def successors(node):
+        neighbors = graph.neighbors(node).tolist()
+        return ([manager.NodeToIndex(j) for j in neighbors if j not in depots],
+                not depots.isdisjoint(neighbors))
+
+    for node in range(len(graph)):
+        if node not in depots:
+            allowed, to_depot = successors(node)
+            routing.NextVar(manager.NodeToIndex(node)).SetValues(allowed + (ends if to_depot else []))
+    for v in range(routing.vehicles()):
+        allowed, _ = successors(manager.IndexToNode(routing.Start(v)))
+        routing.NextVar(routing.Start(v)).SetValues(allowed + [routing.End(v)])
+
+
+@profiling.stage("solve_tsp")
+def solve_tsp(distance_matrix, return_to_start=True, stats=None, time_limit=None,
+              no_improvement_seconds=None, no_improvement_solutions=None,
+              deadline=None, on_solution=None, should_stop=None,
+              first_solution_strategy="PATH_CHEAPEST_ARC", metaheuristic="GUIDED_LOCAL_SEARCH",
+              exact_max_stops=EXACT_MAX_STOPS, initial_route=None):
+    # Small instances are solved exactly in milliseconds instead of searched
+    if len(distance_matrix) <= exact_max_stops:
+        route, total_distance = solve_tsp_exact(distance_matrix, return_to_start)
+        if stats is not None:
+            stats.update({"solver": "held_karp", "optimal": route is not None})
+        if route is not None and on_solution is not None:
+            on_solution(route, total_distance)
+        return route, total_distance
+
+    from ortools.constraint_solver import pywrapcp
     manager = pywrapcp.RoutingIndexManager(len(distance_matrix), 1, 0)
     routing = pywrapcp.RoutingModel(manager)
 
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return int(distance_matrix[from_node][to_node] * 1000)  # Convert km to meters
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    # Registered as a native matrix, so no python runs per arc evaluation
+    transit_callback_index = routing.RegisterTransitMatrix(routing_matrix(distance_matrix).tolist())
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    search_parameters.time_limit.seconds = 15
+    def route_distance(route):
+        return round(tour_length(route, distance_matrix), 2)
 
-    solution = routing.SolveWithParameters(search_parameters)
+    def improved(cost):
+        # anytime mode: hand every better tour to the caller as it is found
+        if on_solution is not None:
+            route = _read_route(routing, manager, lambda var: var.Value(), 0, return_to_start)
+            on_solution(route, route_distance(route))
 
-    if solution:
-        index = routing.Start(0)
-        route = []
-        while not routing.IsEnd(index):
-            route.append(manager.IndexToNode(index))
-            index = solution.Value(routing.NextVar(index))
+    add_stop_rules(routing, no_improvement_seconds, no_improvement_solutions, improved, should_stop)
 
-        if return_to_start:
-            route.append(manager.IndexToNode(index))
+    limit = resolve_time_limit(len(distance_matrix), time_limit, deadline)
+    search_parameters = search_parameters_for(first_solution_strategy, metaheuristic, limit)
 
-        # Total distance
-        total_distance = 0.0
-        for i in range(len(route) - 1):
-            total_distance += distance_matrix[route[i]][route[i + 1]]
+    # Warm start: search from a known tour instead of a fresh first solution
+    solution = solve_from_routes(routing, manager, search_parameters,
+                                 [initial_route] if initial_route is not None else None)
+    count_search(routing)
+    if stats is not None:
+        stats.update(search_stats(routing))
 
-        return route, round(total_distance, 2)
+    if solution:
+        route = _read_route(routing, manager, solution.Value, 0, return_to_start)
+        return route, route_distance(route)
 
     return None, None
 
-def solve_tsp_greedy(locations, return_to_start=True):
-    n = len(locations)
-    visited = [False] * n
-    route = [0]  # Start from first location (index 0)
-    visited[0] = True
-    current = 0
 
+@profiling.stage("solve_tsp_sparse")
+def solve_tsp_sparse(graph, return_to_start=True, stats=None, time_limit=None,
+                     no_improvement_seconds=None, no_improvement_solutions=None, deadline=None,
+                     first_solution_strategy="PATH_CHEAPEST_ARC", metaheuristic="GUIDED_LOCAL_SEARCH",
+                     initial_route=None):
+    """solve_tsp over a CandidateGraph instead of a dense matrix.
+
+    A grid nearest-neighbour tour (or ``initial_route``) is improved by the
+    native local search on the graph's neighbour lists for at most
+    default_time_limit(n) seconds. With a positive ``time_limit`` or a
+    ``deadline`` OR-Tools then searches on from that tour, restricted to
+    graph arcs plus the tour's own, for ``time_limit`` seconds or until
+    the deadline, whichever is sooner. Without either only the local
+    search runs.
+    """
+    n = len(graph)
+    if n == 0:
+        return None, None
+    route = list(initial_route) if initial_route is not None else \
+        nearest_neighbor_route(graph.lats, graph.lons, 0, return_to_start)
+    # the python local search grows ~quadratically, so it gets the
+    # default_time_limit(n) budget (or less, by the caller's deadline)
+    now = time.time()
+    local_deadline = now + default_time_limit(n)
+    if deadline is not None:
+        # leave OR-Tools at least half of what is left
+        local_deadline = min(local_deadline, now + (deadline - now) / 2)
+    route = improve_tour(route, graph.distance_rows(), graph.neighbor_lists(),
+                         big=graph.length_bound(), deadline=local_deadline)
+    if not time_limit and deadline is None:
+        if stats is not None:
+            stats.update({"solver": "local_search", "arcs": len(graph.indices)})
+        return route, round(graph.route_length(route), 2)
+
+    closed = route if route[-1] == route[0] else route + [0]
+    graph = graph.with_route(closed)
+    from ortools.constraint_solver import pywrapcp
+    manager = pywrapcp.RoutingIndexManager(n, 1, 0)
+    routing = pywrapcp.RoutingModel(manager)
+    routing.SetArcCostEvaluatorOfAllVehicles(sparse_transit(routing, manager, graph))
+    restrict_to_graph(routing, manager, graph)
+    add_stop_rules(routing, no_improvement_seconds, no_improvement_solutions)
+
+    # with only a deadline the search runs until it
+    limit = resolve_time_limit(n, time_limit or np.inf, deadline)
+    search_parameters = search_parameters_for(first_solution_strategy, metaheuristic, limit)
+    solution = solve_from_routes(routing, manager, search_parameters, [closed])
+    count_search(routing)
+    if stats is not None:
+        stats.update(search_stats(routing))
+        stats["arcs"] = len(graph.indices)
+
+    if solution:
+        route = _read_route(routing, manager, solution.Value, 0, return_to_start)
+    return route, round(graph.route_length(route), 2)
+
+
+def iter_tsp_solutions(distance_matrix, return_to_start=True, **kwargs):
+    """Yield (route, total_distance) for each improving tour as it is found.
+
+    The search runs in a background thread; the last item yielded is the
+    final answer. Takes the same stop rules as solve_tsp. An error in the
+    search is re-raised here, and closing the generator early stops it.
+    """
+    found = queue.Queue()
+    done = object()
+    stop = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            solve_tsp(distance_matrix, return_to_start,
+                      on_solution=lambda route, dist: found.put((route, dist)),
+                      should_stop=stop.is_set, **kwargs)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            found.put(done)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = found.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+    worker.join()
+    if errors:
+        raise errors[0]
+
+
+def _matrix_nearest_neighbor(matrix, return_to_start=True):
+    n = len(matrix)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    route = [0]
     for _ in range(n - 1):
-        nearest = None
-        min_dist = float('inf')
-        for j in range(n):
-            if not visited[j]:
-                dist = geodesic(locations[current][1], locations[j][1]).km
-                if dist < min_dist:
-                    min_dist = dist
-                    nearest = j
+        row = np.where(visited, np.inf, matrix[route[-1]])
+        nearest = int(np.argmin(row))
         route.append(nearest)
         visited[nearest] = True
-        current = nearest
-
     if return_to_start:
         route.append(0)
+    return route
+
+
+@profiling.stage("solve_tsp_greedy")
+def solve_tsp_greedy(locations, return_to_start=True, distance_matrix=None):
+    if len(locations) == 0:
+        return [], 0.0
+
+    if distance_matrix is not None:
+        matrix = np.asarray(distance_matrix, dtype=np.float64)
+        route = _matrix_nearest_neighbor(matrix, return_to_start)
+        return route, round(tour_length(route, matrix), 2)
+
+    # Grid index over projected coordinates: roughly O(n log n), no matrix
+    lats, lons = coords_to_arrays(locations)
+    route = nearest_neighbor_route(lats, lons, 0, return_to_start)
+    total_distance = route_leg_distances(lats, lons, route).sum()
+    return route, round(float(total_distance), 2)
 
-    # Total distance calculation
-    total_distance = 0.0
-    for i in range(len(route) - 1):
-        total_distance += geodesic(locations[route[i]][1], locations[route[i + 1]][1]).km
 
-    return route, round(total_distance, 2)
+def solve_tsp_local(distance_matrix, return_to_start=True):
+    # Nearest-neighbor seed polished by 2-opt, Or-opt and LK chains
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    if len(matrix) == 0:
+        return None, None
+    route = _matrix_nearest_neighbor(matrix, return_to_start)
+    route = improve_route(route, matrix)
+    return route, round(tour_length(route, matrix), 2)
@@ -0,0 +1,150 @@
+import numpy as np
+
+from local_search import improve_route, two_opt
+
+
+def stop_key(location):
+    name, (lat, lon) = location
+    return name, round(float(lat), 9), round(float(lon), 9)
+
+
+def match_stops(previous_locations, locations):
+    """Map old stop indices to new ones by (name, coordinates).
+
+    Returns (old_to_new, added): old_to_new[i] is the new index of old stop
+    i or None if it was removed; ``added`` lists new indices with no old
+    counterpart. Repeated stops are matched one to one in order.
+    """
+    free = {}
+    for j, location in enumerate(locations):
+        free.setdefault(stop_key(location), []).append(j)
+    old_to_new = []
+    for location in previous_locations:
+        matches = free.get(stop_key(location))
+        old_to_new.append(matches.pop(0) if matches else None)
+    kept = {j for j in old_to_new if j is not None}
+    added = [j for j in range(len(locations)) if j not in kept]
+    return old_to_new, added
+
+
+def insertion_cost(route, node, distance_matrix, open_end=False):
+    # (extra km, position) of the cheapest place to put ``node`` in ``route``
+    matrix = np.asarray(distance_matrix)
+    # int64 even when empty: a one-stop route has no legs, not float indices
+    a = np.asarray(route[:-1], dtype=np.int64)
+    b = np.asarray(route[1:], dtype=np.int64)
+    deltas = matrix[a, node] + matrix[node, b] - matrix[a, b]
+    best = int(deltas.argmin()) if len(deltas) else -1
+    cost = float(deltas[best]) if len(deltas) else np.inf
+    if open_end and matrix[route[-1], node] < cost:
+        return float(matrix[route[-1], node]), len(route)
+    return cost, best + 1
+
+
+def cheapest_insertion(route, nodes, distance_matrix):
+    # closed routes ([s, ..., s]) only insert between stops; open ones may
+    # also append at the end
+    route = list(route)
+    open_end = len(route) < 2 or route[0] != route[-1]
+    for node in nodes:
+        if not route:
+            route = [node]
+            continue
+        _, position = insertion_cost(route, node, distance_matrix, open_end)
+        route.insert(position, node)
+    return route
+
+
+def repair_route(previous_route, old_to_new, added, distance_matrix, start=0):
+    """Carry a tour over to a new stop list.
+
+    Removed stops are dropped, the rest are renumbered, new stops go in by
+    cheapest insertion, and the tour is rotated to begin at ``start``.
+    """
+    closed = len(previous_route) > 1 and previous_route[0] == previous_route[-1]
+    body = previous_route[:-1] if closed else previous_route
+    route = [old_to_new[i] for i in body if old_to_new[i] is not None]
+
+    if not route and added:
+        route = [start if start in added else added[0]]
+        added = [j for j in added if j != route[0]]
+
+    if closed:
+        route = cheapest_insertion(route + route[:1], added, distance_matrix)[:-1]
+        if start in route:
+            i = route.index(start)
+            route = route[i:] + route[:i]
+        return route + route[:1]
+
+    route = cheapest_insertion(route, added, distance_matrix)
+    if route and route[0] != start:
+        route.remove(start)
+        route.insert(0, start)
+    return route
+
+
+def reoptimize_route(previous_locations, previous_route, locations, distance_matrix, start=0,
+                     method=None):
+    """New tour for ``locations`` starting from the tour solved before.
+
+    Only the repaired neighbourhood is searched, so a one-stop edit costs a
+    few milliseconds rather than a full solve. ``method="2-opt"`` keeps
+    that search to 2-opt moves; otherwise the full improve_route engine runs.
+    """
+    old_to_new, added = match_stops(previous_locations, locations)
+    route = repair_route(previous_route, old_to_new, added, distance_matrix, start)
+    if len(route) < 2:
+        return route
+    # stops whose neighbours changed: the new ones and those next to a gap
+    touched = set(added)
+    body = previous_route[:-1] if previous_route[0] == previous_route[-1] else previous_route
+    for i, old in enumerate(body):
+        if old_to_new[old] is None:
+            for side in (body[i - 1], body[(i + 1) % len(body)]):
+                if old_to_new[side] is not None:
+                    touched.add(old_to_new[side])
+    touched.add(start)
+    improve = two_opt if method == "2-opt" else improve_route
+    return improve(route, distance_matrix, focus=sorted(touched))
+
+
+def repair_routes(previous_routes, old_to_new, added, distance_matrix, demands,
+                  vehicle_capacity, num_vehicles, depot):
+    """Vehicle routes ([depot, ..., depot]) carried over to a new stop list.
+
+    New stops go to the cheapest position with spare capacity and missing
+    vehicles start empty. Returns None when a stop fits nowhere or there
+    are fewer vehicles than non-empty routes, so callers can cold start.
+    """
+    routes = []
+    for route in previous_routes:
+        body = [old_to_new[i] for i in route[1:-1] if old_to_new[i] is not None]
+        body = [j for j in body if j != depot]
+        if body:
+            routes.append([depot] + body + [depot])
+    if len(routes) > num_vehicles:
+        return None
+    routes += [[depot, depot] for _ in range(num_vehicles - len(routes))]
+    loads = [sum(demands[j] for j in route[1:-1]) for route in routes]
+
+    # a moved depot leaves the old one behind as an ordinary stop
+    old_depot = old_to_new[previous_routes[0][0]] if previous_routes else None
+    if old_depot is not None and old_depot != depot:
+        added = list(added) + [old_depot]
+
+    for node in added:
+        if node == depot:
+            continue
+        best = None
+        for r, route in enumerate(routes):
+            if loads[r] + demands[node] > vehicle_capacity:
+                continue
+            cost, position = insertion_cost(route, node, distance_matrix)
+            if best is None or cost < best[0]:
+                best = (cost, r, position)
+        if best is None:
+            return None
+        _, r, position = best
+        routes[r].insert(position, node)
+        loads[r] += demands[node]
+    return routes